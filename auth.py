@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 import bcrypt  # <--- Biblioteca nativa
+import hashlib
 import os
 
 # Segredo para assinar os tokens
@@ -48,4 +49,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+# --- SESSÃO DO ADMIN (ACCESS CURTO + REFRESH EM COOKIE) ---
+ADMIN_ACCESS_TOKEN_MINUTES = 15
+ADMIN_REFRESH_TOKEN_DAYS = 7
+
+def password_fingerprint(hashed_password):
+    """Pedaço do hash da senha gravado no refresh token: trocou a senha, o refresh morre."""
+    return hashlib.sha256((hashed_password or "").encode('utf-8')).hexdigest()[:16]
+
+def create_refresh_token(email: str, hashed_password: str):
+    return create_access_token(
+        data={"sub": email, "typ": "refresh", "pwd": password_fingerprint(hashed_password)},
+        expires_delta=timedelta(days=ADMIN_REFRESH_TOKEN_DAYS),
+    )
@@ -0,0 +1,13 @@
+import sys
+from services.order_items import backfill_order_items
+
+# Extrai os itens de todos os pedidos para a tabela order_items (services/order_items.py).
+# Uso:
+#   python backfill_order_items.py          -> todas as lojas
+#   python backfill_order_items.py 3        -> só a loja 3
+# Enquanto uma loja não passar por aqui, os relatórios continuam lendo o items_json.
+
+if __name__ == "__main__":
+    store_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print("🚀 Extraindo itens dos pedidos...")
+    backfill_order_items(store_id)
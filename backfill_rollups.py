@@ -0,0 +1,13 @@
+import sys
+from services.sales_rollup import backfill_rollups
+
+# Refaz os resumos de vendas (services/sales_rollup.py) a partir dos pedidos.
+# Uso:
+#   python backfill_rollups.py          -> todas as lojas
+#   python backfill_rollups.py 3        -> só a loja 3
+# Enquanto uma loja não passar por aqui, o dashboard continua lendo os pedidos.
+
+if __name__ == "__main__":
+    store_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print("🚀 Consolidando resumos de vendas...")
+    backfill_rollups(store_id)
@@ -1,32 +1,28 @@
-from database import engine
-from sqlalchemy import text
+import sys
+from services.db_indexes import build_indexes, check_hot_queries, INDEX_VERSION
+
+# Índices declarados em models.py (__table_args__), criados com CONCURRENTLY.
+# Uso:
+#   python create_indexes.py           -> cria/repara os índices
+#   python create_indexes.py --check   -> EXPLAIN nas consultas quentes (sai com erro se houver Seq Scan)
 
 def create_indexes():
-    print("🚀 Otimizando Banco de Dados (Modo Blindado)...")
-    
-    # Lista de índices vitais com comando "IF NOT EXISTS" para não dar erro
-    commands = [
-        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);",
-        "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);",
-        "CREATE INDEX IF NOT EXISTS idx_orders_store_status ON orders (store_id, status);",
-        "CREATE INDEX IF NOT EXISTS idx_orders_customer_phone ON orders (customer_phone);"
-    ]
+    print(f"🚀 Otimizando Banco de Dados (índices versão {INDEX_VERSION})...")
+    result = build_indexes()
+    return 1 if result["errors"] else 0
+
 
-    with engine.connect() as conn:
-        # Habilita o autocommit para que cada comando seja independente
-        # Isso impede que um erro trave a transação inteira
-        conn.execution_options(isolation_level="AUTOCOMMIT")
-        
-        for sql in commands:
-            try:
-                print(f"🔧 Executando: {sql}")
-                conn.execute(text(sql))
-                print("   ✅ Sucesso.")
-            except Exception as e:
-                # Se der erro, mostra mas continua para o próximo
-                print(f"   ⚠️ Aviso (Pode ignorar se já existir): {e}")
+def check_indexes():
+    print("🔎 Conferindo planos das consultas quentes...")
+    failures = check_hot_queries()
+    if failures:
+        print(f"❌ {len(failures)} consulta(s) sem índice: {', '.join(failures)}")
+        return 1
+    print("✅ Todas as consultas quentes usam índice.")
+    return 0
 
-    print("🏁 Otimização concluída! O sistema deve voar agora.")
 
 if __name__ == "__main__":
-    create_indexes()
\ No newline at end of file
+    if "--check" in sys.argv:
+        sys.exit(check_indexes())
+    sys.exit(create_indexes())
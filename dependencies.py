@@ -1,20 +1,44 @@
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, APIKeyCookie
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from database import get_db
-from models import User, Order, Store
-from auth import verify_password, SECRET_KEY, ALGORITHM
+from models import Order, Store
+from auth import (
+    SECRET_KEY, ALGORITHM, create_access_token, create_refresh_token,
+    password_fingerprint, ADMIN_ACCESS_TOKEN_MINUTES, ADMIN_REFRESH_TOKEN_DAYS
+)
+from services.catalog import invalidate_catalog
+from services.principal_cache import authenticate_basic, get_user_by_email, password_hash_of
 from jose import JWTError, jwt
+from typing import Optional
+import urllib.parse
 import pytz
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 
 # Configurações globais que vamos centralizar aqui
 security = HTTPBasic()
+optional_basic = HTTPBasic(auto_error=False)  # Basic só como alternativa (não abre o popup)
+
+# Basic Auth no admin continua aceito (scripts/integrações), mas pode ser desligado
+ADMIN_BASIC_FALLBACK = os.getenv("ADMIN_BASIC_FALLBACK", "true").lower() != "false"
+REFRESH_COOKIE = "refresh_token"
 templates = Jinja2Templates(directory="templates")
 
 
+def catalog_write_guard(request: Request):
+    """
+    Dependência de router (menu.py / inventory.py): qualquer escrita nesses
+    routers invalida o snapshot do catálogo usado pelo motor de estoque.
+    Roda depois do endpoint, ou seja, depois do commit.
+    """
+    yield
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        invalidate_catalog()
+
+
 def get_mixed_current_user(
     request: Request, 
     db: Session = Depends(get_db)
@@ -31,24 +55,29 @@ def get_mixed_current_user(
             if "Bearer " in token: token = token.split(" ")[1]
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             email = payload.get("sub")
-            user = db.query(User).filter(User.email == email).first()
+            user = get_user_by_email(db, email)
             if user:
                 return user
         except:
             pass # Se falhar o cookie, tenta o próximo método
 
-    # 2. Se não tem cookie válido, tenta Basic Auth (Usado pelo Admin no PC)
+    # 1b. Access do admin venceu: renova pelo refresh token (cookie)
+    user = refresh_admin_session(request, db)
+    if user:
+        return user
+
+    # 2. Se não tem cookie válido, tenta Basic Auth (alternativa do Admin)
     # Verificamos o header manualmente para não forçar o popup do navegador
     auth_header = request.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Basic "):
+    if ADMIN_BASIC_FALLBACK and auth_header and auth_header.startswith("Basic "):
         try:
             import base64
             encoded = auth_header.split(" ")[1]
             decoded = base64.b64decode(encoded).decode("utf-8")
             username, password = decoded.split(":")
             
-            user = db.query(User).filter(User.email == username).first()
-            if user and verify_password(password, user.hashed_password):
+            user = authenticate_basic(db, username, password)
+            if user:
                 return user
         except:
             pass
@@ -68,24 +97,126 @@ def format_brazil_time(dt):
 templates.env.filters["brazil_time"] = format_brazil_time
 
 
-# --- AUTENTICAÇÃO VIA BANCO DE DADOS ---
-def check_db_auth(credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)):
-    """Verifica usuário/senha no banco de dados e retorna o Objeto User"""
-    user = db.query(User).filter(User.email == credentials.username).first()
-    
-    if not user or not verify_password(credentials.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Email ou senha incorretos",
-            headers={"WWW-Authenticate": "Basic"},
+# --- SESSÃO DO ADMIN (TOKEN EM COOKIE) ---
+# O login (/admin/login) troca email/senha UMA vez por um access token curto
+# (cookie access_token) e um refresh token (cookie refresh_token, httponly).
+# Cada requisição do admin passa a ser: conferir a assinatura do JWT + papel do
+# usuário (cache em services/principal_cache.py). Sem bcrypt por polling.
+# Access vencido + refresh válido = novo access emitido na própria requisição.
+# A dependência não grava o cookie (o Response injetado é descartado quando a rota
+# devolve TemplateResponse/JSONResponse/RedirectResponse): guarda o token em
+# request.state e o middleware admin_session_cookie (main.py) grava na resposta final.
+
+def _decode_token(token):
+    if not token: return None
+    if token.startswith("Bearer "): token = token.split(" ")[1]
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
+def _admin_access_token(user):
+    return create_access_token(
+        data={"sub": user.email, "typ": "access"},
+        expires_delta=timedelta(minutes=ADMIN_ACCESS_TOKEN_MINUTES),
+    )
+
+
+def _set_access_cookie(response: Response, access_token):
+    response.set_cookie(
+        key="access_token", value=f"Bearer {access_token}", httponly=True,
+        max_age=ADMIN_ACCESS_TOKEN_MINUTES * 60, path="/", samesite="lax"
+    )
+
+
+def set_admin_session(response: Response, user, hashed_password, refresh: bool = True):
+    """Grava os cookies de sessão do admin (login). refresh=False só renova o access token."""
+    _set_access_cookie(response, _admin_access_token(user))
+    if refresh:
+        response.set_cookie(
+            key=REFRESH_COOKIE, value=create_refresh_token(user.email, hashed_password), httponly=True,
+            max_age=ADMIN_REFRESH_TOKEN_DAYS * 86400, path="/", samesite="lax"
         )
+
+
+def clear_admin_session(response: Response):
+    response.delete_cookie("access_token", path="/")
+    response.delete_cookie(REFRESH_COOKIE, path="/")
+
+
+def refresh_admin_session(request: Request, db: Session):
+    """
+    Usa o refresh token do cookie para emitir um access novo. Retorna o User ou None.
+    O token novo fica em request.state (gravado na resposta por apply_refreshed_session).
+    """
+    payload = _decode_token(request.cookies.get(REFRESH_COOKIE))
+    if not payload or payload.get("typ") != "refresh": return None
+    user = get_user_by_email(db, payload.get("sub"))
+    if not user: return None
+    if payload.get("pwd") != password_fingerprint(password_hash_of(user)): return None  # Senha trocada
+    request.state.refreshed_access_token = _admin_access_token(user)
     return user
 
 
+def apply_refreshed_session(request: Request, response: Response):
+    """Grava na resposta final o access renovado nesta requisição (se houve)."""
+    access_token = getattr(request.state, "refreshed_access_token", None)
+    if access_token: _set_access_cookie(response, access_token)
+    return response
+
+
+def get_session_user(request: Request, db: Session):
+    """Usuário do cookie de sessão (access, ou refresh se o access venceu) ou None."""
+    payload = _decode_token(request.cookies.get("access_token"))
+    if payload and payload.get("typ") != "refresh":
+        user = get_user_by_email(db, payload.get("sub"))
+        if user: return user
+    return refresh_admin_session(request, db)
+
+
+def _login_required(request: Request):
+    # Navegação normal do navegador vai para a tela de login; XHR/API recebem 401
+    if request.method == "GET" and "text/html" in request.headers.get("accept", ""):
+        target = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        raise HTTPException(
+            status_code=status.HTTP_303_SEE_OTHER,
+            headers={"Location": f"/admin/login?next={urllib.parse.quote(target)}"},
+        )
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Não autenticado")
+
+
+# --- AUTENTICAÇÃO DO ADMIN ---
+def check_db_auth(
+    request: Request,
+    credentials: Optional[HTTPBasicCredentials] = Depends(optional_basic),
+    db: Session = Depends(get_db)
+):
+    """Retorna o Objeto User da sessão (cookie). HTTP Basic fica como alternativa (bcrypt cacheado)."""
+    user = get_session_user(request, db)
+    if user: return user
+
+    if credentials and ADMIN_BASIC_FALLBACK:
+        user = authenticate_basic(db, credentials.username, credentials.password)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Email ou senha incorretos",
+                headers={"WWW-Authenticate": "Basic"},
+            )
+        return user
+
+    _login_required(request)
+
+
 # --- VERIFICADOR DE PERMISSÕES ---
 def check_role(allowed_roles: list):
-    def role_checker(credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)):
-        user = check_db_auth(credentials, db)
+    def role_checker(
+        request: Request,
+        credentials: Optional[HTTPBasicCredentials] = Depends(optional_basic),
+        db: Session = Depends(get_db)
+    ):
+        user = check_db_auth(request, credentials, db)
         if user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -136,7 +267,7 @@ def get_current_driver(request: Request, db: Session = Depends(get_db)):
     except JWTError:
         return None
     
-    user = db.query(User).filter(User.email == email).first()
+    user = get_user_by_email(db, email)
     if not user or user.role != 'driver':
         return None
         
@@ -155,7 +286,7 @@ def get_current_waiter(request: Request, db: Session = Depends(get_db)):
     except JWTError: return None
     
     # Permite Owner, Manager e Viewer (Caixa/Garçom)
-    user = db.query(User).filter(User.email == email).first()
+    user = get_user_by_email(db, email)
     if not user or user.role not in ['owner', 'manager', 'viewer', 'waiter']:
         return None
     return user
\ No newline at end of file
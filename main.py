@@ -25,6 +25,7 @@ from pydantic import BaseModel
 from sqlalchemy import desc, func, or_, cast, String, not_
 from sqlalchemy.orm import Session
 from services.sockets import manager
+from services.order_events import order_delta_messages, broadcast_deltas
 
 # Importa o adaptador e o processador
 from services.integrations.wabiz import WabizAdapter
@@ -32,7 +33,7 @@ from services.background_jobs import process_standard_order, get_active_adapters
 
 
 # --- Imports Locais ---
-from database import Base, engine, get_db, SessionLocal
+from database import engine, get_db, SessionLocal
 from auth import (
     verify_password,
     get_password_hash,
@@ -62,6 +63,7 @@ from dependencies import (
     get_today_stats,
     get_current_driver,
     get_current_waiter,
+    apply_refreshed_session,
 )
 
 # Importa os jobs de background do novo arquivo
@@ -94,8 +96,7 @@ from jose import JWTError, jwt
 
 load_dotenv()
 
-# Cria tabelas se não existirem
-Base.metadata.create_all(bind=engine)
+# Tabelas/colunas: o deploy roda `python migrate.py upgrade` (migrations/). A API não faz DDL.
 
 app = FastAPI(title="ALIV Growth Platform")
 
@@ -117,6 +118,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# --- SESSÃO DO ADMIN: grava o access renovado pelo refresh (ver dependencies.py) ---
+@app.middleware("http")
+async def admin_session_cookie(request: Request, call_next):
+    response = await call_next(request)
+    return apply_refreshed_session(request, response)
+
 app.include_router(kds.router)
 app.include_router(auth.router)  # <--- NOVO
 app.include_router(orders.router)
@@ -176,8 +184,8 @@ def dashboard_view(
     else:
         start_date_br = now_br.replace(tzinfo=None) - timedelta(days=30)
         
-    # Força hora 00:00 BRT
-    start_dt_br = tz_br.localize(start_date_br.replace(hour=0, minute=0, second=0))
+    # Força hora 00:00 BRT (sem microssegundos: o padrão vem do now() e o resumo exige hora cheia)
+    start_dt_br = tz_br.localize(start_date_br.replace(hour=0, minute=0, second=0, microsecond=0))
 
     if end:
         try:
@@ -192,7 +200,7 @@ def dashboard_view(
 
     # Auto-correção de inversão
     if start_dt_br > end_dt_br:
-        start_dt_br, end_dt_br = end_dt_br.replace(hour=0, minute=0), start_dt_br.replace(hour=23, minute=59)
+        start_dt_br, end_dt_br = end_dt_br.replace(hour=0, minute=0, second=0, microsecond=0), start_dt_br.replace(hour=23, minute=59, second=59)
 
     # 3. CONVERSÃO PARA UTC (AQUI ESTÁ A CORREÇÃO DOS RELATÓRIOS)
     # Transformamos "00:00 Brasil" em "03:00 UTC" para o banco entender certo
@@ -502,6 +510,26 @@ def start_scheduler():
     
     print("🚀 [API] Servidor iniciado (Modo Web - Sem Robôs).")
 
+    # Só avisa: quem migra é o deploy (python migrate.py upgrade)
+    try:
+        from migrations.runner import pending_migrations
+        pending = pending_migrations()
+        if pending:
+            print(f"⚠️ [API] {len(pending)} migração(ões) pendente(s): {', '.join(m.VERSION for m in pending)}. Rode: python migrate.py upgrade")
+    except Exception as e:
+        print(f"⚠️ [API] Não foi possível conferir as migrações: {e}")
+
+
+@app.on_event("startup")
+async def start_event_bus():
+    # Cada worker escuta o canal Redis e repassa para os websockets que ele atende
+    manager.start_listener()
+
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await manager.stop_listener()
+
 
 # ==========================================
 #           GESTÃO DE LOJAS (SaaS)
@@ -1541,7 +1569,7 @@ async def complete_delivery(
         order.status = "ENTREGUE"
         db.commit()
 
-        await manager.broadcast(order.store_id, "update")
+        await broadcast_deltas(order_delta_messages([order], "order_status"))
 
         return {"success": True}
     return JSONResponse(status_code=400, content={"message": "Erro ao finalizar"})
@@ -1645,34 +1673,78 @@ def waiter_app_view(request: Request, current_user: User = Depends(get_current_w
     )
 
 
-@app.get("/admin/maintenance/add-columns-v2")
-def add_columns_v2():
-    from sqlalchemy import text
+# --- SETOR DE PRODUÇÃO NOS ITENS DOS PEDIDOS EM ABERTO ---
+@app.post("/admin/maintenance/backfill-item-sectors")
+def backfill_item_sectors_route(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(check_role(["owner", "manager"]))
+):
+    """Pedidos abertos gravados antes do roteamento na entrada (o KDS volta a só comparar o setor)."""
+    from services.sector_routing import backfill_item_sectors
+    try:
+        changed = backfill_item_sectors(db, current_user.store_id)
+        return {"success": True, "orders_updated": changed}
+    except Exception as e:
+        db.rollback()
+        return {"success": False, "message": str(e)}
+
+
+# --- RESUMOS DE VENDAS (DASHBOARD / RELATÓRIOS) ---
+@app.post("/admin/maintenance/backfill-rollups")
+def backfill_rollups_route(current_user: User = Depends(check_role(["owner"]))):
+    """Consolida o histórico da loja nos resumos (services/sales_rollup.py). Também: python backfill_rollups.py"""
+    from services.sales_rollup import backfill_rollups
+    try:
+        days = backfill_rollups(current_user.store_id)
+        return {"success": True, "days_rebuilt": days}
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
 
+# --- ITENS VENDIDOS (TABELA order_items) ---
+@app.post("/admin/maintenance/backfill-order-items")
+def backfill_order_items_route(current_user: User = Depends(check_role(["owner"]))):
+    """Extrai os itens dos pedidos antigos da loja (services/order_items.py). Também: python backfill_order_items.py"""
+    from services.order_items import backfill_order_items
+    try:
+        orders = backfill_order_items(current_user.store_id)
+        return {"success": True, "orders_processed": orders}
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
+
+# --- MÉTRICAS DOS WEBSOCKETS (DESTE WORKER) ---
+@app.get("/admin/system/ws-metrics")
+def websocket_metrics(current_user: User = Depends(check_role(["owner", "manager"]))):
+    data = manager.get_metrics()
+    if current_user.role != "owner":
+        data = {k: v for k, v in data.items() if k == current_user.store_id}
+    return {"pid": os.getpid(), "stores": data}
+
+
+# --- REPARO DOS CONTADORES DO PAINEL (pizzas/plataformas/badges) ---
+@app.post("/admin/system/rebuild-board-stats")
+def rebuild_board_stats_route(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(check_role(["owner", "manager"]))
+):
+    from services.board_stats import rebuild_board_stats, stats_payload
+    stats = rebuild_board_stats(db, current_user.store_id)
+    prod_stats, platform_stats, counts = stats_payload(stats)
+    return {"success": True, "product_stats": prod_stats, "platform_stats": platform_stats, "counts": counts}
+
+
+# --- CHECAGEM DOS ÍNDICES (EXPLAIN NAS CONSULTAS QUENTES) ---
+@app.get("/admin/system/index-check")
+def index_check(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(check_role(["owner"]))
+):
+    from services.db_indexes import check_hot_queries, applied_version, INDEX_VERSION
+    failures = check_hot_queries(current_user.store_id)
     with engine.connect() as conn:
-        try:
-            conn.execute(
-                text(
-                    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS driver_tip FLOAT DEFAULT 0.0;"
-                )
-            )
-            conn.execute(
-                text(
-                    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_credit FLOAT DEFAULT 0.0;"
-                )
-            )
-            conn.execute(
-                text(
-                    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_fee FLOAT DEFAULT 0.0;"
-                )
-            )
-            conn.commit()
-            return {
-                "status": "success",
-                "message": "Colunas adicionadas (Tip, Credit, Fee).",
-            }
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+        version = applied_version(conn)
+    return {"success": not failures, "seq_scans": failures, "index_version": version, "code_version": INDEX_VERSION}
 
 
 # --- ROTA DE MANUTENÇÃO DO SISTEMA (BOTÃO OTIMIZAR) ---
@@ -1688,19 +1760,16 @@ def optimize_system(
     log_msgs = []
 
     try:
-        # 1. Cria Índices (Garante estrutura)
-        commands = [
-            "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);",
-            "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);",
-            "CREATE INDEX IF NOT EXISTS idx_orders_store_status ON orders (store_id, status);",
-            "CREATE INDEX IF NOT EXISTS idx_orders_customer_phone ON orders (customer_phone);"
-        ]
+        # 1. Cria Índices (declarados em models.py; CONCURRENTLY, sem travar os pedidos)
+        from services.db_indexes import build_indexes
+        index_result = build_indexes()
+        log_msgs.append(f"Índices: {len(index_result['created'])} criados, {len(index_result['rebuilt'])} refeitos (versão {index_result['version']}).")
+        for err in index_result["errors"]:
+            log_msgs.append(f"⚠️ {err}")
         
         # Usa conexão direta para comandos DDL
         with engine.connect() as conn:
             conn.execution_options(isolation_level="AUTOCOMMIT")
-            for sql in commands:
-                conn.execute(text(sql))
             
             # 2. Otimização Profunda (Vacuum Analyze)
             # Isso limpa "espaços mortos" no banco e atualiza estatísticas de velocidade
@@ -0,0 +1,28 @@
+import sys
+from migrations.runner import upgrade, pending_migrations, load_migrations, offline_sql
+
+# Migrações versionadas (migrations/versions). Uso:
+#   python migrate.py upgrade [versão]  -> aplica as pendentes (até a versão, se informada)
+#   python migrate.py status            -> lista aplicadas/pendentes (sai com erro se houver pendente)
+#   python migrate.py sql               -> imprime o SQL sem conectar no banco
+
+def status():
+    pending = {m.VERSION for m in pending_migrations()}
+    for migration in load_migrations():
+        mark = "⏳" if migration.VERSION in pending else "✅"
+        print(f"{mark} {migration.VERSION} - {getattr(migration, 'DESCRIPTION', '')}")
+    return 1 if pending else 0
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "status":
+        sys.exit(status())
+    if command == "sql":
+        print(offline_sql())
+        sys.exit(0)
+    if command == "upgrade":
+        upgrade(sys.argv[2] if len(sys.argv) > 2 else None)
+        sys.exit(0)
+    print("Uso: python migrate.py [upgrade [versão] | status | sql]")
+    sys.exit(2)
@@ -0,0 +1,136 @@
+# Arquivo: pizzaria/migrations/runner.py
+import importlib
+import os
+import pkgutil
+import textwrap
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from database import engine
+
+# ==========================================
+#       MIGRAÇÕES VERSIONADAS DO BANCO
+# ==========================================
+# Substitui o Base.metadata.create_all() que rodava no import do main.py (em TODO
+# worker, a cada boot) e as rotas /admin/maintenance/add-columns-*.
+# A API não faz mais DDL: o deploy roda `python migrate.py upgrade` ANTES de subir
+# os workers (e pode rodar com a API no ar).
+#
+# Cada migração é um módulo em migrations/versions/ (vNNNN_nome.py) com:
+#   VERSION = "0004"            DESCRIPTION = "..."
+#   TRANSACTIONAL = True         (False para CREATE INDEX CONCURRENTLY)
+#   def statements(dialect): -> lista de SQL   (permite gerar o SQL offline: migrate.py sql)
+#   ou def run(conn):                          (só para migração de DADOS, nunca DDL)
+# O SQL de cada versão é CONGELADO (texto literal): nada de create_all/CreateTable
+# sobre o models.py atual, senão uma versão antiga passa a criar colunas de hoje e o
+# `migrate.py sql` não consegue mostrar o que ela faz.
+# As versões aplicadas ficam em schema_migrations. Um advisory lock impede dois
+# deploys migrando ao mesmo tempo.
+
+MIGRATIONS_TABLE = "schema_migrations"
+_LOCK_KEY = 81120001  # pg_advisory_lock (qualquer número fixo do projeto)
+
+
+def load_migrations():
+    """Módulos de migrations/versions em ordem de versão."""
+    import migrations.versions as pkg
+    found = []
+    for info in pkgutil.iter_modules([os.path.dirname(pkg.__file__)]):
+        if not info.name.startswith("v"): continue
+        module = importlib.import_module(f"migrations.versions.{info.name}")
+        found.append(module)
+    found.sort(key=lambda m: m.VERSION)
+    versions = [m.VERSION for m in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Versões de migração duplicadas: {versions}")
+    return found
+
+
+_CREATE_TABLE_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+    " version VARCHAR(32) PRIMARY KEY,"
+    " description TEXT,"
+    " applied_at TIMESTAMP DEFAULT now())"
+)
+
+
+def _ensure_table(conn):
+    conn.execute(text(_CREATE_TABLE_SQL))
+
+
+def applied_versions(conn) -> set:
+    """Versões já aplicadas (vazio se a tabela ainda não existe). Só leitura."""
+    exists = conn.execute(text("SELECT to_regclass(:t)"), {"t": MIGRATIONS_TABLE}).scalar()
+    if not exists: return set()
+    return {row[0] for row in conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+
+def pending_migrations(conn=None):
+    if conn is None:
+        with engine.connect() as c:
+            return pending_migrations(c)
+    done = applied_versions(conn)
+    return [m for m in load_migrations() if m.VERSION not in done]
+
+
+def _apply(conn, migration):
+    if hasattr(migration, "run"):
+        migration.run(conn)
+    else:
+        for sql in migration.statements(conn.dialect):
+            conn.execute(text(sql))
+    conn.execute(
+        text(f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (:v, :d)"),
+        {"v": migration.VERSION, "d": getattr(migration, "DESCRIPTION", "")},
+    )
+
+
+def upgrade(target: str = None, log=print) -> list:
+    """Aplica as pendentes (até `target`, se informado). Retorna as versões aplicadas."""
+    applied = []
+    # Conexão só do lock (fica segurando enquanto as migrações rodam em conexões próprias)
+    with engine.connect() as lock_conn:
+        lock_conn = lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _LOCK_KEY})
+        try:
+            _ensure_table(lock_conn)
+            done = applied_versions(lock_conn)
+            for migration in load_migrations():
+                if migration.VERSION in done: continue
+                if target and migration.VERSION > target: break
+
+                log(f"🔧 [Migração] {migration.VERSION} - {getattr(migration, 'DESCRIPTION', '')}")
+                if getattr(migration, "TRANSACTIONAL", True):
+                    with engine.begin() as conn:
+                        _apply(conn, migration)
+                else:
+                    # CONCURRENTLY não roda dentro de transação: cada comando se confirma sozinho
+                    with engine.connect() as conn:
+                        _apply(conn.execution_options(isolation_level="AUTOCOMMIT"), migration)
+                applied.append(migration.VERSION)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+
+    log(f"🏁 [Migração] {len(applied)} aplicada(s)." if applied else "✅ [Migração] Banco já está em dia.")
+    return applied
+
+
+def offline_sql(dialect=None) -> str:
+    """SQL de todas as migrações (sem conectar no banco), para revisar ou rodar na mão."""
+    dialect = dialect or postgresql.dialect()
+    out = [_CREATE_TABLE_SQL + ";", ""]
+    for migration in load_migrations():
+        out.append(f"-- {migration.VERSION}: {getattr(migration, 'DESCRIPTION', '')}")
+        if not getattr(migration, "TRANSACTIONAL", True):
+            out.append("-- (fora de transação)")
+        if hasattr(migration, "statements"):
+            out += [textwrap.dedent(sql).strip().rstrip(";") + ";" for sql in migration.statements(dialect)]
+        else:
+            out.append("-- migração em Python (rode: python migrate.py upgrade)")
+        description = getattr(migration, "DESCRIPTION", "").replace("'", "''")
+        out.append(
+            f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES "
+            f"('{migration.VERSION}', '{description}');"
+        )
+        out.append("")
+    return "\n".join(out)
@@ -0,0 +1,617 @@
+# Tabelas do models.py de antes das migrações (o antigo create_all do boot),
+# congeladas em SQL: o models.py de hoje não muda o que esta versão faz.
+# Em banco já existente só cria o que faltar (IF NOT EXISTS). Colunas e tabelas
+# que vieram depois ficam nas versões seguintes; os índices idx_ ficam com a 0004.
+VERSION = "0001"
+DESCRIPTION = "baseline: tabelas do models.py (IF NOT EXISTS)"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS stores (
+        id SERIAL NOT NULL,
+        name VARCHAR,
+        slug VARCHAR,
+        fb_pixel_id VARCHAR,
+        fb_access_token VARCHAR,
+        ga4_measurement_id VARCHAR,
+        ga4_api_secret VARCHAR,
+        whatsapp_number VARCHAR,
+        whatsapp_api_token VARCHAR,
+        whatsapp_phone_id VARCHAR,
+        crm_schedule_hour INTEGER,
+        is_open BOOLEAN,
+        address_lat VARCHAR,
+        address_lng VARCHAR,
+        address_name VARCHAR,
+        address_text VARCHAR,
+        integration_type VARCHAR,
+        integration_url VARCHAR,
+        integration_user VARCHAR,
+        integration_password VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        integrations_config JSONB,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stores_id ON stores (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_stores_slug ON stores (slug)",
+    """
+    CREATE TABLE IF NOT EXISTS bills (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        description VARCHAR,
+        amount FLOAT,
+        due_date TIMESTAMP WITHOUT TIME ZONE,
+        paid_at TIMESTAMP WITHOUT TIME ZONE,
+        payment_method VARCHAR,
+        invoice_key VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_bills_id ON bills (id)",
+    """
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        trigger_type VARCHAR,
+        days_delay INTEGER,
+        message_template TEXT,
+        meta_template_name VARCHAR,
+        is_active BOOLEAN,
+        scheduled_at TIMESTAMP WITHOUT TIME ZONE,
+        filter_rules JSONB,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_campaigns_id ON campaigns (id)",
+    """
+    CREATE TABLE IF NOT EXISTS customers (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        phone VARCHAR,
+        name VARCHAR,
+        email VARCHAR,
+        birth_date TIMESTAMP WITHOUT TIME ZONE,
+        total_spent FLOAT,
+        order_count INTEGER,
+        last_order_at TIMESTAMP WITHOUT TIME ZONE,
+        rfm_segment VARCHAR,
+        rfm_score VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_customers_id ON customers (id)",
+    "CREATE INDEX IF NOT EXISTS ix_customers_phone ON customers (phone)",
+    """
+    CREATE TABLE IF NOT EXISTS delivery_fees (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        neighborhood VARCHAR,
+        fee FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_delivery_fees_id ON delivery_fees (id)",
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        event_name VARCHAR,
+        event_id VARCHAR,
+        url TEXT,
+        user_agent TEXT,
+        client_ip VARCHAR,
+        user_data JSONB,
+        custom_data JSONB,
+        sent_to_facebook BOOLEAN,
+        sent_to_google BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_events_event_id ON events (event_id)",
+    "CREATE INDEX IF NOT EXISTS ix_events_event_name ON events (event_name)",
+    "CREATE INDEX IF NOT EXISTS ix_events_id ON events (id)",
+    """
+    CREATE TABLE IF NOT EXISTS imported_invoices (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        access_key VARCHAR,
+        imported_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_imported_invoices_access_key ON imported_invoices (access_key)",
+    "CREATE INDEX IF NOT EXISTS ix_imported_invoices_id ON imported_invoices (id)",
+    """
+    CREATE TABLE IF NOT EXISTS insights (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        type VARCHAR,
+        title VARCHAR,
+        message TEXT,
+        action_prompt TEXT,
+        is_archived BOOLEAN,
+        is_read BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_insights_id ON insights (id)",
+    """
+    CREATE TABLE IF NOT EXISTS inventory_categories (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_inventory_categories_id ON inventory_categories (id)",
+    """
+    CREATE TABLE IF NOT EXISTS inventory_units (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_inventory_units_id ON inventory_units (id)",
+    """
+    CREATE TABLE IF NOT EXISTS pending_pixel_events (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        event_id VARCHAR,
+        event_name VARCHAR,
+        payload_json JSONB,
+        status VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_pending_pixel_events_event_id ON pending_pixel_events (event_id)",
+    "CREATE INDEX IF NOT EXISTS ix_pending_pixel_events_id ON pending_pixel_events (id)",
+    """
+    CREATE TABLE IF NOT EXISTS pizza_sizes (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        slug VARCHAR,
+        slices INTEGER,
+        recipe_multiplier FLOAT,
+        max_flavors INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_pizza_sizes_id ON pizza_sizes (id)",
+    """
+    CREATE TABLE IF NOT EXISTS product_addons (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        addon_type VARCHAR,
+        is_active BOOLEAN,
+        valid_categories JSONB,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_addons_id ON product_addons (id)",
+    """
+    CREATE TABLE IF NOT EXISTS production_sectors (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        printer_ip VARCHAR,
+        has_expedition BOOLEAN,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_production_sectors_id ON production_sectors (id)",
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL NOT NULL,
+        email VARCHAR,
+        phone VARCHAR,
+        hashed_password VARCHAR,
+        full_name VARCHAR,
+        store_id INTEGER,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        role VARCHAR,
+        driver_fixed_fee FLOAT,
+        driver_balance FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+    "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+    """
+    CREATE TABLE IF NOT EXISTS addon_prices (
+        id SERIAL NOT NULL,
+        addon_id INTEGER,
+        size_id INTEGER,
+        price FLOAT,
+        external_code VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(addon_id) REFERENCES product_addons (id),
+        FOREIGN KEY(size_id) REFERENCES pizza_sizes (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_addon_prices_id ON addon_prices (id)",
+    """
+    CREATE TABLE IF NOT EXISTS addresses (
+        id SERIAL NOT NULL,
+        customer_id INTEGER,
+        store_id INTEGER,
+        street VARCHAR,
+        number VARCHAR,
+        neighborhood VARCHAR,
+        city VARCHAR,
+        state VARCHAR,
+        zip_code VARCHAR,
+        complement VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        last_used_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY(customer_id) REFERENCES customers (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_addresses_id ON addresses (id)",
+    "CREATE INDEX IF NOT EXISTS ix_addresses_neighborhood ON addresses (neighborhood)",
+    """
+    CREATE TABLE IF NOT EXISTS campaign_logs (
+        id SERIAL NOT NULL,
+        campaign_id INTEGER,
+        customer_phone VARCHAR,
+        customer_name VARCHAR,
+        sent_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        status VARCHAR,
+        message_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(campaign_id) REFERENCES campaigns (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_campaign_logs_customer_phone ON campaign_logs (customer_phone)",
+    "CREATE INDEX IF NOT EXISTS ix_campaign_logs_id ON campaign_logs (id)",
+    """
+    CREATE TABLE IF NOT EXISTS cash_closings (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        user_id INTEGER,
+        opened_at TIMESTAMP WITHOUT TIME ZONE,
+        closed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        total_system FLOAT,
+        total_real FLOAT,
+        difference FLOAT,
+        breakdown_json JSONB,
+        notes TEXT,
+        closer_name VARCHAR,
+        next_opening_amount FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_cash_closings_id ON cash_closings (id)",
+    """
+    CREATE TABLE IF NOT EXISTS cash_openings (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        user_id INTEGER,
+        amount FLOAT,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_cash_openings_id ON cash_openings (id)",
+    """
+    CREATE TABLE IF NOT EXISTS categories (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        order_index INTEGER,
+        is_active BOOLEAN,
+        sector_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(sector_id) REFERENCES production_sectors (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_categories_id ON categories (id)",
+    """
+    CREATE TABLE IF NOT EXISTS ingredients (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        name VARCHAR,
+        category_id INTEGER,
+        unit_id INTEGER,
+        input_unit_id INTEGER,
+        usage_unit_id INTEGER,
+        current_stock FLOAT,
+        min_stock FLOAT,
+        max_stock FLOAT,
+        cost FLOAT,
+        expiration_date TIMESTAMP WITHOUT TIME ZONE,
+        integration_code VARCHAR,
+        is_available_for_sale BOOLEAN,
+        conversion_factor FLOAT,
+        category VARCHAR,
+        unit VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(category_id) REFERENCES inventory_categories (id),
+        FOREIGN KEY(unit_id) REFERENCES inventory_units (id),
+        FOREIGN KEY(input_unit_id) REFERENCES inventory_units (id),
+        FOREIGN KEY(usage_unit_id) REFERENCES inventory_units (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_ingredients_id ON ingredients (id)",
+    "CREATE INDEX IF NOT EXISTS ix_ingredients_integration_code ON ingredients (integration_code)",
+    """
+    CREATE TABLE IF NOT EXISTS addon_recipes (
+        id SERIAL NOT NULL,
+        addon_price_id INTEGER,
+        ingredient_id INTEGER,
+        quantity FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(addon_price_id) REFERENCES addon_prices (id),
+        FOREIGN KEY(ingredient_id) REFERENCES ingredients (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_addon_recipes_id ON addon_recipes (id)",
+    """
+    CREATE TABLE IF NOT EXISTS cash_transactions (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        user_id INTEGER,
+        type VARCHAR,
+        amount FLOAT,
+        description VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        cash_opening_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(cash_opening_id) REFERENCES cash_openings (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_cash_transactions_id ON cash_transactions (id)",
+    """
+    CREATE TABLE IF NOT EXISTS driver_sessions (
+        id SERIAL NOT NULL,
+        driver_id INTEGER,
+        store_id INTEGER,
+        start_time TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        end_time TIMESTAMP WITHOUT TIME ZONE,
+        total_deliveries INTEGER,
+        total_amount_due FLOAT,
+        cash_opening_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(driver_id) REFERENCES users (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(cash_opening_id) REFERENCES cash_openings (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_driver_sessions_id ON driver_sessions (id)",
+    """
+    CREATE TABLE IF NOT EXISTS ingredient_recipes (
+        id SERIAL NOT NULL,
+        parent_ingredient_id INTEGER,
+        child_ingredient_id INTEGER,
+        quantity FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(parent_ingredient_id) REFERENCES ingredients (id),
+        FOREIGN KEY(child_ingredient_id) REFERENCES ingredients (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_ingredient_recipes_id ON ingredient_recipes (id)",
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        wabiz_id VARCHAR,
+        external_id VARCHAR,
+        customer_name VARCHAR,
+        customer_phone VARCHAR,
+        customer_email VARCHAR,
+        address_street VARCHAR,
+        address_number VARCHAR,
+        address_neighborhood VARCHAR,
+        address_city VARCHAR,
+        address_state VARCHAR,
+        address_complement VARCHAR,
+        total_value FLOAT,
+        payment_method VARCHAR,
+        items_json JSONB,
+        sent_to_facebook BOOLEAN,
+        sent_to_google BOOLEAN,
+        sent_thank_you_msg BOOLEAN,
+        sent_nps BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        driver_id INTEGER,
+        status VARCHAR,
+        table_number INTEGER,
+        service_fee FLOAT,
+        discount FLOAT,
+        delivery_type VARCHAR,
+        is_driver_paid BOOLEAN,
+        kds_timer_start TIMESTAMP WITHOUT TIME ZONE,
+        customer_id INTEGER,
+        notes TEXT,
+        cash_opening_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(driver_id) REFERENCES users (id),
+        FOREIGN KEY(customer_id) REFERENCES customers (id),
+        FOREIGN KEY(cash_opening_id) REFERENCES cash_openings (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_orders_external_id ON orders (external_id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_id ON orders (id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_wabiz_id ON orders (wabiz_id)",
+    """
+    CREATE TABLE IF NOT EXISTS pizza_base_recipes (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        size_slug VARCHAR,
+        size_id INTEGER,
+        base_type VARCHAR,
+        ingredient_id INTEGER,
+        quantity FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(size_id) REFERENCES pizza_sizes (id),
+        FOREIGN KEY(ingredient_id) REFERENCES ingredients (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_pizza_base_recipes_id ON pizza_base_recipes (id)",
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        category_id INTEGER,
+        sector_id INTEGER,
+        name VARCHAR,
+        description TEXT,
+        price FLOAT,
+        image_url VARCHAR,
+        is_active BOOLEAN,
+        is_pizza BOOLEAN,
+        allows_flavors BOOLEAN,
+        max_flavors INTEGER,
+        base_type VARCHAR,
+        config JSONB,
+        combo_items JSONB,
+        preparation_method TEXT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(category_id) REFERENCES categories (id),
+        FOREIGN KEY(sector_id) REFERENCES production_sectors (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_id ON products (id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_logs (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        ingredient_id INTEGER,
+        user_name VARCHAR,
+        movement_type VARCHAR,
+        quantity FLOAT,
+        cost_at_time FLOAT,
+        old_stock FLOAT,
+        new_stock FLOAT,
+        reason VARCHAR,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(ingredient_id) REFERENCES ingredients (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stock_logs_id ON stock_logs (id)",
+    """
+    CREATE TABLE IF NOT EXISTS driver_advances (
+        id SERIAL NOT NULL,
+        session_id INTEGER,
+        amount FLOAT,
+        reason VARCHAR,
+        is_paid BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(session_id) REFERENCES driver_sessions (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_driver_advances_id ON driver_advances (id)",
+    # CREATE TYPE não tem IF NOT EXISTS
+    """
+    DO $$ BEGIN
+        CREATE TYPE transaction_type_enum AS ENUM ('vale', 'consumo', 'bonus', 'pagamento');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS employee_transactions (
+        id SERIAL NOT NULL,
+        employee_id INTEGER NOT NULL,
+        admin_id INTEGER NOT NULL,
+        order_id INTEGER,
+        amount FLOAT NOT NULL,
+        transaction_type transaction_type_enum NOT NULL,
+        discount_percentage FLOAT,
+        description VARCHAR(255),
+        created_at TIMESTAMP WITHOUT TIME ZONE,
+        updated_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY(employee_id) REFERENCES users (id),
+        FOREIGN KEY(admin_id) REFERENCES users (id),
+        FOREIGN KEY(order_id) REFERENCES orders (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_employee_transactions_id ON employee_transactions (id)",
+    """
+    CREATE TABLE IF NOT EXISTS product_mappings (
+        id SERIAL NOT NULL,
+        product_id INTEGER,
+        store_id INTEGER,
+        integration_type VARCHAR,
+        external_code VARCHAR,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_store_integration_code UNIQUE (store_id, integration_type, external_code),
+        FOREIGN KEY(product_id) REFERENCES products (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_mappings_external_code ON product_mappings (external_code)",
+    "CREATE INDEX IF NOT EXISTS ix_product_mappings_id ON product_mappings (id)",
+    """
+    CREATE TABLE IF NOT EXISTS product_recipes (
+        id SERIAL NOT NULL,
+        product_id INTEGER,
+        size_id INTEGER,
+        ingredient_id INTEGER,
+        quantity FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(product_id) REFERENCES products (id),
+        FOREIGN KEY(size_id) REFERENCES pizza_sizes (id),
+        FOREIGN KEY(ingredient_id) REFERENCES ingredients (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_recipes_id ON product_recipes (id)",
+    """
+    CREATE TABLE IF NOT EXISTS product_size_prices (
+        id SERIAL NOT NULL,
+        product_id INTEGER,
+        size_id INTEGER,
+        price FLOAT,
+        cost_price FLOAT,
+        is_active BOOLEAN,
+        PRIMARY KEY (id),
+        FOREIGN KEY(product_id) REFERENCES products (id),
+        FOREIGN KEY(size_id) REFERENCES pizza_sizes (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_size_prices_id ON product_size_prices (id)",
+]
+
+
+def statements(dialect):
+    return STATEMENTS
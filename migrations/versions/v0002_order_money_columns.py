@@ -0,0 +1,12 @@
+# Antiga rota /admin/maintenance/add-columns-v2
+VERSION = "0002"
+DESCRIPTION = "orders: driver_tip, customer_credit, delivery_fee"
+TRANSACTIONAL = True
+
+
+def statements(dialect):
+    return [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS driver_tip FLOAT DEFAULT 0.0",
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_credit FLOAT DEFAULT 0.0",
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_fee FLOAT DEFAULT 0.0",
+    ]
@@ -0,0 +1,11 @@
+# Antiga rota /admin/maintenance/add-columns-v3 (itens normalizados, ver services/normalizer.py)
+VERSION = "0003"
+DESCRIPTION = "orders: items_view, items_view_version"
+TRANSACTIONAL = True
+
+
+def statements(dialect):
+    return [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS items_view JSONB",
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS items_view_version INTEGER",
+    ]
@@ -0,0 +1,24 @@
+# Índices das consultas quentes (declarados em models.py), sem travar escrita.
+# SQL congelado: mudou índice no models.py? Nova migração (e suba o INDEX_VERSION).
+VERSION = "0004"
+DESCRIPTION = "índices compostos/parciais das consultas quentes (CONCURRENTLY)"
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_status ON orders (status)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_created_at ON orders (created_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_store_status ON orders (store_id, status)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_customer_phone ON orders (customer_phone)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_store_created ON orders (store_id, created_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_store_external ON orders (store_id, external_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_store_wabiz ON orders (store_id, wabiz_id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_driver_payout ON orders (driver_id, status, cash_opening_id, is_driver_paid)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_store_active ON orders (store_id, status) WHERE status IN ('PENDENTE', 'PREPARO', 'FORNO', 'EXPEDICAO', 'PRONTO_COZINHA', 'PRONTO', 'SAIU_ENTREGA')",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_logs_store_type_created ON stock_logs (store_id, movement_type, created_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_campaign_logs_campaign_phone ON campaign_logs (campaign_id, customer_phone)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pending_pixel_store_event ON pending_pixel_events (store_id, event_id) WHERE status = 'PENDING'",
+]
+
+
+def statements(dialect):
+    return STATEMENTS
@@ -0,0 +1,50 @@
+# Resumos de vendas por dia/hora e por produto/dia (services/sales_rollup.py).
+# SQL congelado (não depende do models.py atual). Depois de aplicar: python backfill_rollups.py
+VERSION = "0005"
+DESCRIPTION = "sales_rollup_hourly, product_rollup_daily, sales_rollup_state"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS product_rollup_daily (
+        id SERIAL NOT NULL,
+        store_id INTEGER NOT NULL,
+        local_date DATE NOT NULL,
+        payment_method VARCHAR NOT NULL,
+        product_name VARCHAR NOT NULL,
+        qty FLOAT,
+        revenue FLOAT,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_product_rollup_day UNIQUE (store_id, local_date, payment_method, product_name),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_rollup_daily_id ON product_rollup_daily (id)",
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_hourly (
+        id SERIAL NOT NULL,
+        store_id INTEGER NOT NULL,
+        local_date DATE NOT NULL,
+        hour INTEGER NOT NULL,
+        payment_method VARCHAR NOT NULL,
+        orders_count INTEGER,
+        revenue FLOAT,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_sales_rollup_hour UNIQUE (store_id, local_date, hour, payment_method),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_sales_rollup_hourly_id ON sales_rollup_hourly (id)",
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_state (
+        store_id INTEGER NOT NULL,
+        backfilled_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (store_id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+]
+
+
+def statements(dialect):
+    return STATEMENTS
@@ -0,0 +1,45 @@
+# Itens vendidos, uma linha por item/sabor/adicional (services/order_items.py).
+# SQL congelado (não depende do models.py atual). Depois de aplicar: python backfill_order_items.py
+VERSION = "0006"
+DESCRIPTION = "order_items, order_items_state"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS order_items_state (
+        store_id INTEGER NOT NULL,
+        backfilled_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (store_id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS order_items (
+        id SERIAL NOT NULL,
+        store_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE,
+        is_cancelled BOOLEAN,
+        item_index INTEGER NOT NULL,
+        parent_index INTEGER,
+        kind VARCHAR,
+        product_id INTEGER,
+        title VARCHAR,
+        name VARCHAR,
+        qty FLOAT,
+        unit_price FLOAT,
+        size VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(order_id) REFERENCES orders (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_order_items_store_created ON order_items (store_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_order_items_store_name ON order_items (store_id, name)",
+    "CREATE INDEX IF NOT EXISTS ix_order_items_id ON order_items (id)",
+]
+
+
+def statements(dialect):
+    return STATEMENTS
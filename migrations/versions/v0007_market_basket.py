@@ -0,0 +1,54 @@
+# Cesta de compras: contagens de produtos/pares/trios e regras de combos (services/market_basket.py).
+# SQL congelado (não depende do models.py atual).
+VERSION = "0007"
+DESCRIPTION = "basket_itemsets, basket_rules, basket_state"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS basket_itemsets (
+        store_id INTEGER NOT NULL,
+        itemset VARCHAR NOT NULL,
+        size INTEGER NOT NULL,
+        count INTEGER,
+        PRIMARY KEY (store_id, itemset),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS basket_rules (
+        id SERIAL NOT NULL,
+        store_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        antecedent JSONB,
+        consequent VARCHAR,
+        itemset_size INTEGER,
+        support_count INTEGER,
+        support FLOAT,
+        confidence FLOAT,
+        lift FLOAT,
+        computed_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_basket_rules_store_rank ON basket_rules (store_id, rank)",
+    "CREATE INDEX IF NOT EXISTS ix_basket_rules_id ON basket_rules (id)",
+    """
+    CREATE TABLE IF NOT EXISTS basket_state (
+        store_id INTEGER NOT NULL,
+        window_days INTEGER,
+        window_start TIMESTAMP WITHOUT TIME ZONE,
+        window_end TIMESTAMP WITHOUT TIME ZONE,
+        basket_count INTEGER,
+        full_rebuild_at TIMESTAMP WITHOUT TIME ZONE,
+        updated_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (store_id),
+        FOREIGN KEY(store_id) REFERENCES stores (id)
+    )
+    """,
+]
+
+
+def statements(dialect):
+    return STATEMENTS
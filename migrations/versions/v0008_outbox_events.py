@@ -0,0 +1,36 @@
+# Outbox transacional dos efeitos colaterais do pedido (services/outbox.py).
+# SQL congelado (não depende do models.py atual).
+VERSION = "0008"
+DESCRIPTION = "outbox_events"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS outbox_events (
+        id SERIAL NOT NULL,
+        store_id INTEGER,
+        order_id INTEGER,
+        event_type VARCHAR,
+        idempotency_key VARCHAR,
+        payload JSONB,
+        status VARCHAR,
+        attempts INTEGER,
+        next_attempt_at TIMESTAMP WITHOUT TIME ZONE,
+        locked_at TIMESTAMP WITHOUT TIME ZONE,
+        last_error TEXT,
+        created_at TIMESTAMP WITHOUT TIME ZONE,
+        processed_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY(store_id) REFERENCES stores (id),
+        FOREIGN KEY(order_id) REFERENCES orders (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_outbox_events_id ON outbox_events (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_outbox_events_idempotency_key ON outbox_events (idempotency_key)",
+    "CREATE INDEX IF NOT EXISTS ix_outbox_events_status ON outbox_events (status)",
+    "CREATE INDEX IF NOT EXISTS ix_outbox_events_store_id ON outbox_events (store_id)",
+]
+
+
+def statements(dialect):
+    return STATEMENTS
@@ -0,0 +1,27 @@
+# Etapa de cada item do pedido no KDS, por setor (services/kds_stages.py).
+# SQL congelado (não depende do models.py atual).
+VERSION = "0009"
+DESCRIPTION = "order_item_stages"
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS order_item_stages (
+        id SERIAL NOT NULL,
+        order_id INTEGER,
+        item_index INTEGER NOT NULL,
+        sector_id INTEGER,
+        stage INTEGER,
+        updated_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        CONSTRAINT uix_order_item_stage UNIQUE (order_id, item_index),
+        FOREIGN KEY(order_id) REFERENCES orders (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_order_item_stages_id ON order_item_stages (id)",
+    "CREATE INDEX IF NOT EXISTS ix_order_item_stages_order_id ON order_item_stages (order_id)",
+]
+
+
+def statements(dialect):
+    return STATEMENTS
@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func, Boolean, Float, ForeignKey, UniqueConstraint, Enum as SqlEnum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, Date, func, Boolean, Float, ForeignKey, UniqueConstraint, Enum as SqlEnum
+from sqlalchemy import Index, text
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, Session
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.dialects.postgresql import JSONB
 from database import Base
 from datetime import datetime, date
 import enum
+import copy
 
 # ==========================================
 #          AUTENTICAÇÃO E LOJAS
@@ -317,6 +322,10 @@ class StockLog(Base):
     store = relationship("Store")
     ingredient = relationship("Ingredient")
 
+    __table_args__ = (
+        Index("idx_stock_logs_store_type_created", "store_id", "movement_type", "created_at"),
+    )
+
 class PizzaBaseRecipe(Base):
     __tablename__ = "pizza_base_recipes"
     id = Column(Integer, primary_key=True, index=True)
@@ -424,6 +433,133 @@ class Order(Base):
     # Isso grava exatamente em qual abertura de caixa esse pedido nasceu
     cash_opening_id = Column(Integer, ForeignKey("cash_openings.id"), nullable=True)
 
+    # --- ITENS JÁ NORMALIZADOS (gravado na escrita, ver services/normalizer.py) ---
+    # Evita rodar os tradutores Wabiz/iFood/PDV a cada leitura do painel/KDS/impressão
+    items_view = Column(JSONB, nullable=True)
+    items_view_version = Column(Integer, nullable=True)
+
+    # --- ÍNDICES DAS CONSULTAS QUENTES (criados com CONCURRENTLY por services/db_indexes.py) ---
+    __table_args__ = (
+        Index("idx_orders_status", "status"),
+        Index("idx_orders_created_at", "created_at"),
+        Index("idx_orders_store_status", "store_id", "status"),
+        Index("idx_orders_customer_phone", "customer_phone"),
+        # Dashboards / relatórios por período
+        Index("idx_orders_store_created", "store_id", "created_at"),
+        # Deduplicação no process_standard_order
+        Index("idx_orders_store_external", "store_id", "external_id"),
+        Index("idx_orders_store_wabiz", "store_id", "wabiz_id"),
+        # Acerto dos motoboys (pendentes do caixa)
+        Index("idx_orders_driver_payout", "driver_id", "status", "cash_opening_id", "is_driver_paid"),
+        # Painel: só os pedidos em andamento (mesma lista do KANBAN_ACTIVE_STATUSES)
+        Index(
+            "idx_orders_store_active", "store_id", "status",
+            postgresql_where=text("status IN ('PENDENTE', 'PREPARO', 'FORNO', 'EXPEDICAO', 'PRONTO_COZINHA', 'PRONTO', 'SAIU_ENTREGA')"),
+        ),
+    )
+
+# Recalcula o items_view sempre que os itens (ou a origem) do pedido mudam
+ITEMS_VIEW_SOURCE_FIELDS = ("items_json", "payment_method", "wabiz_id", "external_id")
+
+@event.listens_for(Session, "before_flush")
+def _refresh_order_items_view(session, flush_context, instances):
+    from services.normalizer import refresh_items_view  # Import tardio (evita ciclo)
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Order): continue
+        if obj in session.new or any(get_history(obj, f).has_changes() for f in ITEMS_VIEW_SOURCE_FIELDS):
+            refresh_items_view(obj)
+
+
+# --- CONTADORES DO PAINEL (services/board_stats.py) ---
+# Captura o antes/depois de cada pedido gravado; depois do commit aplica só a diferença.
+def _board_values(obj, side):
+    from services.board_stats import BOARD_SOURCE_FIELDS
+    values = {}
+    for f in BOARD_SOURCE_FIELDS:
+        h = get_history(obj, f)
+        if side == "new":
+            values[f] = h.added[0] if h.added else (h.unchanged[0] if h.unchanged else getattr(obj, f))
+        elif h.deleted: values[f] = h.deleted[0]
+        elif h.unchanged: values[f] = h.unchanged[0]
+        elif h.added: values["_unknown"] = True  # Alterado sem valor antigo (ex.: mutação in-place)
+        else:
+            # Não carregado e não alterado: igual ao atual
+            try: values[f] = getattr(obj, f)
+            except Exception: values["_unknown"] = True
+    if values.get("items_json") is not None:
+        values["items_json"] = copy.deepcopy(values["items_json"])
+    return values
+
+
+@event.listens_for(Session, "after_flush")
+def _capture_board_changes(session, flush_context):
+    from services.board_stats import BOARD_SOURCE_FIELDS
+    changes = session.info.setdefault("board_changes", [])
+    for obj in session.new:
+        if isinstance(obj, Order):
+            changes.append({"store_id": obj.store_id, "old": None, "new": _board_values(obj, "new")})
+    for obj in session.dirty:
+        if isinstance(obj, Order) and any(get_history(obj, f).has_changes() for f in BOARD_SOURCE_FIELDS):
+            changes.append({"store_id": obj.store_id, "old": _board_values(obj, "old"), "new": _board_values(obj, "new")})
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            changes.append({"store_id": obj.store_id, "old": _board_values(obj, "old"), "new": None})
+
+    # Lojas com incremento a caminho: a reconstrução do hash espera (uma vez por transação)
+    pending = session.info.setdefault("board_pending", set())
+    new_stores = {ch["store_id"] for ch in changes if ch["store_id"]} - pending
+    if new_stores:
+        from services.board_stats import mark_pending
+        mark_pending(new_stores)
+        pending.update(new_stores)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_board_changes(session):
+    changes = session.info.pop("board_changes", None)
+    pending = session.info.pop("board_pending", None)
+    if changes or pending:
+        from services.board_stats import apply_order_changes
+        apply_order_changes(changes or [], pending or ())
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_board_changes(session):
+    session.info.pop("board_changes", None)
+    pending = session.info.pop("board_pending", None)
+    if pending:
+        from services.board_stats import release_pending
+        release_pending(pending)
+
+
+# --- VERSÃO DA LOJA (services/store_version.py: ETag das rotas de polling) ---
+# Qualquer gravação de pedido, caixa ou sessão/vale de motoboy muda a versão da loja.
+@event.listens_for(Session, "after_flush")
+def _capture_store_versions(session, flush_context):
+    stores = session.info.setdefault("store_versions", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Order, CashOpening, CashClosing, DriverSession)):
+            stores.add(obj.store_id)
+        elif isinstance(obj, DriverAdvance):
+            # Vale não tem loja: usa a sessão do motoboy (já carregada nas rotas que lançam vales)
+            driver_session = session.identity_map.get(identity_key(DriverSession, obj.session_id))
+            if driver_session is not None:
+                stores.add(driver_session.store_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_store_versions(session):
+    stores = session.info.pop("store_versions", None)
+    if stores:
+        from services.store_version import bump_store_versions
+        bump_store_versions(stores)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_store_versions(session):
+    session.info.pop("store_versions", None)
+
+
 class Event(Base):
     __tablename__ = "events"
     id = Column(Integer, primary_key=True, index=True)
@@ -502,6 +638,10 @@ class CampaignLog(Base):
     message_id = Column(String)
     campaign = relationship("Campaign", back_populates="logs")
 
+    __table_args__ = (
+        Index("idx_campaign_logs_campaign_phone", "campaign_id", "customer_phone"),
+    )
+
 class Insight(Base):
     __tablename__ = "insights"
     id = Column(Integer, primary_key=True, index=True)
@@ -685,4 +825,230 @@ class PendingPixelEvent(Base):
     status = Column(String, default="PENDING") # PENDING, PROCESSED
     created_at = Column(DateTime, server_default=func.now())
     
-    store = relationship("Store")
\ No newline at end of file
+    store = relationship("Store")
+
+    __table_args__ = (
+        Index("idx_pending_pixel_store_event", "store_id", "event_id", postgresql_where=text("status = 'PENDING'")),
+    )
+
+# --- OUTBOX: EFEITOS COLATERAIS DE PEDIDOS (PIXEL, CONFIRMAÇÃO, KDS) ---
+# Gravado no MESMO commit do pedido; services/outbox.py drena em paralelo com retry.
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+
+    event_type = Column(String)  # pixel_fb, confirm_origin, kds_trigger, ga4_pending
+    idempotency_key = Column(String, unique=True, index=True)  # Ex: "pixel_fb:3:ABC123"
+    payload = Column(JSONB, default={})
+
+    status = Column(String, default="PENDING", index=True)  # PENDING, PROCESSING, DONE, FAILED
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+
+# --- ESTÁGIO DOS ITENS NO KDS ---
+# Um toque na tela da cozinha grava só a linha do item (UPSERT), sem reescrever o
+# items_json inteiro do pedido. item_index = posição do item no items_json.
+# Sem linha = vale o kds_stage que está dentro do próprio item (pedidos antigos).
+class OrderItemStage(Base):
+    __tablename__ = "order_item_stages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), index=True)
+    item_index = Column(Integer, nullable=False)
+    sector_id = Column(Integer, nullable=True)
+    stage = Column(Integer, default=0)  # 0 = cozinha, 1 = forno/expedição, 2 = pronto
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('order_id', 'item_index', name='uix_order_item_stage'),
+    )
+
+
+# --- RESUMOS DE VENDAS (services/sales_rollup.py) ---
+# Dia/hora no horário de Brasília. Cancelados ficam de fora (mesma regra do dashboard).
+class SalesRollupHourly(Base):
+    __tablename__ = "sales_rollup_hourly"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    local_date = Column(Date, nullable=False)
+    hour = Column(Integer, nullable=False)                 # 0-23
+    payment_method = Column(String, nullable=False, default="")  # Texto cru do pedido ("" = sem forma)
+    orders_count = Column(Integer, default=0)
+    revenue = Column(Float, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint('store_id', 'local_date', 'hour', 'payment_method', name='uix_sales_rollup_hour'),
+    )
+
+
+class ProductRollupDaily(Base):
+    __tablename__ = "product_rollup_daily"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    local_date = Column(Date, nullable=False)
+    payment_method = Column(String, nullable=False, default="")
+    product_name = Column(String, nullable=False)
+    qty = Column(Float, default=0.0)
+    revenue = Column(Float, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint('store_id', 'local_date', 'payment_method', 'product_name', name='uix_product_rollup_day'),
+    )
+
+
+class SalesRollupState(Base):
+    """Loja com histórico já consolidado (backfill). Sem linha aqui, os relatórios leem os pedidos."""
+    __tablename__ = "sales_rollup_state"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    backfilled_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Dias (loja, data local) afetados por gravações de pedido; recalculados depois do commit
+@event.listens_for(Session, "after_flush")
+def _capture_rollup_days(session, flush_context):
+    from services.sales_rollup import ROLLUP_SOURCE_FIELDS, local_day_of
+    days = session.info.setdefault("rollup_days", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Order): continue
+        if obj in session.new:
+            # created_at vem do server_default: ainda não está no objeto (é agora)
+            days.add((obj.store_id, local_day_of(obj.__dict__.get("created_at") or datetime.utcnow())))
+            continue
+        if obj in session.dirty and not any(get_history(obj, f).has_changes() for f in ROLLUP_SOURCE_FIELDS):
+            continue
+        stores = {obj.store_id} | set(get_history(obj, "store_id").deleted or [])
+        created = {obj.created_at} | set(get_history(obj, "created_at").deleted or [])
+        for store_id in stores:
+            for created_at in created:
+                if store_id and created_at: days.add((store_id, local_day_of(created_at)))
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_rollup_days(session):
+    days = session.info.pop("rollup_days", None)
+    if days:
+        from services.sales_rollup import schedule_rollup_refresh
+        schedule_rollup_refresh(days)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rollup_days(session):
+    session.info.pop("rollup_days", None)
+
+
+# --- ITENS VENDIDOS (services/order_items.py) ---
+# Uma linha por item do items_json (e por sabor/adicional/sub-produto de combo),
+# para os relatórios agruparem no banco em vez de varrer o JSON de cada pedido.
+class OrderItem(Base):
+    __tablename__ = "order_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime)                    # Cópia do pedido (filtro de período sem JOIN)
+    is_cancelled = Column(Boolean, default=False)
+    item_index = Column(Integer, nullable=False)     # Posição na lista achatada do pedido
+    parent_index = Column(Integer, nullable=True)    # Item pai (None = item principal)
+    kind = Column(String, default="item")            # item / part (sabor) / addon / sub (combo)
+    product_id = Column(Integer, nullable=True)      # Resolvido pelo catálogo (ID > código > nome)
+    title = Column(String)                           # Nome como veio (chave do top produtos)
+    name = Column(String)                            # Nome limpo (sem o que vem entre parênteses)
+    qty = Column(Float, default=1.0)
+    unit_price = Column(Float, default=0.0)
+    size = Column(String, nullable=True)             # Tamanho da pizza (catálogo da loja)
+
+    __table_args__ = (
+        Index("idx_order_items_order", "order_id"),
+        Index("idx_order_items_store_created", "store_id", "created_at"),
+        Index("idx_order_items_store_name", "store_id", "name"),
+    )
+
+
+class OrderItemsState(Base):
+    """Loja com histórico já extraído (backfill). Sem linha aqui, os relatórios leem o items_json."""
+    __tablename__ = "order_items_state"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    backfilled_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Pedidos com itens/status/data alterados: linhas do order_items refeitas depois do commit
+@event.listens_for(Session, "after_flush")
+def _capture_order_items(session, flush_context):
+    from services.order_items import ORDER_ITEMS_SOURCE_FIELDS
+    order_ids = session.info.setdefault("order_items_orders", set())
+    for obj in session.new:
+        if isinstance(obj, Order) and obj.id: order_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Order) and obj.id and any(get_history(obj, f).has_changes() for f in ORDER_ITEMS_SOURCE_FIELDS):
+            order_ids.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _sync_order_items(session):
+    order_ids = session.info.pop("order_items_orders", None)
+    if order_ids:
+        from services.order_items import schedule_order_items_sync
+        schedule_order_items_sync(order_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_order_items(session):
+    session.info.pop("order_items_orders", None)
+
+
+# --- CESTA DE COMPRAS / COMBOS (services/market_basket.py) ---
+class BasketItemset(Base):
+    """Em quantos pedidos da janela cada conjunto de 1, 2 ou 3 produtos apareceu junto."""
+    __tablename__ = "basket_itemsets"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    itemset = Column(String, primary_key=True)   # Nomes limpos, ordenados, separados por ITEMSET_SEP
+    size = Column(Integer, nullable=False)
+    count = Column(Integer, default=0)
+
+
+class BasketRule(Base):
+    """Regras "quem leva A (e B) leva C" já ranqueadas (rank 1 = melhor)."""
+    __tablename__ = "basket_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    rank = Column(Integer, nullable=False)
+    antecedent = Column(JSONB)                   # Lista de nomes
+    consequent = Column(String)
+    itemset_size = Column(Integer)               # 2 = par, 3 = trio
+    support_count = Column(Integer)              # Pedidos com o conjunto inteiro
+    support = Column(Float)                      # support_count / pedidos da janela
+    confidence = Column(Float)                   # P(consequente | antecedente)
+    lift = Column(Float)                         # confidence / P(consequente)
+    computed_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_basket_rules_store_rank", "store_id", "rank"),
+    )
+
+
+class BasketState(Base):
+    """Janela já contada em basket_itemsets (para somar/subtrair só a diferença)."""
+    __tablename__ = "basket_state"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    window_days = Column(Integer, default=0)     # 0 = histórico inteiro
+    window_start = Column(DateTime, nullable=True)
+    window_end = Column(DateTime)
+    basket_count = Column(Integer, default=0)
+    full_rebuild_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -8,7 +8,11 @@ from typing import Optional
 from database import get_db
 from models import User, Store, Order
 from auth import verify_password, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM
-from dependencies import templates, check_db_auth, check_role, get_today_stats
+from dependencies import (
+    templates, check_db_auth, check_role, get_today_stats,
+    set_admin_session, clear_admin_session, refresh_admin_session, apply_refreshed_session
+)
+from services.principal_cache import invalidate_principals, authenticate_basic, password_hash_of
 
 router = APIRouter()
 
@@ -19,7 +23,7 @@ def logout(
     target: str = Query("admin") # <--- Aceita ?target=driver ou ?target=waiter
 ):
     # Define para onde vai
-    url = "/admin/dashboard" # Padrão
+    url = "/admin/login" # Padrão
     
     if target == "driver":
         url = "/driver/login"
@@ -27,10 +31,55 @@ def logout(
         url = "/waiter/login"
         
     response = RedirectResponse(url=url, status_code=303)
-    response.delete_cookie("access_token")
+    clear_admin_session(response)
     return response
 
 
+# ==========================================
+#        LOGIN DO ADMIN (SESSÃO POR TOKEN)
+# ==========================================
+
+def _safe_next(target: Optional[str]) -> str:
+    # Só caminhos internos (evita redirecionar para outro site depois do login)
+    if not target or not target.startswith("/") or target.startswith("//"):
+        return "/admin/dashboard"
+    return target
+
+
+@router.get("/admin/login", response_class=HTMLResponse)
+def admin_login_page(request: Request, next: Optional[str] = Query(None)):
+    return templates.TemplateResponse("admin_login.html", {"request": request, "next": _safe_next(next)})
+
+
+@router.post("/admin/login", response_class=HTMLResponse)
+async def admin_login_action(
+    request: Request,
+    email: str = Form(...),
+    password: str = Form(...),
+    next: Optional[str] = Form(None),
+    db: Session = Depends(get_db),
+):
+    user = authenticate_basic(db, email.strip(), password)
+    if not user or user.role == "driver":
+        return templates.TemplateResponse(
+            "admin_login.html",
+            {"request": request, "next": _safe_next(next), "error": "Email ou senha incorretos."},
+            status_code=401,
+        )
+
+    response = RedirectResponse(url=_safe_next(next), status_code=303)
+    set_admin_session(response, user, password_hash_of(user))
+    return response
+
+
+@router.post("/admin/auth/refresh")
+def admin_refresh_session(request: Request, db: Session = Depends(get_db)):
+    """Renova o access token pelo refresh token (o check_db_auth já faz isso sozinho quando ele vence)."""
+    if not refresh_admin_session(request, db):
+        return JSONResponse(status_code=401, content={"message": "Sessão expirada. Faça login novamente."})
+    return apply_refreshed_session(request, JSONResponse(content={"success": True}))
+
+
 @router.get("/admin/users", response_class=HTMLResponse)
 def admin_users_view(
     request: Request,
@@ -107,6 +156,7 @@ async def save_user(
                 user.hashed_password = get_password_hash(password)
 
         db.commit()
+        invalidate_principals()
         return {"success": True}
 
     except Exception as e:
@@ -135,6 +185,7 @@ async def delete_user(
     try:
         db.delete(user)
         db.commit()
+        invalidate_principals()
         return {"success": True}
     except Exception as e:
         return JSONResponse(
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, Form, Query, HTTPException
+from fastapi import APIRouter, Request, Depends, Form, Query, HTTPException, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc, or_, cast, String, not_
 from fastapi.responses import HTMLResponse, JSONResponse
@@ -14,6 +14,10 @@ from models import User, Order, DriverSession, DriverAdvance, CashClosing, CashO
 from auth import verify_password
 from dependencies import templates, check_db_auth, check_role
 from services.sockets import manager
+from services.order_events import order_delta_messages, broadcast_deltas
+from services.cash_state import get_cash_state, cash_state_opened, cash_state_closed
+from services.board_stats import invalidate_board_stats
+from services.store_version import bump_store_versions, check_not_modified
 from services.utils import get_br_time
 
 router = APIRouter()
@@ -85,24 +89,12 @@ def get_daily_summary(
 ):
     store_id = current_user.store_id
     
-    # 1. Busca a última abertura e fechamento
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    is_open = False
-    start_filter = None
-    opening_val = 0.0
-    current_cash_id = None
-
-    if last_opening:
-        # Se fechamento > abertura, está fechado.
-        if last_closing and last_closing.closed_at > last_opening.created_at:
-            is_open = False
-        else:
-            is_open = True
-            start_filter = last_opening.created_at
-            opening_val = last_opening.amount
-            current_cash_id = last_opening.id
+    # 1. Estado do caixa (cache atualizado na abertura/fechamento)
+    cash = get_cash_state(db, store_id)
+    is_open = cash.is_open
+    start_filter = cash.opened_at
+    opening_val = cash.opening_amount if cash.is_open else 0.0
+    current_cash_id = cash.opening_id
 
     # 2. Inicializa Zerado
     summary = {
@@ -227,27 +219,11 @@ def get_finance_orders_history(
     # ======================================================================
     # 1. VERIFICAÇÃO RIGOROSA DO CAIXA
     # ======================================================================
-    # Busca a última abertura e o último fechamento
-    last_opening = db.query(CashOpening).filter(
-        CashOpening.store_id == store_id
-    ).order_by(desc(CashOpening.created_at)).first()
-    
-    last_closing = db.query(CashClosing).filter(
-        CashClosing.store_id == store_id
-    ).order_by(desc(CashClosing.closed_at)).first()
-    
-    is_open = False
-    current_cash_id = None
-    start_filter = datetime.now() # Placeholder de segurança
-
-    if last_opening:
-        # Lógica: Se tem fechamento posterior à abertura, está FECHADO
-        if last_closing and last_closing.closed_at > last_opening.created_at:
-            is_open = False
-        else:
-            is_open = True
-            start_filter = last_opening.created_at
-            current_cash_id = last_opening.id
+    # Estado do caixa em cache (atualizado na abertura/fechamento)
+    cash = get_cash_state(db, store_id)
+    is_open = cash.is_open
+    current_cash_id = cash.opening_id
+    start_filter = cash.opened_at if cash.is_open else datetime.now() # Placeholder de segurança
 
     # ======================================================================
     # 2. SE CAIXA FECHADO -> RETORNA TUDO ZERADO
@@ -335,20 +311,18 @@ def get_finance_orders_history(
 # --- API: LISTA MOTOBOYS (A QUE DAVA 404) ---
 @router.get("/admin/api/finance/drivers-live")
 def get_drivers_live_metrics(
+    request: Request,
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(check_db_auth)
 ):
     store_id = current_user.store_id
+    # Nada mudou (pedidos, caixa, sessões/vales) desde o último polling: 304 sem ir ao banco
+    not_modified = check_not_modified(request, response, store_id, current_user.id)
+    if not_modified: return not_modified
     
-    # 1. VERIFICAÇÃO DE CAIXA
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    # 1. VERIFICAÇÃO DE CAIXA (estado em cache)
+    current_cash_id = get_cash_state(db, store_id).opening_id
 
     drivers = db.query(User).filter(User.store_id == store_id, User.role == 'driver').all()
     final_list = []
@@ -437,13 +411,7 @@ def get_driver_summary(
     current_user: User = Depends(check_db_auth)
 ):
     # Identifica Caixa Aberto
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    current_cash_id = get_cash_state(db, current_user.store_id).opening_id
 
     driver = db.query(User).get(driver_id)
     
@@ -581,13 +549,7 @@ def settle_driver(
     current_user: User = Depends(check_role(["owner", "manager"]))
 ):
     # 1. Identifica Caixa Aberto para vincular a transação
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    current_cash_id = get_cash_state(db, current_user.store_id).opening_id
 
     # 2. Busca sessão ativa para registrar o adiantamento
     active_session = db.query(DriverSession).filter(
@@ -634,21 +596,8 @@ def cash_operation(
     db: Session = Depends(get_db),
     current_user: User = Depends(check_role(["owner", "manager"]))
 ):
-    # 1. Busca o Caixa Aberto (Lógica Padrão de Blindagem)
-    last_opening = db.query(CashOpening).filter(
-        CashOpening.store_id == current_user.store_id
-    ).order_by(desc(CashOpening.created_at)).first()
-    
-    last_closing = db.query(CashClosing).filter(
-        CashClosing.store_id == current_user.store_id
-    ).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    
-    # Se tem abertura E (não tem fechamento OU a abertura é mais recente)
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    # 1. Busca o Caixa Aberto (estado em cache, atualizado na abertura/fechamento)
+    current_cash_id = get_cash_state(db, current_user.store_id).opening_id
     
     # Se tentar lançar sangria com caixa fechado, avisa ou permite (mas sem ID)
     if not current_cash_id:
@@ -683,7 +632,9 @@ async def open_cash_box(
     last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
     last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
 
+    # A abertura confere no banco (não no cache): é aqui que o estado muda
     if last_opening and (not last_closing or last_opening.created_at > last_closing.closed_at):
+        cash_state_opened(last_opening)
         return JSONResponse(status_code=400, content={"message": "Caixa já aberto!"})
     
     # 2. Abre o Novo Caixa
@@ -695,6 +646,7 @@ async def open_cash_box(
     )
     db.add(new_opening)
     db.commit() # Comita para gerar o ID
+    cash_state_opened(new_opening) # Todas as telas passam a ver o caixa aberto
     
     # ======================================================================
     # 🧹 FAXINA AUTOMÁTICA (LÓGICA BLINDADA)
@@ -723,6 +675,9 @@ async def open_cash_box(
         ).update({DriverSession.cash_opening_id: new_opening.id}, synchronize_session=False)
         
         db.commit()
+        # Os órfãos entraram por UPDATE em massa (fora do ORM): contadores refeitos na próxima leitura
+        invalidate_board_stats(current_user.store_id, new_opening.id)
+        bump_store_versions([current_user.store_id])
         print(f"💰 Caixa Aberto! {orphans_count} pedidos e {drivers_count} motoboys vinculados.")
         
     except Exception as e:
@@ -855,6 +810,7 @@ async def close_cash_register(
     )
     db.add(closing)
     db.commit()
+    cash_state_closed(closing)
     
     # 4. Alerta WhatsApp (Mantido)
     if abs(diff) > 0.50:
@@ -1063,13 +1019,7 @@ def admin_toggle_driver_session(
     if not driver: return JSONResponse(status_code=404, content={"message": "Erro"})
 
     # 1. Busca Caixa Aberto
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    current_cash_id = get_cash_state(db, current_user.store_id).opening_id
 
     if not current_cash_id:
         return JSONResponse(status_code=400, content={"message": "Abra o caixa primeiro!"})
@@ -1441,7 +1391,7 @@ async def pay_order_via_employee(
     order.status = "CONCLUIDO"
     
     db.commit()
-    await manager.broadcast(current_user.store_id, "update")
+    await broadcast_deltas(order_delta_messages([order], "order_status"))
     
     return {"success": True, "message": f"Atualizado: R$ {final_amount:.2f} para {employee.full_name}"}
 
@@ -1555,13 +1505,7 @@ def create_manual_transaction(
     db.add(tx)
 
     # Identifica Caixa Aberto
-    last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
-    last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
-    
-    current_cash_id = None
-    if last_opening:
-        if not last_closing or last_opening.created_at > last_closing.closed_at:
-            current_cash_id = last_opening.id
+    current_cash_id = get_cash_state(db, current_user.store_id).opening_id
 
     # 2. LÓGICA MOTOBOY VS STAFF
     if employee.role == 'driver':
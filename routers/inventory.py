@@ -21,12 +21,12 @@ from models import (
     PizzaBaseRecipe,
     AddonRecipe,
 )
-from dependencies import templates, check_db_auth, check_role
+from dependencies import templates, check_db_auth, check_role, catalog_write_guard
 from services.analytics import PizzaBrain
 from services.invoice_reader import extract_data_from_invoice
 from services.stock_engine import get_or_create_category, get_or_create_unit
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(catalog_write_guard)])
 
 
 # Modelos Pydantic internos para as rotas de API
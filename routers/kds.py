@@ -7,21 +7,20 @@ from fastapi import (
     WebSocketDisconnect,
     Query,
     status,
+    Response,
 )
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy import func, or_, desc
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from datetime import datetime, timedelta
 import pytz
 import traceback
-import re
 from typing import Optional
 from jose import jwt
 
 # Imports locais
 from database import get_db
-from models import User, Order, Product, ProductMapping, Category, ProductionSector
+from models import User, Order, Product, ProductMapping, ProductionSector
 from dependencies import templates, check_db_auth
 from services.sockets import manager
 from auth import ALGORITHM, SECRET_KEY, verify_password, create_access_token
@@ -32,7 +31,11 @@ from services.integrations.ifood import process_ifood_update, IfoodAdapter
 from fastapi import BackgroundTasks
 
 # --- IMPORTANTE: IMPORTA O SEU NOVO NORMALIZADOR ---
-from services.normalizer import normalize_order_items_for_view
+from services.normalizer import ensure_items_views, get_items_view
+from services.order_events import order_delta_messages, broadcast_deltas, current_store_seq
+from services.store_version import check_not_modified, bump_store_versions
+from services.sector_routing import get_sector_classifier, DEFAULT_SECTOR_ID
+from services.kds_stages import load_item_stages, apply_item_stages, json_stage, advance_item_stages, derive_order_status, STAGE_KITCHEN, STAGE_OVEN, STAGE_DONE
 
 router = APIRouter()
 
@@ -65,13 +68,22 @@ def kds_monitor(
 # --- API: BUSCA DE PEDIDOS INTELIGENTE ---
 @router.get("/api/kds/orders")
 def get_kds_orders(
+    request: Request,
     mode: str,
     sector_id: Optional[int] = None,
+    order_id: Optional[int] = None,
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(check_db_auth),
 ):
+    # order_id: só o card deste pedido (delta do websocket); lista vazia = saiu da tela
     try:
         store_id = current_user.store_id
+        # Ponto de partida para os deltas do websocket (gap = recarregar); vai também no 304
+        seq = current_store_seq(store_id)
+        # Nada mudou na loja desde o último polling: 304 sem ir ao banco
+        not_modified = check_not_modified(request, response, store_id, current_user.id, seq=seq)
+        if not_modified: return not_modified
         
         # --- 1. CORREÇÃO DE FUSO HORÁRIO (Definição) ---
         utc = pytz.utc
@@ -99,52 +111,34 @@ def get_kds_orders(
         # Busca Pedidos (Limite 24h para segurança)
         limit_date = datetime.now() - timedelta(hours=24)
         
-        orders = (
-            db.query(Order)
-            .filter(
-                Order.store_id == store_id,
-                Order.status.in_(target_status),
-                Order.created_at >= limit_date,
-            )
-            .order_by(Order.created_at.asc())
-            .all()
+        query = db.query(Order).filter(
+            Order.store_id == store_id,
+            Order.status.in_(target_status),
+            Order.created_at >= limit_date,
         )
+        if order_id: query = query.filter(Order.id == order_id)
+        orders = query.order_by(Order.created_at.asc()).all()
 
         data = []
         
-        # Caches
-        cat_sector_map = {c.id: c.sector_id for c in db.query(Category).filter_by(store_id=store_id).all()}
-        prod_cat_map = {p.name.lower().strip(): p.category_id for p in db.query(Product).filter_by(store_id=store_id).all() if p.name}
+        # Reserva para itens sem sector_id gravado (em cache junto com o catálogo da loja)
+        classifier = get_sector_classifier(db, store_id) if sector_id else None
 
+        ensure_items_views(orders)
+        # Estágios dos itens (order_item_stages) de todos os pedidos da tela numa consulta
+        item_stages = load_item_stages(db, [o.id for o in orders])
         for o in orders:
             try:
-                # Normaliza
-                all_items = normalize_order_items_for_view(o)
+                # Itens já normalizados (gravados no pedido)
+                all_items = get_items_view(o)
+                # Cada item normalizado aponta para a sua posição no items_json (src_index)
+                if o.id in item_stages:
+                    all_items = apply_item_stages(all_items, item_stages[o.id], normalized=True)
                 visible_items = []
 
                 for item in all_items:
-                    # Lógica de Filtro por Setor (Resumida para focar na correção do tempo)
-                    if sector_id:
-                        cat_id = None
-                        raw_title = str(item.get("name") or "").lower()
-                        clean = raw_title.replace("combo:", "").split(":")[0].strip()
-                        clean = re.sub(r"^\d+x\s+", "", clean).strip()
-
-                        cat_id = prod_cat_map.get(clean)
-                        if not cat_id:
-                            for db_name, db_cat_id in prod_cat_map.items():
-                                if db_name in clean or clean in db_name:
-                                    cat_id = db_cat_id
-                                    break
-
-                        if cat_id:
-                            item_sector = cat_sector_map.get(cat_id)
-                            if item_sector and item_sector != sector_id: continue
-                            if not item_sector and sector_id != 1: continue
-                        else:
-                            if sector_id != 1: continue
-                            forbidden = ["refri", "cerveja", "coca", "guarana", "fanta", "pepsi", "suco", "agua", "h2oh", "lata", "2l", "600ml", "vinho"]
-                            if any(k in str(item.get("name") or "").lower() for k in forbidden): continue
+                    # Filtro por Setor (gravado no item na entrada; classificador só para pedidos antigos)
+                    if sector_id and classifier.sector_for(item) != sector_id: continue
 
                     # Filtro de Estágio KDS
                     stage = int(item.get("kds_stage", 0) if "kds_stage" in item else 0)
@@ -205,6 +199,7 @@ def get_kds_orders(
                     "items": visible_items,
                     "obs": o.notes if o.notes else "",
                     "time": time_str,    # Hora BR
+                    "created_at": o.created_at.isoformat() if o.created_at else "",  # Ordem na tela (deltas)
                     "elapsed": elapsed,  # Tempo real
                     "status": o.status,
                     "btn_action": btn_action,
@@ -248,64 +243,45 @@ async def advance_order_status(
         sec = db.query(ProductionSector).get(sector_id)
         if sec: sector_has_expedition = sec.has_expedition
 
-    import copy
-    items = copy.deepcopy(order.items_json) if order.items_json else []
+    items = order.items_json if isinstance(order.items_json, list) else []
+
+    # Estágio atual de cada item: linha da tabela ou, sem linha, o que está no próprio item
+    stages = load_item_stages(db, [order.id]).get(order.id, {})
+    current = {idx: stages.get(idx, json_stage(item)) for idx, item in enumerate(items)}
 
-    # Mapas para identificar itens deste setor
-    cat_sector_map = {c.id: c.sector_id for c in db.query(Category).filter_by(store_id=order.store_id).all()}
-    prod_cat_map = {p.name.lower().strip(): p.category_id for p in db.query(Product).filter_by(store_id=order.store_id).all() if p.name}
+    # Itens deste setor (sem setor/bebida avulsa: o setor padrão finaliza junto)
+    classifier = get_sector_classifier(db, order.store_id) if sector_id else None
 
     def is_item_in_sector(item):
         if not sector_id: return True
-        raw_title = str(item.get("title") or item.get("name") or "").lower()
-        clean = raw_title.replace("combo:", "").split(":")[0].strip()
-        clean = re.sub(r"^\d+x\s+", "", clean).strip()
-        cat_id = prod_cat_map.get(clean)
-        if cat_id:
-            s_id = cat_sector_map.get(cat_id)
-            if s_id == sector_id: return True
-            if not s_id and sector_id == 1: return True
-        elif sector_id == 1: return True
-        return False
-
-    items_changed = False
+        item_sector = classifier.sector_for(item)
+        return item_sector == sector_id or (item_sector is None and sector_id == DEFAULT_SECTOR_ID)
+
+    moves = {}  # item_index -> (setor, novo estágio)
 
     if current_status == "kitchen":
-        for item in items:
-            if is_item_in_sector(item):
-                if int(item.get("kds_stage", 0)) == 0:
-                    if sector_has_expedition: item["kds_stage"] = 1
-                    else:
-                        item["kds_stage"] = 2
-                        item["kds_done"] = True
-                    items_changed = True
+        for idx, item in enumerate(items):
+            if is_item_in_sector(item) and current[idx] == STAGE_KITCHEN:
+                moves[idx] = (sector_id, STAGE_OVEN if sector_has_expedition else STAGE_DONE)
 
     elif current_status == "expedition":
-        for item in items:
-            if is_item_in_sector(item):
-                if int(item.get("kds_stage", 0)) == 1:
-                    item["kds_stage"] = 2
-                    item["kds_done"] = True
-                    items_changed = True
-
-    if items_changed:
-        order.items_json = items        
-        flag_modified(order, "items_json")
-
-        all_done = True
-        any_oven = False
-        for i in items:
-            s = int(i.get("kds_stage", 0))
-            if s < 2: all_done = False
-            if s == 1: any_oven = True
-
-        # Define o novo Status Global do Pedido
-        if all_done: order.status = "PRONTO"
-        elif any_oven: order.status = "FORNO"
-        else: order.status = "PREPARO"
+        for idx, item in enumerate(items):
+            if is_item_in_sector(item) and current[idx] == STAGE_OVEN:
+                moves[idx] = (sector_id, STAGE_DONE)
+
+    # UPSERT só das linhas (sem regravar o items_json); outra tela pode ter avançado antes
+    moved = advance_item_stages(db, order, moves, current) if moves else []
+
+    if moved:
+        bump_store_versions([order.store_id])
+
+        # Define o novo Status Global do Pedido (trava a linha do pedido só para a agregação)
+        db.refresh(order, with_for_update=True)
+        new_status = derive_order_status(db, order.id, len(items))
+        if order.status != new_status: order.status = new_status
 
         db.commit()
-        await manager.broadcast(order.store_id, "update")
+        await broadcast_deltas(order_delta_messages([order], "order_items"))
         
         # --- CORREÇÃO: DISPARA INTEGRAÇÕES (Wabiz/iFood) ---
         # Só avisa se o status mudou (Ex: foi de PREPARO para PRONTO) e tem vínculo externo
@@ -458,15 +434,21 @@ async def trigger_kds_update(store_id: int):
 # --- NOVA ROTA: HISTÓRICO RECENTE PARA KDS ---
 @router.get("/api/kds/history")
 def get_kds_history_recent(
+    request: Request,
     limit: int = 20,
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(check_db_auth)
 ):
     """Retorna últimos finalizados com Hora Brasil e Lista Completa de Itens"""
+    not_modified = check_not_modified(request, response, current_user.store_id, current_user.id)
+    if not_modified: return not_modified
+
     orders = db.query(Order).filter(
         Order.store_id == current_user.store_id,
         Order.status.in_(['PRONTO', 'ENTREGUE', 'CONCLUIDO', 'SAIU_ENTREGA']) 
     ).order_by(desc(Order.created_at)).limit(limit).all()
+    ensure_items_views(orders)
 
     data = []
     utc = pytz.utc
@@ -480,7 +462,7 @@ def get_kds_history_recent(
         local_dt = raw_dt.astimezone(br_zone)
         
         # 2. Normalização Completa dos Itens (Estrutura Rica)
-        items_norm = normalize_order_items_for_view(o)
+        items_norm = get_items_view(o)
             
         data.append({
             "id": o.id,
@@ -22,9 +22,9 @@ from models import (
     DeliveryFee,
     ProductionSector,
 )
-from dependencies import templates, check_db_auth, get_today_stats, check_role,get_mixed_current_user
+from dependencies import templates, check_db_auth, get_today_stats, check_role,get_mixed_current_user, catalog_write_guard
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(catalog_write_guard)])
 
 # ==========================================
 #           GESTÃO DE CARDÁPIO (CRUD)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, Form, Query, WebSocket, WebSocketDisconnect, status, BackgroundTasks # <--- CONFIRME SE ESTÁ AQUI
+from fastapi import APIRouter, Request, Depends, Form, Query, WebSocket, WebSocketDisconnect, status, BackgroundTasks, Response # <--- CONFIRME SE ESTÁ AQUI
 from fastapi.security.utils import get_authorization_scheme_param
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import desc, or_, and_, cast, String, not_, func
@@ -10,17 +10,22 @@ from typing import Optional
 from services.background_jobs import get_active_adapters
 from services.integrations.ifood import IfoodAdapter, process_ifood_update
 from services.integrations.wabiz import WabizAdapter, process_wabiz_update
-import unicodedata
 import re
 # Imports Locais
 from database import get_db
 # Adicione CashOpening na lista de imports de models
-from models import Order, User, Product, DeliveryFee, Customer, Address, DriverSession, CashOpening, CashClosing, ProductMapping
+from models import Order, User, Product, DeliveryFee, Customer, Address, DriverSession
 from dependencies import templates, check_db_auth, get_today_stats, get_mixed_current_user, get_current_waiter
 from services.whatsapp import notify_pickup_ready
 from services.stock_engine import return_stock_from_order, enrich_order_with_combo_data
 from services.utils import normalize_phone, recover_historical_ip, upsert_customer_smart, dispatch_smart_event, get_active_cash_id
-from services.normalizer import normalize_order_items_for_view
+from services.normalizer import normalize_order_items_for_view, load_items_views, get_items_view
+from services.cash_state import get_cash_state
+from services.board_stats import get_board_stats, stats_payload
+from services.order_events import build_order_card, build_kanban, order_delta_messages, broadcast_deltas, current_store_seq, card_query, DELIVERED_PAGE_SIZE, LIST_PAGE_SIZE
+from services.store_version import check_not_modified
+from services.sector_routing import stamp_item_sectors
+from services.kds_stages import load_item_stages, apply_item_stages, remap_item_stages, item_signature
 
 from services.sockets import manager
 import asyncio
@@ -126,6 +131,93 @@ def admin_orders_view(request: Request, db: Session = Depends(get_db), current_u
     })
     
     
+# --- CONSULTA DO PAINEL (projeção + filtros da aba) ---
+
+def _board_query(db, store_id, cash, tab, search, platform, start, end, driver_id, now):
+    """Linhas de card (services/order_events.CARD_COLUMNS) visíveis na aba, já sem cancelados."""
+    list_query = card_query(db).filter(Order.store_id == store_id, not_(Order.status.ilike('%CANCELADO%')))
+
+    if start:
+        s_dt = datetime.strptime(start, '%Y-%m-%d')
+        e_dt = datetime.strptime(end, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if end else now
+        list_query = list_query.filter(Order.created_at >= s_dt, Order.created_at <= e_dt)
+    else:
+        active_statuses = ['PENDENTE', 'PREPARO', 'PRONTO', 'SAIU_ENTREGA', 'FORNO', 'EXPEDICAO']
+        if cash.is_open:
+            if cash.opening_id:
+                 list_query = list_query.filter(or_(Order.cash_opening_id == cash.opening_id, Order.created_at >= cash.opened_at, Order.status.in_(active_statuses)))
+            else:
+                list_query = list_query.filter(or_(Order.created_at >= cash.opened_at, Order.status.in_(active_statuses)))
+        else:
+            last_closing_dt = cash.closed_at or now
+            list_query = list_query.filter(or_(Order.created_at >= last_closing_dt, Order.status.in_(active_statuses)))
+
+    if search and search.strip():
+        term = f"%{search}%"
+        list_query = list_query.filter(or_(Order.customer_name.ilike(term), Order.wabiz_id.ilike(term), cast(Order.id, String).ilike(term)))
+
+    if platform and platform != 'all':
+        if platform == 'ifood': list_query = list_query.filter(Order.payment_method.ilike('%ifood%'))
+        elif platform == 'wabiz': list_query = list_query.filter(and_(not_(Order.wabiz_id.ilike('M-%')), not_(Order.payment_method.ilike('%ifood%'))))
+        elif platform == 'pdv': list_query = list_query.filter(or_(Order.wabiz_id.ilike('M-%'), Order.payment_method.ilike('%pdv%')))
+
+    if driver_id:
+        list_query = list_query.filter(Order.driver_id == driver_id)
+
+    if tab == 'delivery':
+        list_query = list_query.filter(Order.table_number == None, Order.address_street != None, Order.address_street != '', not_(Order.address_street.ilike('Retirada%')), not_(Order.address_street.ilike('%Balcão%')), not_(Order.address_street.ilike('%Balcao%')))
+    elif tab == 'balcao':
+        list_query = list_query.filter(Order.table_number == None, or_(Order.address_street.ilike('Retirada%'), Order.address_street.ilike('%Balcão%'), Order.address_street.ilike('%Balcao%'), Order.address_street == None, Order.address_street == ''))
+    elif tab == 'mesas':
+        list_query = list_query.filter(Order.table_number != None, not_(Order.status.in_(['ENTREGUE', 'CONCLUIDO', 'FINALIZADO'])))
+
+    return list_query
+
+
+# Status que aparecem nas colunas ativas do Kanban (ENTREGUE vem paginado à parte)
+KANBAN_ACTIVE_STATUSES = ['PENDENTE', 'PREPARO', 'FORNO', 'EXPEDICAO', 'PRONTO_COZINHA', 'PRONTO', 'SAIU_ENTREGA']
+
+
+def _keyset_page(q, cursor, limit):
+    """Página por keyset (created_at, id), mais recentes primeiro — não usa OFFSET."""
+    if cursor:
+        c_dt, c_id = cursor
+        q = q.filter(or_(Order.created_at < c_dt, and_(Order.created_at == c_dt, Order.id < c_id)))
+    return q.order_by(desc(Order.created_at), desc(Order.id)).limit(limit).all()
+
+
+def _delivered_page(base, cursor, limit):
+    """Página do ENTREGUE (coluna do Kanban)."""
+    return _keyset_page(base.filter(Order.status == 'ENTREGUE'), cursor, limit)
+
+
+def _history_page(base, cursor, limit):
+    """Página do que já saiu do fluxo (abas em lista): finalizados e sem status."""
+    return _keyset_page(base.filter(or_(Order.status == None, not_(Order.status.in_(KANBAN_ACTIVE_STATUSES)))), cursor, limit)
+
+
+def _encode_cursor(row):
+    return f"{row.created_at.isoformat()}|{row.id}" if row.created_at else None
+
+
+def _decode_cursor(raw):
+    try:
+        dt_txt, id_txt = raw.rsplit('|', 1)
+        return datetime.fromisoformat(dt_txt), int(id_txt)
+    except Exception:
+        return None
+
+
+def _rows_to_cards(db, rows):
+    views = load_items_views(db, rows)
+    # Estágio real dos itens (order_item_stages): o app do garçom remonta os itens daqui
+    stages = load_item_stages(db, [r.id for r in rows if r.status not in ('ENTREGUE', 'CANCELADO')])
+    return [
+        build_order_card(r, items=apply_item_stages(views.get(r.id, []), stages.get(r.id), normalized=True))
+        for r in rows
+    ]
+
+
 @router.get("/admin/api/orders/list")
 def get_orders_api(
     request: Request,
@@ -135,365 +227,70 @@ def get_orders_api(
     start: Optional[str] = None,
     end: Optional[str] = None,
     driver_id: Optional[int] = None,
+    sections: Optional[str] = Query(None, description="kanban,list,counts (padrão conforme a aba)"),
+    response: Response = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_mixed_current_user)
 ):
     try:
+        # Sequência lida ANTES da versão e da consulta: delta com seq maior que este já está
+        # (ou estará) na tela. Vai também no 304 (X-Store-Seq)
+        seq = current_store_seq(current_user.store_id)
+        # Nada mudou na loja desde o último polling: 304 sem ir ao banco
+        not_modified = check_not_modified(request, response, current_user.store_id, current_user.id, seq=seq)
+        if not_modified: return not_modified
+
         # 1. IDENTIFICAÇÃO DO CAIXA
         tz_br = pytz.timezone('America/Sao_Paulo')
         now = datetime.now(tz_br).replace(tzinfo=None)
         
-        last_opening = db.query(CashOpening).filter(CashOpening.store_id == current_user.store_id).order_by(desc(CashOpening.created_at)).first()
-        last_closing = db.query(CashClosing).filter(CashClosing.store_id == current_user.store_id).order_by(desc(CashClosing.closed_at)).first()
-
-        is_box_open = False
-        current_cash_id = None
-        start_dt_box = now 
-
-        if last_opening:
-            if last_closing and last_closing.closed_at > last_opening.created_at:
-                is_box_open = False 
-            else:
-                is_box_open = True
-                current_cash_id = last_opening.id
-                start_dt_box = last_opening.created_at
-        
-        if not is_box_open:
-             start_dt_box = now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        # --- CORREÇÃO AQUI: Cria a query base ---
-        all_box_orders = []
-
-        if is_box_open:
-            stats_query = db.query(Order).filter(Order.store_id == current_user.store_id)
-            
-            if current_cash_id:
-                stats_query = stats_query.filter(
-                    or_(
-                        Order.cash_opening_id == current_cash_id,
-                        # Pega também orfãos recentes para a função de "varrer" funcionar visualmente assim que abre
-                        and_(Order.cash_opening_id == None, Order.created_at >= start_dt_box)
-                    )
-                )
-            else:
-                # Fallback de segurança
-                stats_query = stats_query.filter(Order.created_at >= start_dt_box)
-
-            # Só executa a query pesada se o caixa estiver aberto
-            all_box_orders = stats_query.with_entities(
-                Order.id,
-                Order.items_json,
-                Order.payment_method,
-                Order.wabiz_id,
-                Order.status,
-                Order.table_number,
-                Order.address_street
-            ).all()
-
-
-        prod_stats = {"pizzas": 0, "esfihas": 0, "beirutes": 0}
-        platform_stats = {"ifood": 0, "wabiz": 0, "pdv": 0}
-        counts = {"delivery": {"total": 0, "prep": 0, "ready": 0}, "balcao": {"total": 0, "prep": 0, "ready": 0}, "mesas": 0}
-
-        # === 🧠 SUPER MAPA DE CATEGORIAS (ID + NOME + EXTERNAL CODE) ===
-        # 1. Carrega Produtos Normais
-        products_db = db.query(Product).options(joinedload(Product.category)).filter(Product.store_id == current_user.store_id).all()
-        
-        # 2. Carrega Mapeamentos (Integrações)
-        mappings_db = db.query(ProductMapping).options(joinedload(ProductMapping.product).joinedload(Product.category)).filter(ProductMapping.store_id == current_user.store_id).all()
-        
-        cat_map = {} # Chave -> Nome da Categoria (UPPER)
-
-        # Indexa Produtos por ID e Nome
-        for p in products_db:
-            if p.category:
-                c_name = p.category.name.upper()
-                cat_map[str(p.id)] = c_name
-                cat_map[p.name.strip().upper()] = c_name
-
-        # Indexa por Código Externo (O Pulo do Gato para iFood/Wabiz)
-        for m in mappings_db:
-            if m.product and m.product.category and m.external_code:
-                c_name = m.product.category.name.upper()
-                cat_map[str(m.external_code)] = c_name
-
-        # Loop de Contagem (LÓGICA CORRIGIDA)
-        for o in all_box_orders:
-            
-            # Pula cancelados
-            if o.status and "CANCELADO" in o.status.upper(): 
-                continue
-            
-            # A. Produtos
-            if o.items_json:
-                for item in o.items_json:
-                    try: qty = float(item.get('quantity', 1))
-                    except: qty = 1.0
-                    
-                    # Ignora itens que são apenas cabeçalhos de combo ou taxas
-                    name_upper = str(item.get('title') or item.get('name') or "").upper()
-                    if "TAXA" in name_upper or "ENTREGA" in name_upper: continue
-
-                    # 1. Tenta identificar categoria pelo mapa (Código/ID)
-                    possible_keys = [
-                        str(item.get('externalCode', '')),
-                        str(item.get('external_code', '')),
-                        str(item.get('code', '')),
-                        str(item.get('id', '')),
-                        str(item.get('product_id', '')),
-                    ]
-                    
-                    found_cat = ""
-                    for key in possible_keys:
-                        if key and key in cat_map:
-                            found_cat = cat_map[key]
-                            break
-                    
-                    # 2. DECISÃO HÍBRIDA (Prioriza Nome > Categoria)
-                    # Isso corrige "Esfiha cadastrada na categoria Pizza"
-                    
-                    # Verifica ESFIHA (Prioridade Alta)
-                    if 'ESFIHA' in name_upper or 'ESFIHA' in found_cat:
-                        prod_stats['esfihas'] += int(qty)
-                        
-                    # Verifica BEIRUTE
-                    elif 'BEIRUTE' in name_upper or 'BEIRUTE' in found_cat:
-                        prod_stats['beirutes'] += int(qty)
-                        
-                    # Verifica PIZZA (Última prioridade, pois é termo genérico)
-                    elif 'PIZZA' in name_upper or 'PIZZA' in found_cat:
-                        # Evita contar "Massa de Pizza" ou "Borda de Pizza" como uma Pizza inteira
-                        if "BORDA" not in name_upper and "MASSA" not in name_upper:
-                            prod_stats['pizzas'] += int(qty)
-                            
-
-            # B. Plataforma
-            pm = (o.payment_method or "").lower()
-            wid = str(o.wabiz_id or "")
-            if "ifood" in pm: platform_stats["ifood"] += 1
-            elif wid and not wid.startswith("M-"): platform_stats["wabiz"] += 1
-            else: platform_stats["pdv"] += 1
-
-            # C. Badges
-            st = (o.status or "").upper()
-            if o.table_number:
-                if st not in ['ENTREGUE', 'CONCLUIDO']: counts['mesas'] += 1
-            else:
-                is_balcao = "RETIRADA" in (o.address_street or "").upper() or not o.address_street
-                target = counts['balcao'] if is_balcao else counts['delivery']
-                if st not in ['CONCLUIDO']:
-                    target['total'] += 1
-                    if st in ['PREPARO', 'PENDENTE', 'FORNO']: target['prep'] += 1
-                    if st in ['PRONTO', 'SAIU_ENTREGA']: target['ready'] += 1
-
-        # 3. QUERY OPERACIONAL (LISTA VISUAL)
-        list_query = db.query(Order).options(joinedload(Order.driver)).filter(Order.store_id == current_user.store_id)
-
-        if start:
-            s_dt = datetime.strptime(start, '%Y-%m-%d')
-            e_dt = datetime.strptime(end, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if end else now
-            list_query = list_query.filter(Order.created_at >= s_dt, Order.created_at <= e_dt)
-        else:
-            active_statuses = ['PENDENTE', 'PREPARO', 'PRONTO', 'SAIU_ENTREGA', 'FORNO', 'EXPEDICAO']
-            if is_box_open:
-                if current_cash_id and hasattr(Order, 'cash_opening_id'):
-                     list_query = list_query.filter(or_(Order.cash_opening_id == current_cash_id, Order.created_at >= start_dt_box, Order.status.in_(active_statuses)))
-                else:
-                    list_query = list_query.filter(or_(Order.created_at >= start_dt_box, Order.status.in_(active_statuses)))
-            else:
-                last_closing_dt = last_closing.closed_at if last_closing else now
-                list_query = list_query.filter(or_(Order.created_at >= last_closing_dt, Order.status.in_(active_statuses)))
-
-        if search and search.strip():
-            term = f"%{search}%"
-            list_query = list_query.filter(or_(Order.customer_name.ilike(term), Order.wabiz_id.ilike(term), cast(Order.id, String).ilike(term)))
-
-        if platform and platform != 'all':
-            if platform == 'ifood': list_query = list_query.filter(Order.payment_method.ilike('%ifood%'))
-            elif platform == 'wabiz': list_query = list_query.filter(and_(not_(Order.wabiz_id.ilike('M-%')), not_(Order.payment_method.ilike('%ifood%'))))
-            elif platform == 'pdv': list_query = list_query.filter(or_(Order.wabiz_id.ilike('M-%'), Order.payment_method.ilike('%pdv%')))
-
-        
-        if driver_id:
-            list_query = list_query.filter(Order.driver_id == driver_id)
-        
-        if tab == 'delivery':
-            list_query = list_query.filter(Order.table_number == None, Order.address_street != None, Order.address_street != '', not_(Order.address_street.ilike('Retirada%')), not_(Order.address_street.ilike('%Balcão%')), not_(Order.address_street.ilike('%Balcao%')))
-        elif tab == 'balcao':
-            list_query = list_query.filter(Order.table_number == None, or_(Order.address_street.ilike('Retirada%'), Order.address_street.ilike('%Balcão%'), Order.address_street.ilike('%Balcao%'), Order.address_street == None, Order.address_street == ''))
-        elif tab == 'mesas':
-            list_query = list_query.filter(Order.table_number != None, not_(Order.status.in_(['ENTREGUE', 'CONCLUIDO', 'FINALIZADO'])), not_(Order.status.ilike('CANCELADO%')))
-
-        orders_list = list_query.order_by(desc(Order.created_at)).all()
-        
-        # 4. Montagem
-        data = []
-        for o in orders_list:
-            if o.status and "CANCELADO" in o.status.upper(): continue
-            
-            dtype = o.delivery_type 
-            
-            if dtype == 'delivery' and "retirada" in (o.address_street or "").lower():
-                dtype = "balcao"
+        # Estado do caixa em cache (sem as 2 consultas de abertura/fechamento a cada polling)
+        cash = get_cash_state(db, current_user.store_id)
 
-            if not dtype:
-                dtype = "delivery" 
-                if o.table_number: dtype = "mesa"
-                elif "retirada" in (o.address_street or "").lower(): dtype = "balcao"
-                
-            
-            driver_name = o.driver.full_name if o.driver else "Sem Motoboy"
-            neighborhood = o.address_neighborhood if o.address_neighborhood else "OUTROS"
-            final_delivery_fee = float(o.delivery_fee or 0.0)
-            
-            if final_delivery_fee == 0 and o.items_json:
-                 for item in o.items_json:
-                    try:
-                        title = (item.get('title') or item.get('name') or "").lower()
-                        price = float(item.get('price', 0)) * float(item.get('quantity', 1))
-                        if ('taxa' in title or 'entrega' in title) and price > 0: final_delivery_fee += price
-                    except: pass
-
-            # --- CÁLCULO DE TEMPO CORRIGIDO (UTC -> BR) ---
-            utc = pytz.utc
-            br_zone = pytz.timezone('America/Sao_Paulo')
-            now_aware = datetime.now(br_zone)
-            
-            minutes_elapsed = 0
-            formatted_time = "--:--"
-            
-            if o.created_at:
-                raw_dt = o.created_at
-                # Se vier sem fuso do banco, marca como UTC
-                if raw_dt.tzinfo is None:
-                    raw_dt = utc.localize(raw_dt)
-                
-                # Converte para Brasil
-                local_dt = raw_dt.astimezone(br_zone)
-                
-                formatted_time = local_dt.strftime('%H:%M')
-                minutes_elapsed = int((now_aware - local_dt).total_seconds() / 60)
-            # ---------------------------------------------
-            
-            pm = (o.payment_method or "").lower()
-            wid = str(o.wabiz_id or "")
-            plat_code = "PDV"
-            if "ifood" in pm: plat_code = "IFOOD"
-            elif not wid.startswith("M-"): plat_code = "WABIZ"
-
-            items_summary = ""
-            if o.items_json:
-                items_summary = ", ".join([f"{int(i.get('quantity',1))}x {i.get('title') or i.get('name') or 'Item'}" for i in o.items_json])
-
-
-
-            final_name = o.customer_name or "Cliente"
-            
-            # --- SUBSTIUIÇÃO: USANDO O NORMALIZADOR UNIFICADO ---
-            try:
-                items_normalized = normalize_order_items_for_view(o)
-            except Exception as e:
-                print(f"⚠️ Erro ao normalizar pedido {o.id}: {e}")
-                # Fallback: Usa os itens brutos se der erro, para não travar a tela
-                items_normalized = o.items_json or [] 
-            
-            # Gera uma string simples para resumo
-            try:
-                items_summary = ", ".join([f"{i.get('quantity', 1)}x {i.get('name', 'Item')}" for i in items_normalized])
-            except:
-                items_summary = "Erro ao listar itens"
-            
-
-            data.append({
-                "id": o.id,
-                "wabiz_id": o.wabiz_id or str(o.id),
-                "name": final_name,
-                "customer_name": final_name,
-                "phone": o.customer_phone,
-                "customer_phone": o.customer_phone,
-                "total": float(o.total_value or 0.0),
-                "discount": float(o.discount or 0.0),
-                "delivery_fee": final_delivery_fee,
-                "service_fee": float(o.service_fee or 0.0),
-                "status": o.status,
-                "payment": o.payment_method,
-                "time": formatted_time,
-                "minutes_elapsed": minutes_elapsed,
-                "items": items_normalized,
-                "items_desc": items_summary,
-                
-                # --- CAMPOS ADICIONADOS PARA CORRIGIR O BUG ---
-                "address_street": o.address_street,
-                "address_number": o.address_number,
-                # ----------------------------------------------
-                
-                "address": f"{o.address_street}, {o.address_number} - {neighborhood}" if o.address_street else "Retirada",
-                "neighborhood": neighborhood,
-                "table": o.table_number,
-                "delivery_type": dtype,
-                "driver_name": driver_name,
-                "driver_id": o.driver_id,
-                "driver_tip": float(o.driver_tip or 0.0),
-                "customer_credit": float(o.customer_credit or 0.0),
-                "platform": plat_code,
-                
-                "obs": o.notes or "",
-                
-            })
-
-        def normalize_neigh_py(text):
-            if not text: return "OUTROS"
-            text = unicodedata.normalize('NFKD', str(text)).encode('ASCII', 'ignore').decode('ASCII')
-            return "".join([c for c in text if c.isalnum() or c.isspace()]).strip().upper()
+        # 2. SEÇÕES (cada aba pede só o que a tela mostra)
+        wanted = set((sections or ("kanban,counts" if tab == 'delivery' else "list,counts")).split(','))
+        base = _board_query(db, current_user.store_id, cash, tab, search, platform, start, end, driver_id, now)
 
         kanban_data = { "PREPARO": [], "PRONTO": [], "SAIU_ENTREGA": [], "ENTREGUE": [] }
-        pronto_groups = {} 
-
-        for item in data:
-            raw_st = (item['status'] or '').upper()
-            st = 'PREPARO' if raw_st == 'PENDENTE' else raw_st
-            if raw_st in ['FORNO', 'EXPEDICAO', 'PRONTO_COZINHA']:
-                st = 'PREPARO'
-                item['css_class'] = 'card-oven'
-
-            if st == 'PREPARO':
-                kanban_data['PREPARO'].append(item)
-            elif st == 'SAIU_ENTREGA':
-                kanban_data['SAIU_ENTREGA'].append(item)
-            elif st == 'ENTREGUE':
-                kanban_data['ENTREGUE'].append(item)
-            elif st == 'PRONTO':
-                neigh_raw = item.get('neighborhood') or 'Outros'
-                neigh_key = normalize_neigh_py(neigh_raw)
-                if neigh_key not in pronto_groups:
-                    pronto_groups[neigh_key] = {"name": neigh_raw.upper().strip(), "orders": [], "total_value": 0.0}
-                pronto_groups[neigh_key]['orders'].append(item)
-                pronto_groups[neigh_key]['total_value'] += item['total']
-            elif st in kanban_data:
-                kanban_data[st].append(item)
-
-        kanban_data['PRONTO'] = sorted(list(pronto_groups.values()), key=lambda x: len(x['orders']), reverse=True)
-        if len(kanban_data['ENTREGUE']) > 20:
-             kanban_data['ENTREGUE'] = kanban_data['ENTREGUE'][-20:]
-             
-        # Sobrescreve a contagem do loop para garantir que só pegue mesas não finalizadas
-        real_open_tables = db.query(Order).filter(
-            Order.store_id == current_user.store_id,
-            Order.table_number != None,
-            not_(Order.status.in_(['ENTREGUE', 'CONCLUIDO', 'FINALIZADO'])),
-            not_(Order.status.ilike('%CANCELADO%'))
-        ).count()
-        
-        counts['mesas'] = real_open_tables
-        
-
         final_orders_list = []
-        if tab != 'delivery':
-            final_orders_list = data
+        delivered_cursor = None
+        list_cursor = None
+        prod_stats, platform_stats, counts = None, None, None
+
+        if 'kanban' in wanted:
+            # Colunas ativas inteiras + primeira página do ENTREGUE (keyset)
+            active_rows = base.filter(Order.status.in_(KANBAN_ACTIVE_STATUSES)).order_by(desc(Order.created_at), desc(Order.id)).all()
+            delivered_rows = _delivered_page(base, None, DELIVERED_PAGE_SIZE)
+            cards = _rows_to_cards(db, active_rows + delivered_rows)
+            kanban_data = build_kanban(cards)
+            if len(delivered_rows) == DELIVERED_PAGE_SIZE:
+                delivered_cursor = _encode_cursor(delivered_rows[-1])
+
+        if 'list' in wanted:
+            # Ativos inteiros (nenhum pedido em produção some da tela) + primeira página do histórico
+            active_rows = base.filter(Order.status.in_(KANBAN_ACTIVE_STATUSES)).order_by(desc(Order.created_at), desc(Order.id)).all()
+            history_rows = _history_page(base, None, LIST_PAGE_SIZE)
+            final_orders_list = _rows_to_cards(db, active_rows + history_rows)
+            if len(history_rows) == LIST_PAGE_SIZE:
+                list_cursor = _encode_cursor(history_rows[-1])
+
+        if 'counts' in wanted:
+            # Contadores do cabeçalho (mantidos incrementalmente, ver services/board_stats.py)
+            prod_stats, platform_stats, counts = stats_payload(get_board_stats(db, current_user.store_id, cash))
+
+            # Sobrescreve a contagem para garantir que só pegue mesas não finalizadas
+            counts['mesas'] = db.query(func.count(Order.id)).filter(
+                Order.store_id == current_user.store_id,
+                Order.table_number != None,
+                not_(Order.status.in_(['ENTREGUE', 'CONCLUIDO', 'FINALIZADO'])),
+                not_(Order.status.ilike('%CANCELADO%'))
+            ).scalar()
 
         return {
             "orders": final_orders_list,
             "kanban": kanban_data, 
+            "delivered_cursor": delivered_cursor,
+            "list_cursor": list_cursor,
             "counts": counts, 
             "product_stats": prod_stats, 
             "platform_stats": platform_stats
@@ -506,6 +303,56 @@ def get_orders_api(
         return JSONResponse(status_code=500, content={"message": str(e)})
     
 
+# --- PRÓXIMAS PÁGINAS DO ENTREGUE (KEYSET) ---
+@router.get("/admin/api/orders/delivered")
+def get_delivered_orders_api(
+    tab: str = Query("delivery"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DELIVERED_PAGE_SIZE, le=100),
+    search: Optional[str] = None,
+    platform: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    driver_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_mixed_current_user)
+):
+    now = datetime.now(pytz.timezone('America/Sao_Paulo')).replace(tzinfo=None)
+    cash = get_cash_state(db, current_user.store_id)
+    base = _board_query(db, current_user.store_id, cash, tab, search, platform, start, end, driver_id, now)
+
+    rows = _delivered_page(base, _decode_cursor(cursor) if cursor else None, limit)
+    return {
+        "orders": _rows_to_cards(db, rows),
+        "next_cursor": _encode_cursor(rows[-1]) if len(rows) == limit else None
+    }
+
+
+@router.get("/admin/api/orders/history")
+def get_history_orders_api(
+    tab: str = Query("balcao"),
+    cursor: Optional[str] = None,
+    limit: int = Query(LIST_PAGE_SIZE, le=100),
+    search: Optional[str] = None,
+    platform: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    driver_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_mixed_current_user)
+):
+    """Próximas páginas do histórico das abas em lista (list_cursor do /admin/api/orders/list)."""
+    now = datetime.now(pytz.timezone('America/Sao_Paulo')).replace(tzinfo=None)
+    cash = get_cash_state(db, current_user.store_id)
+    base = _board_query(db, current_user.store_id, cash, tab, search, platform, start, end, driver_id, now)
+
+    rows = _history_page(base, _decode_cursor(cursor) if cursor else None, limit)
+    return {
+        "orders": _rows_to_cards(db, rows),
+        "next_cursor": _encode_cursor(rows[-1]) if len(rows) == limit else None
+    }
+
+
 # --- NOVA ROTA: AUDITORIA DE PEDIDOS ---
 @router.get("/admin/api/orders/audit")
 def get_audit_orders(
@@ -613,7 +460,9 @@ def get_single_order_api(order_id: int, db: Session = Depends(get_db), current_u
         subtotal = 0.0
         
         if order.items_json:
-            for i in order.items_json:
+            # Estágio de cada item no KDS (order_item_stages): o PDV devolve isso ao salvar
+            stages = load_item_stages(db, [order.id]).get(order.id, {})
+            for i in apply_item_stages(order.items_json, stages):
                 try: 
                     qty = float(i.get('quantity', 1))
                     price = float(i.get('price', 0))
@@ -844,7 +693,7 @@ def bulk_update_status(
         db.commit()
         
         # Avisa o KDS
-        background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+        background_tasks.add_task(broadcast_deltas, order_delta_messages(orders_to_update, "order_status"))
         
         return {"success": True, "message": f"{len(ids_list)} pedidos atualizados!"}
     except Exception as e:
@@ -908,7 +757,7 @@ def bulk_cancel_orders(
             except Exception as e:
                 print(f"⚠️ Erro silencioso API externa pedido {order.id}: {e}")
 
-        background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+        background_tasks.add_task(broadcast_deltas, order_delta_messages(orders, "order_status"))
         
         return {"success": True, "message": f"{count} pedidos cancelados."}
         
@@ -970,7 +819,7 @@ def bulk_revert_orders(
                             process_ifood_update(adapter, order, new_st, old_st)
                 except: pass # Ignora erros de conexão no revert
         
-        background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+        background_tasks.add_task(broadcast_deltas, order_delta_messages(orders, "order_status"))
         
         return {"success": True, "message": f"{count} pedidos retrocedidos."}
         
@@ -1024,7 +873,7 @@ def assign_driver(
                     import traceback
                     traceback.print_exc()
 
-        background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+        background_tasks.add_task(broadcast_deltas, order_delta_messages(orders, "order_status"))
         background_tasks.add_task(manager.broadcast, current_user.store_id, f"driver_update:{driver_id}")
         
         return {"success": True, "message": f"{count} pedidos despachados com sucesso!"}
@@ -1037,23 +886,7 @@ def assign_driver(
 def normalize_signature(items_list):
     """Gera uma assinatura única dos itens para saber se houve alteração real."""
     if not items_list: return "VAZIO"
-    signatures = []
-    for item in items_list:
-        pid = str(item.get('product_id') or item.get('id') or "0")
-        try: qty = "{:.2f}".format(float(item.get('quantity', 0)))
-        except: qty = "0.00"
-        
-        raw_obs = str(item.get('observation') or "").strip().lower()
-        obs = raw_obs if raw_obs not in ["none", "null", ""] else ""
-        
-        raw_parts = item.get('parts') or []
-        parts = sorted([str(p).strip().lower() for p in raw_parts])
-        
-        raw_rem = item.get('removed_ingredients') or []
-        rem = sorted([str(r) for r in raw_rem])
-        
-        signatures.append(f"{pid}|{qty}|{obs}|{parts}|{rem}")
-    return sorted(signatures)
+    return sorted(item_signature(item) for item in items_list)
 
 
 # --- SALVAR PEDIDO (ATUALIZADO COM TROCO) ---
@@ -1139,6 +972,9 @@ def save_order_manual(
             sig_old = normalize_signature(order.items_json)
             sig_new = normalize_signature(items_data)
             items_changed = (sig_old != sig_new)
+            # Itens mudaram (posições podem ter mudado): cada item antigo leva o seu estágio
+            # para a nova posição; só os itens novos usam o kds_stage que veio da tela
+            if items_changed: remap_item_stages(db, order.id, order.items_json, items_data)
             
             # Atualiza Dados
             order.customer_name = customer_name
@@ -1259,6 +1095,10 @@ def save_order_manual(
                 cash_opening_id = current_cash_id,
             )
             db.add(order)
+
+        # Setor de produção de cada item (depois da comparação de assinaturas acima)
+        try: stamp_item_sectors(db, current_user.store_id, items_data)
+        except Exception as e: print(f"⚠️ Erro ao definir setores dos itens: {e}")
             
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(order, "items_json")
@@ -1285,8 +1125,8 @@ def save_order_manual(
                 print(f"⚠️ Erro ao notificar finalização no save_order: {e}")
         # --- FIM DA CORREÇÃO ---
 
-        # Envia evento de atualização para atualizar as telas (Mesas/Kanban)
-        background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+        # Envia o pedido atualizado para as telas (Mesas/Kanban)
+        background_tasks.add_task(broadcast_deltas, order_delta_messages([order], "order_status" if order_id else "order_created"))
         
         return {"success": True}
 
@@ -1348,7 +1188,7 @@ def update_order_status(
         print(f"⚠️ Erro silencioso ao notificar pedido #{order_id}: {str(e)}")
 
     # Dispara atualização do KDS (Socket)
-    background_tasks.add_task(manager.broadcast, current_user.store_id, "update")
+    background_tasks.add_task(broadcast_deltas, order_delta_messages([order], "order_status"))
     
     return {"success": True}
 
@@ -1363,10 +1203,11 @@ async def delete_order(
     if not order or order.store_id != current_user.store_id:
         return JSONResponse(status_code=403, content={"message": "Erro"})
     
+    deltas = order_delta_messages([order], "order_deleted")
     db.delete(order)
     db.commit()
     
-    asyncio.create_task(manager.broadcast(current_user.store_id, "update"))
+    asyncio.create_task(broadcast_deltas(deltas))
     
     return {"success": True}
 
@@ -1396,7 +1237,7 @@ async def close_account(
     db.commit()
     
     # Avisa todas as telas para removerem a mesa da lista
-    await manager.broadcast(current_user.store_id, "update")
+    await broadcast_deltas(order_delta_messages([order], "order_status"))
     
     return {"success": True}
 
@@ -1446,7 +1287,7 @@ async def cancel_order_endpoint(
     
     db.commit()
     
-    asyncio.create_task(manager.broadcast(current_user.store_id, "update"))
+    asyncio.create_task(broadcast_deltas(order_delta_messages(orders_to_cancel, "order_status")))
     
     return {"success": True, "message": "Pedido cancelado localmente e nas plataformas."}
 
@@ -1673,7 +1514,7 @@ def print_order_receipt(
     
     # --- CORREÇÃO: Usamos o Normalizador para limpar a 'tripa' ---
     # Isso separa o Título dos Sabores/Adicionais
-    clean_items = normalize_order_items_for_view(order)
+    clean_items = get_items_view(order)
     # -------------------------------------------------------------
     
     plat = "PDV"
@@ -1726,7 +1567,7 @@ def get_order_text_format(
     
     # --- CORREÇÃO AQUI TAMBÉM ---
     # Usa o normalizador para quebrar as linhas corretamente
-    items_clean = normalize_order_items_for_view(order)
+    items_clean = get_items_view(order)
     
     for item in items_clean:
         qty = int(item.get('quantity', 1))
@@ -10,9 +10,12 @@ from services.background_jobs import (
     run_opportunity_scanner,
     send_morning_reports,
     run_rfm_analysis_cron,
+    run_basket_rules_cron,
     dispatch_smart_event
 )
 from services.crm_engine import run_crm_automations
+from services.outbox import drain_outbox
+from services.sales_rollup import refresh_recent_rollups
 
 def rodar_robo():
     print("🤖 [Robô Dedicado] Iniciando processo único...")
@@ -25,11 +28,18 @@ def rodar_robo():
     
     # 1. Sincronizar pedidos externos (Wabiz/iFood) a cada 30 segundos
     scheduler.add_job(sync_external_orders, "interval", seconds=30)
+
+    # 1.1 Outbox (Pixel, confirmação iFood/Wabiz, KDS) - retentativas a cada 10 segundos
+    # (pedidos novos já disparam a drenagem na hora; aqui é a rede de segurança)
+    scheduler.add_job(drain_outbox, "interval", seconds=10)
     
     # 2. Automações de CRM (Mensagens automáticas) - roda a cada hora cheia
     # Nota: Instanciamos o banco aqui
     scheduler.add_job(run_crm_automations, "cron", minute=0, args=[SessionLocal()])
     
+    # 2.1 Cesta de compras (regras de combos) - só a diferença, antes do scanner
+    scheduler.add_job(run_basket_rules_cron, "cron", minute=45)
+
     # 3. Scanner de Oportunidades (Recuperação de vendas) - a cada 60 min
     scheduler.add_job(run_opportunity_scanner, "interval", minutes=60)
     
@@ -39,6 +49,10 @@ def rodar_robo():
     # 5. Análise RFM (Classificação de clientes) - às 22:35
     scheduler.add_job(run_rfm_analysis_cron, "cron", hour=22, minute=35)
 
+    # 6. Resumos de vendas (dashboard/relatórios) - refaz hoje e ontem a cada 10 min
+    # (cada pedido gravado já recalcula o dia; aqui pega UPDATE em massa e falhas)
+    scheduler.add_job(refresh_recent_rollups, "interval", minutes=10)
+
     # Inicia o agendador
     scheduler.start()
     print("✅ [Robô Dedicado] Todos os agendamentos ativos. Pressione Ctrl+C para sair.")
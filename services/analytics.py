@@ -1,6 +1,12 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, func, not_
-from models import Order, Customer
+from sqlalchemy import func, desc, and_, func, not_, extract
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from models import Order, Customer, OrderItem
+from services import sales_rollup
+from services.order_items import order_items_ready
+from services.market_basket import top_rules
+from services.cache import get_redis, mark_redis_down
+from services.store_version import store_version
 from datetime import datetime, timedelta
 import google.generativeai as genai
 import os
@@ -17,6 +23,33 @@ GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 if GEMINI_KEY:
     genai.configure(api_key=GEMINI_KEY)
 
+HEATMAP_CACHE_TTL = 600
+
+
+def _range_key(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _cache_get(key):
+    r = get_redis()
+    if r is None: return None
+    try:
+        raw = r.get(key)
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        mark_redis_down(e)
+        return None
+
+
+def _cache_set(key, value, ttl):
+    r = get_redis()
+    if r is None: return
+    try:
+        r.set(key, json.dumps(value), ex=ttl)
+    except Exception as e:
+        mark_redis_down(e)
+
+
 class PizzaBrain:
     def __init__(self, db: Session, store_id: int):
         self.db = db
@@ -48,13 +81,22 @@ class PizzaBrain:
 
     def get_kpis(self, start_date=None, end_date=None, payment_method=None):
         """Calcula faturamento, total de pedidos e ticket médio com filtros"""
-        query = self.db.query(Order)
-        
-        # CORREÇÃO: Aplica os filtros antes de somar
-        orders = self._apply_filters(query, start_date, end_date, payment_method).all()
+        # 1. Resumo por hora (services/sales_rollup.py), quando o período permite
+        totals = sales_rollup.sales_totals(self.db, self.store_id, start_date, end_date, payment_method)
+        if totals is not None:
+            total_orders, total_revenue = totals
+        else:
+            # 2. Agregado no banco: antes carregava cada Order inteiro (com items_json) só para somar
+            query = self.db.query(
+                func.count(Order.id),
+                func.coalesce(func.sum(Order.total_value), 0.0),
+            )
+            
+            # CORREÇÃO: Aplica os filtros antes de somar
+            total_orders, total_revenue = self._apply_filters(query, start_date, end_date, payment_method).one()
         
-        total_revenue = sum(o.total_value or 0 for o in orders)
-        total_orders = len(orders)
+        total_revenue = float(total_revenue or 0)
+        total_orders = int(total_orders or 0)
         avg_ticket = total_revenue / total_orders if total_orders > 0 else 0
         
         estimated_profit = total_revenue * 0.30 
@@ -68,27 +110,38 @@ class PizzaBrain:
 
     def get_sales_heatmap(self, start_date=None, end_date=None):
         """Gera matriz para o mapa de calor baseada no período filtrado"""
-        query = self.db.query(Order.created_at)
-        orders = self._apply_filters(query, start_date, end_date).all()
+        # Cache por (loja, período). A versão da loja (services/store_version.py) entra na
+        # chave: qualquer pedido gravado (ou resumo recalculado) gera uma chave nova.
+        version = store_version(self.store_id)
+        cache_key = None
+        if version is not None:
+            cache_key = f"heatmap:{self.store_id}:{version}:{_range_key(start_date)}:{_range_key(end_date)}"
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        heatmap = sales_rollup.sales_heatmap(self.db, self.store_id, start_date, end_date)
+        if heatmap is None:
+            heatmap = self._sales_heatmap_sql(start_date, end_date)
+
+        if cache_key:
+            _cache_set(cache_key, heatmap, HEATMAP_CACHE_TTL)
+        return heatmap
+
+    def _sales_heatmap_sql(self, start_date=None, end_date=None):
+        """Contagem por dia da semana x hora de Brasília, agrupada no banco"""
+        # created_at é UTC sem fuso: AT TIME ZONE 'UTC' e depois 'America/Sao_Paulo'
+        local_dt = func.timezone('America/Sao_Paulo', func.timezone('UTC', Order.created_at))
+        day_col = extract('isodow', local_dt)  # 1 = Seg ... 7 = Dom
+        hour_col = extract('hour', local_dt)
+
+        query = self.db.query(day_col, hour_col, func.count(Order.id)).filter(Order.created_at != None)
+        rows = self._apply_filters(query, start_date, end_date).group_by(day_col, hour_col).all()
         
         # Matriz 7 (dias) x 24 (horas)
         heatmap = [[0 for _ in range(24)] for _ in range(7)]
-        
-        # Fusos
-        import pytz
-        utc = pytz.utc
-        br_zone = pytz.timezone('America/Sao_Paulo')
-        
-        for o in orders:
-            if not o.created_at: continue
-            
-            # Pega data do banco (UTC) e converte para BR
-            dt_utc = o.created_at.replace(tzinfo=utc) 
-            dt_br = dt_utc.astimezone(br_zone)
-            
-            day_idx = dt_br.weekday() # 0 = Seg, 6 = Dom
-            hour_idx = dt_br.hour
-            heatmap[day_idx][hour_idx] += 1
+        for day_idx, hour_idx, count in rows:
+            heatmap[int(day_idx) - 1][int(hour_idx)] += count # 0 = Seg, 6 = Dom
             
         return heatmap
 
@@ -106,35 +159,40 @@ class PizzaBrain:
         if isinstance(start_date, int):
              start_date = datetime.now() - timedelta(days=start_date)
         
-        # Aplica filtros de Loja (SaaS), Data e Pagamento
-        query = self._apply_filters(query, start_date, end_date, payment_method)
-            
-        orders = query.all()
+        # Resumo por dia (services/sales_rollup.py), quando o período é de dias cheios
+        product_map = sales_rollup.top_products(self.db, self.store_id, start_date, end_date, payment_method)
         
-        product_map = {}
-        for o in orders:
-            # Proteção contra pedidos sem itens
-            if not o.items_json: continue
-            
-            # Garante que seja uma lista (caso o banco retorne algo estranho)
-            items = o.items_json if isinstance(o.items_json, list) else []
+        if product_map is None and order_items_ready(self.db, self.store_id):
+            # Itens já extraídos (services/order_items.py): GROUP BY no banco
+            query = self.db.query(
+                OrderItem.title, func.sum(OrderItem.qty), func.sum(OrderItem.qty * OrderItem.unit_price)
+            ).join(Order, Order.id == OrderItem.order_id).filter(OrderItem.parent_index == None)
+            rows = self._apply_filters(query, start_date, end_date, payment_method).group_by(OrderItem.title).all()
+            product_map = {title: {'qty': qty or 0.0, 'revenue': revenue or 0.0} for title, qty, revenue in rows}
+        
+        if product_map is None:
+            # Aplica filtros de Loja (SaaS), Data e Pagamento
+            query = self._apply_filters(query, start_date, end_date, payment_method)
+                
+            orders = query.all()
             
-            for item in items:
-                # Tenta pegar o nome em várias chaves possíveis para robustez
-                name = item.get('title') or item.get('item_name') or item.get('name') or "Produto s/ Nome"
+            product_map = {}
+            for o in orders:
+                # Proteção contra pedidos sem itens
+                if not o.items_json: continue
                 
-                try:
-                    qty = float(item.get('quantity', 1))
-                    price = float(item.get('price', 0))
-                except (ValueError, TypeError):
-                    qty = 1
-                    price = 0.0
+                # Garante que seja uma lista (caso o banco retorne algo estranho)
+                items = o.items_json if isinstance(o.items_json, list) else []
                 
-                if name in product_map:
-                    product_map[name]['qty'] += qty
-                    product_map[name]['revenue'] += (qty * price)
-                else:
-                    product_map[name] = {'qty': qty, 'revenue': qty * price}
+                for item in items:
+                    # Nome em várias chaves possíveis; quantidade/preço com proteção (mesma conta do resumo)
+                    name, qty, revenue = sales_rollup.item_sale(item)
+                    
+                    if name in product_map:
+                        product_map[name]['qty'] += qty
+                        product_map[name]['revenue'] += revenue
+                    else:
+                        product_map[name] = {'qty': qty, 'revenue': revenue}
         
         # Ordena por Quantidade Vendida (Decrescente)
         sorted_products = sorted(product_map.items(), key=lambda x: x[1]['qty'], reverse=True)
@@ -148,23 +206,23 @@ class PizzaBrain:
         start_date = datetime.now() - timedelta(days=days_lookback)
         
         # Query filtrada apenas pela loja e data fixa (sem filtro de tela)
-        orders = self.db.query(Order).filter(
+        # Uma linha por cliente (GROUP BY no banco), sem carregar os pedidos
+        rows = self.db.query(
+            Order.customer_phone,
+            func.array_agg(aggregate_order_by(Order.customer_name, Order.created_at.desc()))[1],
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.total_value), 0.0),
+            func.max(Order.created_at),
+        ).filter(
             Order.store_id == self.store_id,
-            Order.created_at >= start_date
-        ).all()
+            Order.created_at >= start_date,
+            Order.customer_phone != None,
+            Order.customer_phone != "",
+        ).group_by(Order.customer_phone).all()
         
         customers = {}
-        for o in orders:
-            key = o.customer_phone
-            if not key: continue
-            
-            if key not in customers:
-                customers[key] = {"name": o.customer_name, "count": 0, "total_spent": 0, "last_order": o.created_at}
-            
-            c = customers[key]
-            c["count"] += 1
-            c["total_spent"] += float(o.total_value or 0)
-            if o.created_at > c["last_order"]: c["last_order"] = o.created_at
+        for phone, name, count, total_spent, last_order in rows:
+            customers[phone] = {"name": name, "count": count, "total_spent": float(total_spent or 0), "last_order": last_order}
 
         customer_list = []
         now = datetime.now()
@@ -264,11 +322,11 @@ class PizzaBrain:
     def generate_daily_report_text(self):
         """Gera o relatório detalhado de ontem para o WhatsApp"""
         
-        # 1. Define o intervalo "Ontem"
-        today = datetime.now().date()
+        # 1. Define o intervalo "Ontem" (dia de Brasília, em UTC como o banco grava)
+        today = datetime.now(sales_rollup.TZ_BR).date()
         yesterday = today - timedelta(days=1)
-        start_dt = datetime.combine(yesterday, datetime.min.time())
-        end_dt = datetime.combine(yesterday, datetime.max.time())
+        start_dt, next_day_dt = sales_rollup.day_bounds_utc(yesterday)
+        end_dt = next_day_dt - timedelta(seconds=1)
         
         # 2. Coleta Dados
         kpis = self.get_kpis(start_dt, end_dt)
@@ -329,27 +387,72 @@ class PizzaBrain:
             )
             
         
+    def combo_opportunities(self, limit=3, min_support=5):
+        """
+        Combos (pares e trios) das regras já calculadas (services/market_basket.py).
+        Um insight por conjunto de produtos, na ordem do rank. Lista vazia se a loja
+        ainda não tem regras.
+        """
+        opportunities = []
+        seen = set()
+        for rule in top_rules(self.db, self.store_id, limit=limit * 6, min_support=min_support):
+            items = sorted(list(rule.antecedent or []) + [rule.consequent])
+            if tuple(items) in seen: continue
+            seen.add(tuple(items))
+
+            title_items = " + ".join(items)
+            quoted = " e ".join(f"'{i}'" for i in rule.antecedent or [])
+            opportunities.append({
+                "title": f"Combo Ouro: {title_items}",
+                "message": f"Quem pede {quoted} leva '{rule.consequent}' em **{rule.confidence * 100:.0f}%** das vezes "
+                           f"({rule.lift:.1f}x mais que a média). Foram **{rule.support_count} pedidos** com "
+                           f"{'os três' if len(items) == 3 else 'os dois'} juntos. Vale montar um combo!",
+                "prompt": f"Crie uma imagem publicitária profissional e apetitosa para um delivery de comida. A imagem deve destacar um combo promocional contendo: {', '.join(items)}. Iluminação de estúdio, estilo food porn, fundo escuro elegante, fumaça saindo da comida quente, 4k, ultra realista.",
+                "items": items,
+                "support": rule.support,
+                "confidence": rule.confidence,
+                "lift": rule.lift,
+            })
+            if len(opportunities) >= limit: break
+        return opportunities
+
     def analyze_combos(self, min_support=5):
         """
         Descobre produtos que são comprados juntos frequentemente.
         min_support: Mínimo de vezes que o par deve aparecer para ser relevante.
         """
-        # 1. Pega os últimos 500 pedidos (para ser rápido)
-        orders = self.db.query(Order).filter(
-            Order.store_id == self.store_id
-        ).order_by(desc(Order.created_at)).limit(500).all()
+        # 0. Regras já calculadas no worker (suporte/confiança/lift sobre a janela toda)
+        opportunities = self.combo_opportunities(limit=1, min_support=min_support)
+        if opportunities: return opportunities[0]
+
+        # 1. Sem regras ainda: pega os últimos 500 pedidos (para ser rápido)
+        if order_items_ready(self.db, self.store_id):
+            # Nomes limpos já extraídos (services/order_items.py)
+            last_orders = self.db.query(Order.id).filter(
+                Order.store_id == self.store_id
+            ).order_by(desc(Order.created_at)).limit(500).subquery()
+            rows = self.db.query(OrderItem.order_id, OrderItem.name).filter(
+                OrderItem.order_id.in_(self.db.query(last_orders.c.id)),
+                OrderItem.parent_index == None,
+                OrderItem.name != ""
+            ).distinct().all()
+            baskets = {}
+            for order_id, name in rows:
+                baskets.setdefault(order_id, set()).add(name)
+            baskets = list(baskets.values())
+        else:
+            orders = self.db.query(Order.items_json).filter(
+                Order.store_id == self.store_id
+            ).order_by(desc(Order.created_at)).limit(500).all()
+            baskets = []
+            for (items_json,) in orders:
+                if not items_json: continue
+                # Extrai nomes dos produtos únicos neste pedido
+                baskets.append({item.get('title', '').split('(')[0].strip() for item in items_json} - {""})
         
         pair_counts = Counter()
         
-        for order in orders:
-            if not order.items_json: continue
-            
-            # Extrai nomes dos produtos únicos neste pedido
-            items = set()
-            for item in order.items_json:
-                name = item.get('title', '').split('(')[0].strip() # Limpa nome
-                if name: items.add(name)
-            
+        for items in baskets:
             # Se tiver 2 ou mais itens, gera pares
             if len(items) >= 2:
                 # Ordena para que (Coca, Esfiha) seja igual a (Esfiha, Coca)
@@ -510,24 +613,46 @@ class PizzaBrain:
         
         print(f"🔮 [IA Estoque] Analisando de {analysis_start} até {analysis_end} para cobrir {days_to_cover} dias.")
         
-        # 1. Busca Pedidos
-        orders = self.db.query(Order).filter(
-            Order.store_id == self.store_id,
-            Order.created_at >= analysis_start,
-            Order.created_at <= analysis_end
-        ).all()
-        
-        if not orders:
+        # 1. Vendas por produto nos dias (de Brasília) analisados, sem cancelados
+        first_day, last_day = analysis_start.date(), analysis_end.date()
+        range_start, _ = sales_rollup.day_bounds_utc(first_day)
+        _, range_end = sales_rollup.day_bounds_utc(last_day)
+        if sales_rollup.rollup_ready(self.db, self.store_id):
+            # Resumo por dia (services/sales_rollup.py)
+            sold = sales_rollup.product_totals(self.db, self.store_id, first_day, last_day + timedelta(days=1))
+        elif order_items_ready(self.db, self.store_id):
+            # Itens já extraídos (services/order_items.py)
+            rows = self.db.query(OrderItem.title, func.sum(OrderItem.qty)).filter(
+                OrderItem.store_id == self.store_id,
+                OrderItem.parent_index == None,
+                OrderItem.is_cancelled == False,
+                OrderItem.created_at >= range_start,
+                OrderItem.created_at < range_end
+            ).group_by(OrderItem.title).all()
+            sold = {title: {"qty": qty or 0.0} for title, qty in rows}
+        else:
+            orders = self.db.query(Order.items_json).filter(
+                Order.store_id == self.store_id,
+                not_(Order.status.ilike("%CANCELADO%")),
+                Order.created_at >= range_start,
+                Order.created_at < range_end
+            ).all()
+            sold = {}
+            for (items_json,) in orders:
+                if not isinstance(items_json, list): continue
+                for item in items_json:
+                    if not isinstance(item, dict): continue
+                    name, qty, _ = sales_rollup.item_sale(item)
+                    sold.setdefault(name, {"qty": 0.0})["qty"] += qty
+        
+        if not sold:
             return {"shopping_list": [], "message": "Nenhuma venda encontrada."}
 
-        # 2. Calcula Vendas
+        # 2. Calcula Vendas (nome sem o que vem entre parênteses: tamanho/observação)
         product_sales_total = {}
-        for order in orders:
-            if not order.items_json: continue
-            for item in order.items_json:
-                name = item.get('title', '').split('(')[0].strip()
-                qty = float(item.get('quantity', 1))
-                product_sales_total[name] = product_sales_total.get(name, 0) + qty
+        for full_name, data in sold.items():
+            name = str(full_name).split('(')[0].strip()
+            product_sales_total[name] = product_sales_total.get(name, 0) + data["qty"]
         
         # 3. Média Diária
         delta_days = (analysis_end - analysis_start).days
@@ -674,12 +799,37 @@ class PizzaBrain:
         """
         from models import Ingredient, Order # Import local para evitar ciclo
         
-        # 1. Busca Pedidos no período
-        orders = self.db.query(Order).filter(
-            Order.store_id == self.store_id,
-            Order.created_at >= start_date,
-            Order.created_at <= end_date
-        ).all()
+        # 1. Busca os itens vendidos no período
+        if order_items_ready(self.db, self.store_id):
+            # Itens já extraídos (services/order_items.py): itens iguais (nome + sabores)
+            # viram uma linha só com a quantidade somada -> a ficha técnica roda uma vez por tipo
+            rows = self.db.query(
+                OrderItem.order_id, OrderItem.item_index, OrderItem.parent_index,
+                OrderItem.kind, OrderItem.title, OrderItem.qty
+            ).filter(
+                OrderItem.store_id == self.store_id,
+                OrderItem.kind.in_(["item", "part"]),
+                OrderItem.created_at >= start_date,
+                OrderItem.created_at <= end_date
+            ).order_by(OrderItem.order_id, OrderItem.item_index).all()
+            
+            parents, flavors = {}, {}
+            for order_id, item_index, parent_index, kind, title, qty in rows:
+                if kind == "item": parents[(order_id, item_index)] = (title, qty)
+                else: flavors.setdefault((order_id, parent_index), []).append(title)
+            
+            grouped = {}
+            for key, (title, qty) in parents.items():
+                group = (title, tuple(flavors.get(key, [])))
+                grouped[group] = grouped.get(group, 0.0) + (qty or 0.0)
+            batches = [[{"title": title, "quantity": qty, "parts": list(parts)} for (title, parts), qty in grouped.items()]]
+        else:
+            orders = self.db.query(Order.items_json).filter(
+                Order.store_id == self.store_id,
+                Order.created_at >= start_date,
+                Order.created_at <= end_date
+            ).all()
+            batches = [items_json for (items_json,) in orders if items_json]
         
         # 2. Cache de Ingredientes (para pegar nome, custo e CATEGORIA)
         all_ings = self.db.query(Ingredient).filter(Ingredient.store_id == self.store_id).all()
@@ -688,11 +838,9 @@ class PizzaBrain:
         
         consumption_data = {} 
         
-        for order in orders:
-            if not order.items_json: continue
-            
-            # Explode itens do pedido em ingredientes (usa a função que já existe na classe)
-            usage = self.calculate_inventory_usage(order.items_json)
+        for items in batches:
+            # Explode itens em ingredientes (usa a função que já existe na classe)
+            usage = self.calculate_inventory_usage(items)
             
             for ing_name, qty_used in usage.items():
                 # Tenta achar o ingrediente no banco pelo nome
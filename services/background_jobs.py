@@ -6,22 +6,61 @@ from services.integrations.wabiz import WabizAdapter
 from services.integrations.ifood import IfoodAdapter
 from services.analytics import PizzaBrain
 from services.stock_engine import auto_learn_product, deduct_stock_from_order, enrich_order_with_combo_data
-from services.utils import recover_historical_ip, upsert_customer_smart, upsert_address, dispatch_smart_event, get_active_cash_id
+from services.utils import upsert_customer_smart, upsert_address, get_active_cash_id
 from services.whatsapp import send_whatsapp_template
-from services.tasks import task_send_whatsapp, task_run_rfm_analysis
+from services.tasks import task_send_whatsapp, task_run_rfm_analysis, task_refresh_basket_rules
+from services.outbox import enqueue_event, kick_outbox
+from services.sector_routing import stamp_item_sectors
 from database import SessionLocal
-import requests
 import json
+import os
+import time
+import random
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
 from models import PendingPixelEvent
 
 # ==========================================
 #        FACTORY DE INTEGRAÇÕES (O HUB)
 # ==========================================
 
-def get_active_adapters(store: Store):
+def get_active_integrations(store: Store):
+    """Nomes das integrações ativas da loja (chaves do integrations_config)."""
+    config = store.integrations_config or {}
+    names = []
+    if config.get('wabiz', {}).get('active') and config.get('wabiz', {}).get('user'):
+        names.append('wabiz')
+    if config.get('ifood', {}).get('active') and config.get('ifood', {}).get('client_id'):
+        names.append('ifood')
+    return names
+
+
+# --- REGISTRO DE ADAPTADORES ---
+# Um adaptador por (loja, integração) vive enquanto a configuração não mudar.
+# Assim o token OAuth e a conexão keep-alive sobrevivem entre os ciclos do robô.
+_adapter_registry = {}   # (store_id, integração) -> (hash da config, adaptador)
+_registry_lock = threading.Lock()
+
+
+def _registered_adapter(store_id: int, integration: str, cfg: dict, factory):
+    cfg_hash = hashlib.sha1(json.dumps(cfg, sort_keys=True, default=str).encode()).hexdigest()
+    key = (store_id, integration)
+    with _registry_lock:
+        cached = _adapter_registry.get(key)
+        if cached and cached[0] == cfg_hash:
+            return cached[1]
+        adapter = factory()
+        _adapter_registry[key] = (cfg_hash, adapter)
+        return adapter
+
+
+def get_active_adapters(store: Store, only: str = None):
     """
     Lê a configuração JSON (integrations_config) e retorna
     uma lista com TODOS os adaptadores ativos (Wabiz, iFood, etc).
+    'only' limita a uma integração ('wabiz' / 'ifood').
+    Os adaptadores vêm do registro: a mesma instância é reaproveitada entre chamadas.
     """
     adapters = []
     
@@ -30,26 +69,26 @@ def get_active_adapters(store: Store):
     
     # 1. Configuração Wabiz
     wz = config.get('wabiz', {})
-    if wz.get('active') and wz.get('user'):
+    if wz.get('active') and wz.get('user') and only in (None, 'wabiz'):
         try:
-            adapters.append(WabizAdapter(
+            adapters.append(_registered_adapter(store.id, 'wabiz', wz, lambda: WabizAdapter(
                 token=None,
                 user=wz.get('user'),
                 password=wz.get('pass'),
                 base_url=wz.get('url') or "https://delivery.wabiz.com.br/api/v1"
-            ))
+            )))
         except Exception as e:
             print(f"⚠️ Erro ao iniciar Wabiz: {e}")
 
     # 2. Configuração iFood
     ifood = config.get('ifood', {})
-    if ifood.get('active') and ifood.get('client_id'):
+    if ifood.get('active') and ifood.get('client_id') and only in (None, 'ifood'):
         try:
-            adapters.append(IfoodAdapter(
+            adapters.append(_registered_adapter(store.id, 'ifood', ifood, lambda: IfoodAdapter(
                 user=ifood.get('client_id'),
                 password=ifood.get('client_secret'),
                 merchant_id=ifood.get('merchant_id')
-            ))
+            )))
         except Exception as e:
             print(f"⚠️ Erro ao iniciar iFood: {e}")
         
@@ -138,58 +177,20 @@ def process_standard_order(db: Session, store: Store, order_data: dict):
             except: pass
 
         try: deduct_stock_from_order(db, store.id, items, integration_source)
-        except Exception as e: print(f"⚠️ Erro Estoque: {e}")
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Erro Estoque: {e}")
         
         # --- ENRIQUECIMENTO AUTOMÁTICO (INTEGRAÇÕES) ---
         # Se o iFood mandou "Combo Galera" sem lista, nós preenchemos aqui
         enrich_order_with_combo_data(db, store.id, items)
         # -----------------------------------------------
+
+        # Setor de produção de cada item (o KDS só compara, não adivinha mais)
+        try: stamp_item_sectors(db, store.id, items)
+        except Exception as e: print(f"⚠️ [Hub] Erro ao definir setores dos itens: {e}")
         
-        # 3. Pixel (Purchase)
-        pixel_results = {"fb": False, "ga": False}
-        try:
-            client_ip = recover_historical_ip(db, store.id, cust.get('phone'), cust.get('email'))
-            
-            # Melhora o Match Quality separando Nome e Sobrenome
-            full_name = cust.get('name', '') or ""
-            first_name = full_name.split()[0] if full_name else ""
-            last_name = " ".join(full_name.split()[1:]) if full_name and len(full_name.split()) > 1 else ""
-
-            user_data_pixel = {
-                "email": cust.get('email'), 
-                "phone": cust.get('phone'), 
-                "first_name": first_name,
-                "last_name": last_name,
-                "city": addr.get('city', 'Itanhaem'), 
-                "zip_code": addr.get('zip_code', '11740000'),
-                "state": addr.get('state', 'SP'),
-                "ip": client_ip, 
-                "user_agent": "AlivHub/Server-Side", 
-                
-                # --- CORREÇÃO SEGURA ---
-                # Usa o ext_id (já definido no início da função) como fallback final
-                "external_id": cust.get('email') or cust.get('phone') or str(ext_id),
-                # -----------------------
-                
-                "url": "https://app.wabiz.delivery/pedido_confirmado" 
-            }
-            
-            # ESTRATÉGIA HÍBRIDA:
-            # targets=["fb"] -> Envia APENAS para o Facebook via Servidor.
-            # (O Google será enviado pelo GTM no navegador para garantir atribuição correta)
-            pixel_results = dispatch_smart_event(
-                store, 
-                "Venda Real (Server) - Correta", 
-                user_data_pixel, 
-                items, 
-                total, 
-                ext_id, 
-                targets=["fb"] # <--- AQUI ESTÁ A CHAVE DA MUDANÇA
-            )
-        except Exception as e: 
-            print(f"❌ Erro Pixel: {e}")
-
-        # 4. Salvamento
+        # 3. Salvamento
         try: items_safe = json.loads(json.dumps(items, default=str))
         except: items_safe = items
 
@@ -213,100 +214,38 @@ def process_standard_order(db: Session, store: Store, order_data: dict):
             discount=discount,
             payment_method=order_data.get('payment_method', 'Outros'),
             items_json=items_safe,
-            sent_to_facebook=pixel_results['fb'],
-            sent_to_google=pixel_results['ga'],
+            sent_to_facebook=False,
+            sent_to_google=False,
             driver_id=None,
             cash_opening_id=active_cash_id,
             delivery_type=delivery_type,
             notes=order_data.get('notes')
         )
         db.add(new_order)
-        db.commit()
-        
-        # 5. CONFIRMAÇÃO NA ORIGEM (RESTAURADO E ATIVO)
-        
-        # A. iFood
+        db.flush()  # Gera o ID para as linhas de outbox
+
+        # 4. Efeitos colaterais -> OUTBOX (mesmo commit do pedido)
+        # Pixel FB, confirmação na origem, aviso ao KDS e GA4 pendente rodam em
+        # services/outbox.py, fora do loop de sincronização.
+        possible_ids = [str(ext_id)]
+        if display_id and str(display_id) != str(ext_id):
+            possible_ids.append(str(display_id))
+
+        side_payload = {
+            "external_id": ext_id, "display_id": display_id,
+            "customer": cust, "address": addr, "items": items_safe, "total": total,
+        }
+        enqueue_event(db, store.id, "pixel_fb", ext_id, side_payload, order_id=new_order.id)
+        enqueue_event(db, store.id, "kds_trigger", ext_id, {}, order_id=new_order.id)
+        enqueue_event(db, store.id, "ga4_pending", ext_id, dict(side_payload, possible_ids=possible_ids), order_id=new_order.id)
+
         if "ifood" in str(order_data.get('payment_method', '')).lower():
-            print(f"🤖 [Hub] Confirmando iFood #{ext_id}...")
-            adapters = get_active_adapters(store)
-            for adapter in adapters:
-                if isinstance(adapter, IfoodAdapter):
-                    try:
-                        adapter.confirm_order(ext_id)
-                    except Exception as e:
-                        print(f"❌ [iFood] Erro ao confirmar: {e}")
-
-        # B. Wabiz
+            enqueue_event(db, store.id, "confirm_origin", ext_id, {"integration": "ifood", "external_id": ext_id}, order_id=new_order.id)
         elif order_data.get('integration_source') == 'wabiz':
-            print(f"🤖 [Hub] Confirmando Wabiz #{display_id}...")
-            try:
-                from services.integrations.wabiz import process_wabiz_update, WabizAdapter
-                adapters = get_active_adapters(store)
-                for adapter in adapters:
-                    if isinstance(adapter, WabizAdapter):
-                        process_wabiz_update(adapter, new_order, "CONFIRMADO")
-            except Exception as e:
-                print(f"⚠️ [Wabiz] Erro ao confirmar: {e}")
+            enqueue_event(db, store.id, "confirm_origin", ext_id, {"integration": "wabiz", "external_id": ext_id}, order_id=new_order.id)
 
-        # 6. Notificações
-        try:
-            trigger_url = f"http://127.0.0.1:8000/api/internal/kds-trigger/{store.id}"
-            requests.post(trigger_url, timeout=5)
-        except Exception as e:
-            print(f"❌ [Hub] Erro KDS Trigger: {e}")
-            
-        
-        # 7. RESGATE DE PIXEL PENDENTE (GA4)
-        try:
-            from models import PendingPixelEvent
-            
-            # CRIA LISTA DE IDs POSSÍVEIS (Para garantir o match)
-            # O site pode ter enviado o ID Externo (UUID) ou o Display ID (Ex: 2829)
-            possible_ids = [str(ext_id)]
-            if display_id and str(display_id) != str(ext_id):
-                possible_ids.append(str(display_id))
-
-            print(f"🔍 [Hub] Procurando pixel pendente para IDs: {possible_ids}")
-
-            pending_pixel = db.query(PendingPixelEvent).filter(
-                PendingPixelEvent.store_id == store.id,
-                PendingPixelEvent.event_id.in_(possible_ids), # <--- AQUI ESTÁ A CORREÇÃO (Usa .in_)
-                PendingPixelEvent.status == 'PENDING'
-            ).first()
-            
-            if pending_pixel:
-                print(f"🔗 [Hub] MATCH! Pixel encontrado para o pedido #{pending_pixel.event_id}. Disparando GA4...")
-                
-                # ... (O resto do código de disparo continua igual ao anterior) ...
-                web_data = pending_pixel.payload_json
-                u_data = web_data.get('user_data', {})
-                
-                user_data_ga = {
-                    "client_ip": u_data.get('ip'),
-                    "client_user_agent": web_data.get('user_agent'),
-                    "fbp": u_data.get('fbp'),
-                    "fbc": u_data.get('fbc'),
-                    "gclid": u_data.get('gclid'),
-                    "session_id": u_data.get('session_id'),
-                    "email": cust.get('email'),
-                    "phone": cust.get('phone'),
-                    "city": addr.get('city'),
-                    "state": addr.get('state'),
-                    "external_id": ext_id
-                }
-
-                dispatch_smart_event(
-                    store, "Purchase", user_data_ga, items, total, ext_id, targets=["ga"]
-                )
-                
-                pending_pixel.status = "PROCESSED"
-                db.commit()
-            else:
-                print(f"💨 [Hub] Nenhum pixel pendente encontrado para {possible_ids}.")
-                
-        except Exception as e:
-            print(f"⚠️ Erro ao processar pixel pendente: {e}")            
-            
+        db.commit()
+        kick_outbox()
 
         if store.whatsapp_api_token and cust.get('phone'):
             try:
@@ -329,39 +268,100 @@ def process_standard_order(db: Session, store: Store, order_data: dict):
 # ==========================================
 #        NOVO CRON DE SINCRONIZAÇÃO (MULTI)
 # ==========================================
+# Cada par (loja, integração) é uma "unidade de polling" que roda no seu próprio
+# thread, com sua própria sessão de banco. Um Wabiz lento não atrasa mais o
+# iFood das outras lojas: o ciclo dura no máximo POLL_UNIT_BUDGET segundos.
+
+POLL_MAX_WORKERS = int(os.getenv("POLL_MAX_WORKERS", "8"))
+POLL_UNIT_BUDGET = float(os.getenv("POLL_UNIT_BUDGET", "20"))  # Tempo máximo que o ciclo espera por uma unidade
+POLL_JITTER = 2.0          # Espalha as chamadas para não bater em todas as APIs no mesmo segundo
+POLL_BACKOFF_BASE = 30     # 1ª falha: espera 30s, depois 60s, 120s...
+POLL_BACKOFF_MAX = 600
+
+_poll_executor = ThreadPoolExecutor(max_workers=POLL_MAX_WORKERS, thread_name_prefix="poll")
+_poll_state = {}   # (store_id, integração) -> {"running", "failures", "next_try"}
+_poll_lock = threading.Lock()
+
+
+def _poll_unit(store_id: int, integration: str):
+    """Busca e processa os pedidos de UMA integração de UMA loja."""
+    time.sleep(random.uniform(0, POLL_JITTER))
+    started = time.time()
+    db = SessionLocal()
+    try:
+        store = db.query(Store).get(store_id)
+        if not store: return 0
+
+        processed = 0
+        for adapter in get_active_adapters(store, only=integration):
+            raw_orders = adapter.fetch_orders()
+            if not raw_orders: continue
+            for raw in raw_orders:
+                try:
+                    # Normaliza
+                    standard_order = adapter.normalize_order(raw)
+                    # Processa (Transação Atômica)
+                    process_standard_order(db, store, standard_order)
+                    processed += 1
+                except Exception as e_proc:
+                    db.rollback() # <--- CORREÇÃO: Limpa a transação se der erro neste pedido específico
+                    print(f"❌ Erro ao salvar pedido {raw.get('id', '?')}: {e_proc}")
+
+        # Estourar o orçamento conta como falha: a integração entra em backoff
+        if time.time() - started > POLL_UNIT_BUDGET:
+            raise TimeoutError(f"{integration} levou {time.time() - started:.1f}s")
+        return processed
+    finally:
+        db.close()
+
+
+def _finish_poll_unit(key, future):
+    with _poll_lock:
+        state = _poll_state.setdefault(key, {"failures": 0, "next_try": 0})
+        state["running"] = False
+        error = future.exception()
+        if error is None:
+            state["failures"] = 0
+            state["next_try"] = 0
+            return
+        state["failures"] += 1
+        wait = min(POLL_BACKOFF_MAX, POLL_BACKOFF_BASE * (2 ** (state["failures"] - 1)))
+        state["next_try"] = time.time() + wait
+    print(f"⚠️ Erro no adaptador {key[1]} (Loja {key[0]}): {error}. Nova tentativa em {wait}s.")
+
+
 def sync_external_orders():
     """
     Busca pedidos em TODAS as lojas usando TODOS os adaptadores ativos.
-    VERSÃO CORRIGIDA: Com Rollback para não travar a fila.
+    Dispara as unidades em paralelo e espera no máximo POLL_UNIT_BUDGET segundos.
+    Unidades que ainda estão rodando (ou em backoff) são puladas neste ciclo.
     """
     db = SessionLocal()
     try:
-        stores = db.query(Store).filter(Store.is_open == True).all()
-        
-        for store in stores:
-            adapters = get_active_adapters(store)
-            if not adapters: continue
-
-            for adapter in adapters:
-                try:
-                    raw_orders = adapter.fetch_orders()
-                    if raw_orders:
-                        for raw in raw_orders:
-                            try:
-                                # Normaliza
-                                standard_order = adapter.normalize_order(raw)
-                                # Processa (Transação Atômica)
-                                process_standard_order(db, store, standard_order)
-                            except Exception as e_proc:
-                                db.rollback() # <--- CORREÇÃO: Limpa a transação se der erro neste pedido específico
-                                print(f"❌ Erro ao salvar pedido {raw.get('id', '?')}: {e_proc}")
-                                
-                except Exception as e_adapter:
-                    print(f"⚠️ Erro no adaptador: {e_adapter}")
-
+        stores = db.query(Store.id, Store.integrations_config).filter(Store.is_open == True).all()
     finally:
         db.close()
+
+    now = time.time()
+    futures = []
+    for store in stores:
+        for integration in get_active_integrations(store):
+            key = (store.id, integration)
+            with _poll_lock:
+                state = _poll_state.setdefault(key, {"failures": 0, "next_try": 0})
+                if state.get("running") or now < state["next_try"]:
+                    continue
+                state["running"] = True
+            future = _poll_executor.submit(_poll_unit, store.id, integration)
+            future.add_done_callback(lambda f, key=key: _finish_poll_unit(key, f))
+            futures.append(future)
+
+    if not futures: return
+    done, pending = wait(futures, timeout=POLL_UNIT_BUDGET + POLL_JITTER)
+    if pending:
+        print(f"⏳ [Sync] {len(pending)} integração(ões) ainda rodando; ficam fora do próximo ciclo até terminar.")
         
+
 # --- CRONJOB DE OPORTUNIDADES ---
 def run_opportunity_scanner():
     db = SessionLocal()
@@ -369,9 +369,13 @@ def run_opportunity_scanner():
         stores = db.query(Store).filter(Store.is_open == True).all()
         for store in stores:
             brain = PizzaBrain(db, store.id)
-            opportunity = brain.analyze_combos(min_support=3) 
+            # Regras já ranqueadas pelo worker (market_basket); sem elas, o scan antigo
+            opportunities = brain.combo_opportunities(limit=3, min_support=3)
+            if not opportunities:
+                opportunity = brain.analyze_combos(min_support=3)
+                opportunities = [opportunity] if opportunity else []
             
-            if opportunity:
+            for opportunity in opportunities:
                 exists = db.query(Insight).filter(
                     Insight.store_id == store.id,
                     Insight.title == opportunity['title'],
@@ -423,6 +427,19 @@ def send_morning_reports():
         db.close()
         
         
+# --- CRONJOB DA CESTA DE COMPRAS (COMBOS) ---
+def run_basket_rules_cron():
+    db = SessionLocal()
+    try:
+        stores = db.query(Store.id).filter(Store.is_open == True).all()
+        for store in stores:
+            task_refresh_basket_rules.delay(store.id)
+    except Exception as e:
+        print(f"❌ Erro ao agendar cesta de compras: {e}")
+    finally:
+        db.close()
+
+
 # --- CRONJOB DE RFM ---
 def run_rfm_analysis_cron():
     db = SessionLocal()
@@ -0,0 +1,352 @@
+# Arquivo: pizzaria/services/board_stats.py
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_, and_
+
+from database import SessionLocal
+from models import Order
+from services.cache import get_redis, mark_redis_down
+from services.catalog import get_catalog
+from services.cash_state import get_cash_state
+
+# ==========================================
+#   CONTADORES DO CABEÇALHO DO PAINEL
+# ==========================================
+# Produtos (pizzas/esfihas/beirutes), plataformas e badges (delivery/balcão/mesas)
+# eram recalculados lendo o items_json de TODOS os pedidos do caixa a cada polling.
+# Agora cada pedido tem uma "contribuição" e os totais ficam num hash no Redis por
+# caixa (board:stats:{loja}:{abertura}). Toda gravação de pedido via ORM é capturada
+# em models.py (after_flush) e, depois do commit, aplicamos só a diferença (HINCRBY).
+#
+# O hash expira sozinho (rede de segurança) e pode ser refeito com rebuild_board_stats()
+# (rota /admin/system/rebuild-board-stats). Sem Redis, calcula na hora como antes.
+#
+# Corrida reconstrução x incremento: uma diferença calculada antes da foto do banco
+# pode chegar depois do HSET (conta em dobro) e uma posterior pode cair no DEL (some).
+# Por isso, por loja:
+#   - board:pending:{loja}: transações com pedido gravado (flush) cujo incremento ainda
+#     não foi aplicado. Sobe no after_flush, desce quando o incremento é aplicado ou a
+#     transação é desfeita (expira sozinho se um processo morrer no meio).
+#   - board:seq:{loja}: quantos incrementos já foram aplicados.
+# A reconstrução só grava o hash (script Lua, atômico) se não havia nada pendente antes
+# da foto e nada mudou até a gravação. Senão devolve o cálculo sem gravar e a próxima
+# leitura tenta de novo.
+
+BOARD_STATS_MAX_AGE = 600
+BOARD_PENDING_TTL = 120
+BOARD_FIELDS = (
+    "pizzas", "esfihas", "beirutes",
+    "ifood", "wabiz", "pdv",
+    "delivery_total", "delivery_prep", "delivery_ready",
+    "balcao_total", "balcao_prep", "balcao_ready",
+    "mesas",
+)
+# Campos do pedido que mudam a contribuição
+BOARD_SOURCE_FIELDS = ("items_json", "payment_method", "wabiz_id", "status", "table_number", "address_street", "cash_opening_id")
+
+_apply_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="board-stats")
+
+# Só incrementa se o hash existir (hash ausente = será reconstruído na próxima leitura)
+_HINCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+for i = 1, #ARGV, 2 do redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1]) end
+return 1
+"""
+_hincr_script = None
+
+# Nunca deixa o contador de pendentes negativo (marcação perdida com o Redis fora)
+_RELEASE_PENDING = """
+for i = 1, #KEYS do
+    if tonumber(redis.call('GET', KEYS[i]) or '0') > 0 then redis.call('DECR', KEYS[i]) end
+end
+return 1
+"""
+_release_script = None
+
+# Grava a reconstrução só se nada ficou pendente nem foi aplicado desde a foto do banco
+_WRITE_IF_QUIET = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') > 0 then return 0 end
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+_write_script = None
+
+
+def _key(store_id, cash_opening_id):
+    return f"board:stats:{store_id}:{cash_opening_id}"
+
+
+def _pending_key(store_id):
+    return f"board:pending:{store_id}"
+
+
+def _seq_key(store_id):
+    return f"board:seq:{store_id}"
+
+
+# --- CONTRIBUIÇÃO DE UM PEDIDO ---
+
+def order_contribution(catalog, o) -> dict:
+    """
+    Quanto um pedido soma nos contadores. `o` pode ser um Order ou qualquer objeto
+    com os campos de BOARD_SOURCE_FIELDS.
+    """
+    stats = {}
+    if o.status and "CANCELADO" in o.status.upper():
+        return stats
+
+    def add(field, qty=1):
+        stats[field] = stats.get(field, 0) + qty
+
+    # A. Produtos
+    for item in (o.items_json or []):
+        try: qty = float(item.get('quantity', 1))
+        except: qty = 1.0
+
+        # Ignora itens que são apenas cabeçalhos de combo ou taxas
+        name_upper = str(item.get('title') or item.get('name') or "").upper()
+        if "TAXA" in name_upper or "ENTREGA" in name_upper: continue
+
+        # 1. Tenta identificar categoria pelo mapa (Código/ID)
+        found_cat = ""
+        for k in ('externalCode', 'external_code', 'code', 'id', 'product_id'):
+            key = str(item.get(k, ''))
+            if key and key in catalog.category_by_key:
+                found_cat = catalog.category_by_key[key]
+                break
+
+        # 2. DECISÃO HÍBRIDA (Prioriza Nome > Categoria)
+        if 'ESFIHA' in name_upper or 'ESFIHA' in found_cat:
+            add('esfihas', int(qty))
+        elif 'BEIRUTE' in name_upper or 'BEIRUTE' in found_cat:
+            add('beirutes', int(qty))
+        elif 'PIZZA' in name_upper or 'PIZZA' in found_cat:
+            # Evita contar "Massa de Pizza" ou "Borda de Pizza" como uma Pizza inteira
+            if "BORDA" not in name_upper and "MASSA" not in name_upper:
+                add('pizzas', int(qty))
+
+    # B. Plataforma
+    pm = (o.payment_method or "").lower()
+    wid = str(o.wabiz_id or "")
+    if "ifood" in pm: add("ifood")
+    elif wid and not wid.startswith("M-"): add("wabiz")
+    else: add("pdv")
+
+    # C. Badges
+    st = (o.status or "").upper()
+    if o.table_number:
+        if st not in ['ENTREGUE', 'CONCLUIDO']: add('mesas')
+    else:
+        is_balcao = "RETIRADA" in (o.address_street or "").upper() or not o.address_street
+        prefix = 'balcao' if is_balcao else 'delivery'
+        if st not in ['CONCLUIDO']:
+            add(f'{prefix}_total')
+            if st in ['PREPARO', 'PENDENTE', 'FORNO']: add(f'{prefix}_prep')
+            if st in ['PRONTO', 'SAIU_ENTREGA']: add(f'{prefix}_ready')
+
+    return {k: v for k, v in stats.items() if v}
+
+
+def empty_stats():
+    return {f: 0 for f in BOARD_FIELDS}
+
+
+def stats_payload(stats: dict):
+    """Converte o hash plano no formato que o painel já usa (prod_stats, platform_stats, counts)."""
+    g = lambda f: int(stats.get(f, 0) or 0)
+    prod_stats = {"pizzas": g("pizzas"), "esfihas": g("esfihas"), "beirutes": g("beirutes")}
+    platform_stats = {"ifood": g("ifood"), "wabiz": g("wabiz"), "pdv": g("pdv")}
+    counts = {
+        "delivery": {"total": g("delivery_total"), "prep": g("delivery_prep"), "ready": g("delivery_ready")},
+        "balcao": {"total": g("balcao_total"), "prep": g("balcao_prep"), "ready": g("balcao_ready")},
+        "mesas": g("mesas"),
+    }
+    return prod_stats, platform_stats, counts
+
+
+# --- LEITURA / RECONSTRUÇÃO ---
+
+def compute_board_stats(db, store_id: int, cash) -> dict:
+    """Cálculo completo (o loop antigo do get_orders_api)."""
+    stats = empty_stats()
+    if not cash.is_open: return stats
+
+    stats_query = db.query(Order).filter(Order.store_id == store_id)
+    if cash.opening_id:
+        stats_query = stats_query.filter(
+            or_(
+                Order.cash_opening_id == cash.opening_id,
+                # Pega também orfãos recentes para a função de "varrer" funcionar visualmente assim que abre
+                and_(Order.cash_opening_id == None, Order.created_at >= cash.opened_at)
+            )
+        )
+    else:
+        stats_query = stats_query.filter(Order.created_at >= cash.opened_at)
+
+    rows = stats_query.with_entities(*[getattr(Order, f) for f in BOARD_SOURCE_FIELDS]).all()
+    catalog = get_catalog(db, store_id)
+    for row in rows:
+        for field, qty in order_contribution(catalog, row).items():
+            stats[field] += qty
+    return stats
+
+
+def rebuild_board_stats(db, store_id: int, cash=None) -> dict:
+    global _write_script
+    cash = cash or get_cash_state(db, store_id)
+    if not cash.is_open or not cash.opening_id: return compute_board_stats(db, store_id, cash)
+
+    r = get_redis()
+    seq = None
+    if r is not None:
+        try:
+            # Lido ANTES da foto do banco: com incremento pendente a foto pode não bater
+            pending, seq = r.mget(_pending_key(store_id), _seq_key(store_id))
+            if int(pending or 0) > 0: r = None
+        except Exception as e:
+            mark_redis_down(e)
+            r = None
+
+    stats = compute_board_stats(db, store_id, cash)
+
+    if r is not None:
+        try:
+            if _write_script is None:
+                _write_script = r.register_script(_WRITE_IF_QUIET)
+            args = [seq or "0", BOARD_STATS_MAX_AGE]
+            for field, value in stats.items():
+                args += [field, value]
+            _write_script(keys=[_key(store_id, cash.opening_id), _pending_key(store_id), _seq_key(store_id)], args=args)
+        except Exception as e:
+            mark_redis_down(e)
+    return stats
+
+
+def get_board_stats(db, store_id: int, cash) -> dict:
+    """Leitura O(1) do hash; reconstrói se não existir."""
+    if not cash.is_open: return empty_stats()
+
+    r = get_redis()
+    if r is not None and cash.opening_id:
+        try:
+            stats = r.hgetall(_key(store_id, cash.opening_id))
+            if stats: return stats
+        except Exception as e:
+            mark_redis_down(e)
+    return rebuild_board_stats(db, store_id, cash)
+
+
+# --- APLICAÇÃO INCREMENTAL (pós-commit) ---
+
+def mark_pending(store_ids):
+    """Chamado pelo after_flush (models.py): a loja tem incremento a caminho."""
+    r = get_redis()
+    if r is None or not store_ids: return
+    try:
+        pipe = r.pipeline()
+        for store_id in store_ids:
+            pipe.incr(_pending_key(store_id))
+            pipe.expire(_pending_key(store_id), BOARD_PENDING_TTL)
+        pipe.execute()
+    except Exception as e:
+        mark_redis_down(e)
+
+
+def release_pending(store_ids, client=None):
+    """Transação desfeita (ou incremento aplicado, via `client` = pipeline)."""
+    global _release_script
+    r = get_redis()
+    if r is None or not store_ids: return
+    try:
+        if _release_script is None:
+            _release_script = r.register_script(_RELEASE_PENDING)
+        _release_script(keys=[_pending_key(s) for s in store_ids], client=client or r)
+    except Exception as e:
+        mark_redis_down(e)
+
+
+def apply_order_changes(changes, pending_stores=()):
+    """Chamado pelo after_commit (models.py). Roda fora da requisição."""
+    _apply_executor.submit(_apply_order_changes, changes, set(pending_stores))
+
+
+def _apply_order_changes(changes, pending_stores=()):
+    global _hincr_script
+    r = get_redis()
+    if r is None: return  # Sem Redis não há hash para manter
+
+    db = SessionLocal()
+    try:
+        if _hincr_script is None:
+            _hincr_script = r.register_script(_HINCR_IF_EXISTS)
+
+        deltas = {}     # key -> {campo: delta}
+        stale = set()   # keys que não dá para ajustar (valor antigo desconhecido)
+        for ch in changes:
+            store_id = ch["store_id"]
+            catalog = get_catalog(db, store_id)
+
+            for side, sign in (("old", -1), ("new", 1)):
+                values = ch.get(side)
+                if values is None: continue
+                cash_id = values.get("cash_opening_id")
+                if not cash_id:
+                    # Pedido sem caixa conta no caixa aberto (mesma regra do cálculo completo)
+                    cash = get_cash_state(db, store_id)
+                    if not cash.is_open or not cash.opening_id: continue
+                    cash_id = cash.opening_id
+                key = _key(store_id, cash_id)
+
+                if values.get("_unknown"):
+                    stale.add(key)
+                    continue
+                row = _Row(values)
+                bucket = deltas.setdefault(key, {})
+                for field, qty in order_contribution(catalog, row).items():
+                    bucket[field] = bucket.get(field, 0) + sign * qty
+
+        # MULTI: incrementos, fim do pendente e nova sequência entram juntos
+        pipe = r.pipeline()
+        for key in stale:
+            pipe.delete(key)
+        for key, bucket in deltas.items():
+            if key in stale: continue
+            args = []
+            for field, qty in bucket.items():
+                if qty: args += [field, qty]
+            if args: _hincr_script(keys=[key], args=args, client=pipe)
+        for store_id in {ch["store_id"] for ch in changes} | set(pending_stores):
+            pipe.incr(_seq_key(store_id))
+        release_pending(pending_stores, client=pipe)
+        pipe.execute()
+    except Exception as e:
+        print(f"⚠️ [Painel] Erro ao atualizar contadores: {e}")
+        traceback.print_exc()
+        # Incremento perdido: o hash não serve mais (a próxima leitura reconstrói)
+        try:
+            release_pending(pending_stores)
+            for store_id in pending_stores: r.incr(_seq_key(store_id))
+        except Exception as e2:
+            mark_redis_down(e2)
+    finally:
+        db.close()
+
+
+class _Row:
+    __slots__ = BOARD_SOURCE_FIELDS
+
+    def __init__(self, values):
+        for f in BOARD_SOURCE_FIELDS:
+            setattr(self, f, values.get(f))
+
+
+def invalidate_board_stats(store_id: int, cash_opening_id: int):
+    r = get_redis()
+    if r is None: return
+    try:
+        r.delete(_key(store_id, cash_opening_id))
+    except Exception as e:
+        mark_redis_down(e)
@@ -0,0 +1,43 @@
+# Arquivo: pizzaria/services/cache.py
+import os
+import time
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Mesmo Redis usado como broker do Celery (ver celery_app.py)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Se o Redis cair, paramos de tentar por alguns segundos para não travar
+# cada requisição esperando o timeout de conexão.
+REDIS_RETRY_AFTER = 30
+
+_client = None
+_down_until = 0.0
+
+
+def get_redis():
+    """
+    Retorna o cliente Redis compartilhado do processo, ou None se o Redis
+    estiver marcado como fora do ar. Quem chama deve sempre ter um plano B local.
+    """
+    global _client
+    if time.time() < _down_until:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5,
+            decode_responses=True,
+        )
+    return _client
+
+
+def mark_redis_down(error=None):
+    """Chamado quando uma operação no Redis falha. Suspende o uso por REDIS_RETRY_AFTER segundos."""
+    global _down_until
+    if time.time() >= _down_until:
+        print(f"⚠️ [Cache] Redis indisponível, usando fallback local: {error}")
+    _down_until = time.time() + REDIS_RETRY_AFTER
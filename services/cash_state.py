@@ -0,0 +1,128 @@
+# Arquivo: pizzaria/services/cash_state.py
+import json
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import desc
+
+from models import CashOpening, CashClosing
+from services.cache import get_redis, mark_redis_down
+
+# ==========================================
+#     ESTADO DO CAIXA (ABERTO / FECHADO)
+# ==========================================
+# Toda tela que faz polling (painel, resumo do caixa, motoboys ao vivo) precisava
+# descobrir se o caixa está aberto com 2 consultas (última abertura + último fechamento).
+# Agora o estado fica num cache: Redis (compartilhado entre workers e o robô) + memória
+# local por poucos segundos. Quem abre/fecha o caixa (routers/finance.py) grava o
+# estado novo na hora; o TTL só existe como rede de segurança.
+
+CASH_STATE_MAX_AGE = 300        # Segundos no Redis (rede de segurança)
+CASH_STATE_LOCAL_TTL = 2        # Segundos em memória com Redis no ar
+CASH_STATE_LOCAL_TTL_NO_REDIS = 10
+
+_local = {}  # { store_id: (momento, CashState) }
+_lock = threading.Lock()
+
+
+class CashState:
+    __slots__ = ("store_id", "is_open", "opening_id", "opened_at", "opening_amount", "closed_at")
+
+    def __init__(self, store_id, is_open=False, opening_id=None, opened_at=None, opening_amount=0.0, closed_at=None):
+        self.store_id = store_id
+        self.is_open = is_open
+        self.opening_id = opening_id
+        self.opened_at = opened_at            # datetime (naive, como no banco)
+        self.opening_amount = opening_amount or 0.0
+        self.closed_at = closed_at            # Último fechamento (só quando fechado)
+
+    def to_json(self):
+        return json.dumps({
+            "is_open": self.is_open,
+            "opening_id": self.opening_id,
+            "opened_at": self.opened_at.isoformat() if self.opened_at else None,
+            "opening_amount": self.opening_amount,
+            "closed_at": self.closed_at.isoformat() if self.closed_at else None,
+        })
+
+    @classmethod
+    def from_json(cls, store_id, raw):
+        data = json.loads(raw)
+        as_dt = lambda v: datetime.fromisoformat(v) if v else None
+        return cls(store_id, data.get("is_open", False), data.get("opening_id"), as_dt(data.get("opened_at")),
+                   data.get("opening_amount"), as_dt(data.get("closed_at")))
+
+
+def _key(store_id):
+    return f"cash:state:{store_id}"
+
+
+def _remember(state: CashState):
+    with _lock:
+        _local[state.store_id] = (time.time(), state)
+
+
+def _save(state: CashState):
+    _remember(state)
+    r = get_redis()
+    if r is None: return
+    try:
+        r.set(_key(state.store_id), state.to_json(), ex=CASH_STATE_MAX_AGE)
+    except Exception as e:
+        mark_redis_down(e)
+
+
+def load_cash_state(db, store_id: int) -> CashState:
+    """Lê do banco (as 2 consultas antigas). Só roda quando o cache não tem o estado."""
+    last_opening = db.query(CashOpening).filter(CashOpening.store_id == store_id).order_by(desc(CashOpening.created_at)).first()
+    last_closing = db.query(CashClosing).filter(CashClosing.store_id == store_id).order_by(desc(CashClosing.closed_at)).first()
+    closed_at = last_closing.closed_at if last_closing else None
+
+    # Se fechamento > abertura, está fechado.
+    if not last_opening or (last_closing and last_closing.closed_at > last_opening.created_at):
+        return CashState(store_id, closed_at=closed_at)
+    return CashState(store_id, True, last_opening.id, last_opening.created_at, last_opening.amount)
+
+
+def get_cash_state(db, store_id: int) -> CashState:
+    r = get_redis()
+    local_ttl = CASH_STATE_LOCAL_TTL if r is not None else CASH_STATE_LOCAL_TTL_NO_REDIS
+
+    cached = _local.get(store_id)
+    if cached and time.time() - cached[0] < local_ttl:
+        return cached[1]
+
+    if r is not None:
+        try:
+            raw = r.get(_key(store_id))
+            if raw:
+                state = CashState.from_json(store_id, raw)
+                _remember(state)
+                return state
+        except Exception as e:
+            mark_redis_down(e)
+
+    state = load_cash_state(db, store_id)
+    _save(state)
+    return state
+
+
+# --- ESCRITA (chamado por quem abre/fecha o caixa, DEPOIS do commit) ---
+
+def cash_state_opened(opening: CashOpening):
+    _save(CashState(opening.store_id, True, opening.id, opening.created_at, opening.amount))
+
+
+def cash_state_closed(closing: CashClosing):
+    _save(CashState(closing.store_id, closed_at=closing.closed_at))
+
+
+def invalidate_cash_state(store_id: int):
+    with _lock:
+        _local.pop(store_id, None)
+    r = get_redis()
+    if r is None: return
+    try:
+        r.delete(_key(store_id))
+    except Exception as e:
+        mark_redis_down(e)
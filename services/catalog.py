@@ -0,0 +1,270 @@
+# Arquivo: pizzaria/services/catalog.py
+import time
+import threading
+from types import SimpleNamespace
+
+from sqlalchemy.orm import Session
+from models import (
+    Product, ProductMapping, Category, Ingredient, PizzaBaseRecipe, ProductRecipe,
+    PizzaSize, ProductAddon, AddonPrice, AddonRecipe
+)
+from services.cache import get_redis, mark_redis_down
+
+# ==========================================
+#     SNAPSHOT DO CATÁLOGO (EM MEMÓRIA)
+# ==========================================
+# O motor de estoque resolve produto, tamanho e ficha técnica para cada item,
+# sabor e borda de cada pedido. Em vez de consultar o banco dezenas de vezes
+# por pedido, carregamos o catálogo da loja uma vez e só recarregamos quando
+# a versão muda (qualquer escrita em menu.py / inventory.py incrementa a versão).
+#
+# A versão fica no Redis para que a API e o robô (run_robot.py) enxerguem a
+# mesma invalidação. Sem Redis, cai para versão local + expiração curta.
+#
+# IMPORTANTE: o snapshot NÃO guarda current_stock. Saldo é sempre lido/gravado no banco.
+
+CATALOG_MAX_AGE = 600       # Rede de segurança (edições feitas direto no banco)
+CATALOG_MAX_AGE_LOCAL = 60  # Sem Redis, outros processos não avisam: expira rápido
+
+_GLOBAL_KEY = "catalog:version:all"
+
+_snapshots = {}
+_local_versions = {}
+_lock = threading.Lock()
+
+
+def _store_key(store_id):
+    return f"catalog:version:{store_id}"
+
+
+class CatalogSnapshot:
+    """
+    Fotografia somente-leitura do catálogo de uma loja.
+    Produtos, ingredientes e linhas de receita são SimpleNamespace (não ORM),
+    então podem ser compartilhados entre sessões e threads sem lazy-load.
+    """
+
+    def __init__(self, store_id, version):
+        self.store_id = store_id
+        self.version = version
+        self.built_at = time.time()
+
+        self.products_by_id = {}
+        self.products_by_code = {}   # external_code -> produto
+        self.products_by_name = {}   # nome minúsculo -> produto
+        self.sizes = []
+        self.ingredients = {}        # id -> ingrediente (nome, fator, custo)
+        self.base_recipes = {}       # base_type -> [linhas]
+        self.product_recipes = {}    # (product_id, size_id) -> [linhas] (size_id None = genérica)
+        self.addons_by_code = {}     # external_code do AddonPrice -> adicional
+        self.addon_recipes = {}      # (addon_id, size_id) -> [linhas]
+        self.category_by_key = {}    # id / NOME / external_code -> nome da categoria (UPPER)
+        self.category_sectors = {}   # category_id -> sector_id (setor de produção do KDS)
+        self.sector_classifier = None  # Montado sob demanda por services/sector_routing.py
+
+    # --- CONSTRUÇÃO ---
+    @classmethod
+    def build(cls, db: Session, store_id: int, version):
+        snap = cls(store_id, version)
+
+        for ing in db.query(Ingredient).filter(Ingredient.store_id == store_id).all():
+            snap.ingredients[ing.id] = _ingredient_view(ing)
+
+        products = db.query(Product).filter(Product.store_id == store_id).order_by(Product.id).all()
+        categories = db.query(Category.id, Category.name, Category.sector_id).filter(Category.store_id == store_id).all()
+        category_names = {c.id: (c.name or "").upper() for c in categories}
+        snap.category_sectors = {c.id: c.sector_id for c in categories}
+
+        for p in products:
+            c_name = category_names.get(p.category_id)
+            if c_name:
+                snap.category_by_key[str(p.id)] = c_name
+                if p.name: snap.category_by_key[p.name.strip().upper()] = c_name
+            view = SimpleNamespace(
+                id=p.id, name=p.name, is_pizza=p.is_pizza, base_type=p.base_type,
+                category_id=p.category_id, combo_items=p.combo_items or [], recipe_items=[]
+            )
+            snap.products_by_id[p.id] = view
+            if p.name:
+                snap.products_by_name.setdefault(p.name.lower(), view)
+
+        mappings = db.query(ProductMapping.external_code, ProductMapping.product_id).filter(
+            ProductMapping.store_id == store_id
+        ).order_by(ProductMapping.id).all()
+        for code, product_id in mappings:
+            if code and code not in snap.products_by_code:
+                snap.products_by_code[code] = snap.products_by_id.get(product_id)
+            c_name = snap.category_by_key.get(str(product_id))
+            if code and c_name:
+                snap.category_by_key[str(code)] = c_name
+
+        snap.sizes = db.query(PizzaSize).filter(PizzaSize.store_id == store_id).all()
+        # Mesma ordem do antigo ORDER BY slices DESC (no Postgres, NULL vem primeiro)
+        snap.sizes.sort(key=lambda s: (s.slices is None, s.slices or 0), reverse=True)
+        snap.sizes = [
+            SimpleNamespace(id=s.id, name=s.name or "", slug=s.slug, slices=s.slices,
+                            recipe_multiplier=s.recipe_multiplier)
+            for s in snap.sizes
+        ]
+
+        bases = db.query(
+            PizzaBaseRecipe.base_type, PizzaBaseRecipe.size_id, PizzaBaseRecipe.size_slug,
+            PizzaBaseRecipe.ingredient_id, PizzaBaseRecipe.quantity
+        ).filter(PizzaBaseRecipe.store_id == store_id).all()
+
+        recipes = db.query(
+            ProductRecipe.product_id, ProductRecipe.size_id,
+            ProductRecipe.ingredient_id, ProductRecipe.quantity
+        ).join(Product, Product.id == ProductRecipe.product_id).filter(
+            Product.store_id == store_id
+        ).order_by(ProductRecipe.id).all()
+
+        addon_prices = db.query(
+            AddonPrice.id, AddonPrice.addon_id, AddonPrice.size_id, AddonPrice.external_code, ProductAddon.name
+        ).join(ProductAddon, ProductAddon.id == AddonPrice.addon_id).filter(
+            ProductAddon.store_id == store_id
+        ).order_by(AddonPrice.id).all()
+
+        addon_lines = db.query(
+            AddonRecipe.addon_price_id, AddonRecipe.ingredient_id, AddonRecipe.quantity
+        ).join(AddonPrice, AddonPrice.id == AddonRecipe.addon_price_id).join(
+            ProductAddon, ProductAddon.id == AddonPrice.addon_id
+        ).filter(ProductAddon.store_id == store_id).all()
+
+        # Receitas podem apontar para ingrediente de outra loja (cópia de ficha): busca os que faltam
+        referenced = {r.ingredient_id for r in bases} | {r.ingredient_id for r in recipes} | {r.ingredient_id for r in addon_lines}
+        missing = [i for i in referenced if i and i not in snap.ingredients]
+        if missing:
+            for ing in db.query(Ingredient).filter(Ingredient.id.in_(missing)).all():
+                snap.ingredients[ing.id] = _ingredient_view(ing)
+
+        for b in bases:
+            line = snap._line(b.ingredient_id, b.quantity, b.size_id, size_slug=b.size_slug)
+            if line: snap.base_recipes.setdefault(b.base_type, []).append(line)
+
+        for r in recipes:
+            line = snap._line(r.ingredient_id, r.quantity, r.size_id)
+            if not line: continue
+            snap.product_recipes.setdefault((r.product_id, r.size_id), []).append(line)
+            product = snap.products_by_id.get(r.product_id)
+            if product: product.recipe_items.append(line)
+
+        price_keys = {}
+        for ap_id, addon_id, size_id, code, addon_name in addon_prices:
+            addon = SimpleNamespace(id=addon_id, name=addon_name)
+            if code and code not in snap.addons_by_code:
+                snap.addons_by_code[code] = addon
+            price_keys.setdefault((addon_id, size_id), ap_id)
+
+        lines_by_price = {}
+        for l in addon_lines:
+            line = snap._line(l.ingredient_id, l.quantity, None)
+            if line: lines_by_price.setdefault(l.addon_price_id, []).append(line)
+        for key, ap_id in price_keys.items():
+            snap.addon_recipes[key] = lines_by_price.get(ap_id, [])
+
+        return snap
+
+    def _line(self, ingredient_id, quantity, size_id, size_slug=None):
+        ingredient = self.ingredients.get(ingredient_id)
+        if not ingredient: return None
+        return SimpleNamespace(ingredient=ingredient, quantity=quantity or 0.0, size_id=size_id, size_slug=size_slug)
+
+    # --- CONSULTAS (todas em memória) ---
+    def resolve_product(self, prod_id=None, ext_code="", name=""):
+        """Mesma prioridade do antigo _resolve_product: ID interno > código externo > nome."""
+        if prod_id:
+            product = self.products_by_id.get(prod_id)
+            if product: return product
+        if ext_code:
+            return self.products_by_code.get(ext_code)
+        if name:
+            return self.products_by_name.get(name.lower())
+        return None
+
+    def detect_size(self, text_to_search):
+        if not text_to_search: return None
+        text_lower = text_to_search.lower()
+        best_match = None
+        for size in self.sizes:
+            if size.name.lower() in text_lower:
+                if best_match is None or len(size.name) > len(best_match.name):
+                    best_match = size
+        return best_match
+
+    def default_size(self):
+        return self.sizes[0] if self.sizes else None
+
+    def base_recipe(self, base_type, size=None):
+        lines = self.base_recipes.get(base_type, [])
+        if not size: return lines
+        return [b for b in lines if b.size_id == size.id or (b.size_slug is not None and b.size_slug == size.slug)]
+
+    def flavor_recipe(self, product_id, size=None):
+        recipes = []
+        if size:
+            recipes = self.product_recipes.get((product_id, size.id), [])
+        if not recipes:
+            recipes = self.product_recipes.get((product_id, None), [])
+        return recipes
+
+    def addon_recipe(self, addon_id, size_id):
+        return self.addon_recipes.get((addon_id, size_id))
+
+
+def _ingredient_view(ing):
+    return SimpleNamespace(id=ing.id, name=ing.name, conversion_factor=ing.conversion_factor, cost=ing.cost)
+
+
+# ==========================================
+#        VERSÃO E INVALIDAÇÃO
+# ==========================================
+
+def _current_version(store_id):
+    r = get_redis()
+    if r is not None:
+        try:
+            global_v, store_v = r.mget(_GLOBAL_KEY, _store_key(store_id))
+            return (int(global_v or 0), int(store_v or 0)), False
+        except Exception as e:
+            mark_redis_down(e)
+    return ("local", _local_versions.get("all", 0), _local_versions.get(store_id, 0)), True
+
+
+def get_catalog(db: Session, store_id: int) -> CatalogSnapshot:
+    """Retorna o snapshot da loja, reconstruindo apenas se a versão mudou ou expirou."""
+    version, is_local = _current_version(store_id)
+    max_age = CATALOG_MAX_AGE_LOCAL if is_local else CATALOG_MAX_AGE
+
+    snap = _snapshots.get(store_id)
+    if snap and snap.version == version and (time.time() - snap.built_at) < max_age:
+        return snap
+
+    # A versão é lida ANTES de carregar o banco: se alguém gravar durante o build,
+    # o incremento dele gera uma versão nova e o próximo pedido reconstrói.
+    snap = CatalogSnapshot.build(db, store_id, version)
+    with _lock:
+        _snapshots[store_id] = snap
+    print(f"📚 [Catálogo] Loja {store_id}: snapshot carregado ({len(snap.products_by_id)} produtos).")
+    return snap
+
+
+def invalidate_catalog(store_id: int = None):
+    """
+    Marca o catálogo como desatualizado. Sem store_id invalida todas as lojas.
+    Deve ser chamado DEPOIS do commit da alteração.
+    """
+    key = "all" if store_id is None else store_id
+    with _lock:
+        _local_versions[key] = _local_versions.get(key, 0) + 1
+        if store_id is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(store_id, None)
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.incr(_GLOBAL_KEY if store_id is None else _store_key(store_id))
+        except Exception as e:
+            mark_redis_down(e)
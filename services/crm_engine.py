@@ -2,23 +2,44 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from collections import Counter
-from models import Order, Campaign, CampaignLog, Store, Customer, Address
+from models import Order, OrderItem, Campaign, CampaignLog, Store, Customer, Address
+from services.order_items import order_items_ready
 from services.whatsapp import send_whatsapp_template
 
 def get_favorite_product(db: Session, store_id: int, phone: str):
-    orders = db.query(Order).filter(
+    has_orders = db.query(Order.id).filter(
         Order.store_id == store_id,
         Order.customer_phone == phone
-    ).all()
+    ).first()
 
-    if not orders: return "Pizza Especial"
+    if not has_orders: return "Pizza Especial"
 
     IGNORE_TERMS = ["coca", "guaraná", "fanta", "sprite", "h2oh", "agua", "água", "cerveja", "suco", "refrigerante", "entrega", "taxa", "borda"]
+
+    if order_items_ready(db, store_id):
+        # Nomes já limpos em order_items: o banco conta, aqui só filtra bebida/taxa
+        rows = db.query(OrderItem.name, func.count(OrderItem.id).label("times")).join(
+            Order, Order.id == OrderItem.order_id
+        ).filter(
+            Order.store_id == store_id,
+            Order.customer_phone == phone,
+            OrderItem.parent_index == None,
+            OrderItem.name != "",
+            OrderItem.name != "None"
+        ).group_by(OrderItem.name).order_by(func.count(OrderItem.id).desc()).all()
+        for name, _ in rows:
+            if not any(term in name.lower() for term in IGNORE_TERMS): return name
+        return "Pizza"
+
+    orders = db.query(Order.items_json).filter(
+        Order.store_id == store_id,
+        Order.customer_phone == phone
+    ).all()
     all_items = []
     
-    for order in orders:
-        if not order.items_json: continue
-        for item in order.items_json:
+    for (items_json,) in orders:
+        if not items_json: continue
+        for item in items_json:
             name = item.get('title', '').strip()
             if not name or name == "None": continue
             clean_name = name.split('(')[0].strip()
@@ -0,0 +1,151 @@
+# Arquivo: pizzaria/services/db_indexes.py
+import json
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from database import Base, engine
+import models  # noqa: F401  (registra as tabelas/índices no Base.metadata)
+
+# ==========================================
+#     ÍNDICES GERENCIADOS (VERSÃO + CHECAGEM)
+# ==========================================
+# Os índices são declarados nos modelos (__table_args__ em models.py) com prefixo
+# "idx_". Este módulo:
+#   1. Cria os que faltam com CREATE INDEX CONCURRENTLY (não trava escrita no orders).
+#      Um CONCURRENTLY que falhou no meio deixa o índice INVALID: ele é removido e refeito.
+#   2. Grava a versão aplicada (db_index_version) para saber se o banco está em dia.
+#   3. Roda EXPLAIN nas consultas quentes e acusa quem cair em Seq Scan.
+#
+# >>> Mudou/adicionou índice em models.py? Suba INDEX_VERSION. <<<
+# Rodar: python create_indexes.py [--check]  (ou botão Otimizar no painel)
+
+INDEX_VERSION = 2
+INDEX_PREFIX = "idx_"
+
+# Consultas quentes: (nome, tabela que deve usar índice, SQL, parâmetros de exemplo)
+HOT_QUERIES = [
+    ("dashboard_periodo", "orders",
+     "SELECT id FROM orders WHERE store_id = :store_id AND created_at >= now() - interval '1 day'", {}),
+    ("dedup_external_id", "orders",
+     "SELECT id FROM orders WHERE store_id = :store_id AND external_id = :code LIMIT 1", {"code": "0"}),
+    ("dedup_wabiz_id", "orders",
+     "SELECT id FROM orders WHERE store_id = :store_id AND wabiz_id = :code LIMIT 1", {"code": "0"}),
+    ("acerto_motoboy", "orders",
+     "SELECT id FROM orders WHERE driver_id = 0 AND status IN ('ENTREGUE', 'CONCLUIDO') "
+     "AND cash_opening_id = 0 AND is_driver_paid = false", {}),
+    ("painel_ativos", "orders",
+     "SELECT id FROM orders WHERE store_id = :store_id AND status IN ('PREPARO', 'FORNO', 'PRONTO')", {}),
+    ("consumo_estoque", "stock_logs",
+     "SELECT id FROM stock_logs WHERE store_id = :store_id AND movement_type = 'OUT' "
+     "AND created_at >= now() - interval '30 days'", {}),
+    ("campanha_ja_enviada", "campaign_logs",
+     "SELECT id FROM campaign_logs WHERE campaign_id = 0 AND customer_phone = :code LIMIT 1", {"code": "0"}),
+    ("pixel_pendente", "pending_pixel_events",
+     "SELECT id FROM pending_pixel_events WHERE store_id = :store_id AND event_id = :code "
+     "AND status = 'PENDING' LIMIT 1", {"code": "0"}),
+    ("itens_do_pedido", "order_items",
+     "SELECT id FROM order_items WHERE order_id = 0", {}),
+    ("itens_periodo", "order_items",
+     "SELECT id FROM order_items WHERE store_id = :store_id AND created_at >= now() - interval '30 days'", {}),
+]
+
+
+def managed_indexes():
+    """Todos os índices declarados nos modelos com o prefixo idx_."""
+    found = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            if index.name and index.name.startswith(INDEX_PREFIX):
+                found.append(index)
+    return found
+
+
+def _create_sql(index, dialect):
+    sql = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    return sql.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+
+
+def applied_version(conn):
+    try:
+        return conn.execute(text("SELECT max(version) FROM db_index_version")).scalar()
+    except Exception:
+        return None
+
+
+def build_indexes(log=print) -> dict:
+    """Cria/repara os índices gerenciados. CONCURRENTLY exige AUTOCOMMIT (fora de transação)."""
+    result = {"created": [], "rebuilt": [], "errors": []}
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        invalid = {row[0] for row in conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+        ))}
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+        ))}
+
+        for index in managed_indexes():
+            try:
+                if index.name in invalid:
+                    log(f"🔧 [Índices] {index.name} ficou INVALID (build interrompido). Refazendo...")
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                    result["rebuilt"].append(index.name)
+                elif index.name in existing:
+                    continue
+                else:
+                    result["created"].append(index.name)
+
+                log(f"🔧 [Índices] Criando {index.name} em {index.table.name}...")
+                conn.execute(text(_create_sql(index, conn.dialect)))
+            except Exception as e:
+                log(f"   ⚠️ [Índices] Falha em {index.name}: {e}")
+                result["errors"].append(f"{index.name}: {e}")
+
+        if not result["errors"]:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS db_index_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP DEFAULT now())"
+            ))
+            conn.execute(text(
+                "INSERT INTO db_index_version (version) VALUES (:v) ON CONFLICT (version) DO NOTHING"
+            ), {"v": INDEX_VERSION})
+
+        result["version"] = applied_version(conn)
+    log(f"🏁 [Índices] Versão {result['version']} (código: {INDEX_VERSION}). "
+        f"{len(result['created'])} criados, {len(result['rebuilt'])} refeitos, {len(result['errors'])} erros.")
+    return result
+
+
+# --- CHECAGEM (EXPLAIN) ---
+
+def _seq_scans(plan, table):
+    """Procura nós 'Seq Scan' na tabela dentro do plano (JSON do EXPLAIN)."""
+    hits = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == table:
+        hits.append(plan)
+    for child in plan.get("Plans", []) or []:
+        hits += _seq_scans(child, table)
+    return hits
+
+
+def check_hot_queries(store_id: int = 0, log=print) -> list:
+    """
+    Roda EXPLAIN em cada consulta quente com enable_seqscan desligado: se mesmo assim
+    o plano usar Seq Scan, não existe índice que sirva. Retorna a lista de falhas.
+    """
+    failures = []
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, table, sql, params in HOT_QUERIES:
+                raw = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), {"store_id": store_id, **params}).scalar()
+                plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                if _seq_scans(plan, table):
+                    failures.append(name)
+                    log(f"   ❌ [Índices] {name}: Seq Scan em {table}")
+                else:
+                    log(f"   ✅ [Índices] {name}")
+        finally:
+            trans.rollback()
+    return failures
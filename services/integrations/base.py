@@ -2,17 +2,58 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
 from datetime import datetime
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Renova o token um pouco antes de expirar (evita 401 no meio do polling)
+TOKEN_REFRESH_MARGIN = 60
+
+# --- SESSÕES HTTP COMPARTILHADAS (KEEP-ALIVE) ---
+# Uma sessão por upstream (wabiz, ifood): reaproveita a conexão TLS entre ciclos
+# de polling e entre lojas, em vez de abrir um handshake novo a cada chamada.
+_http_sessions = {}
+_http_lock = threading.Lock()
+
+
+def get_http_session(upstream: str) -> requests.Session:
+    with _http_lock:
+        session = _http_sessions.get(upstream)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_sessions[upstream] = session
+        return session
 
 class BaseIntegration(ABC):
     """
     Classe Abstrata que define o contrato para qualquer integração (Wabiz, iFood, Saipos, etc).
     """
+    upstream = "default"  # Nome da sessão HTTP compartilhada
+
     def __init__(self, token: str, user: str = None, password: str = None, base_url: str = None):
         self.token = token
+        self.token_expires_at = 0
         self.user = user
         self.password = password
         self.base_url = base_url
 
+    @property
+    def http(self) -> requests.Session:
+        return get_http_session(self.upstream)
+
+    def _token_is_fresh(self) -> bool:
+        return bool(self.token) and time.time() < getattr(self, "token_expires_at", 0) - TOKEN_REFRESH_MARGIN
+
+    def _store_token(self, token: str, expires_in):
+        self.token = token
+        try: expires_in = int(expires_in)
+        except (TypeError, ValueError): expires_in = 3600
+        self.token_expires_at = time.time() + expires_in
+
     @abstractmethod
     def fetch_orders(self) -> List[Dict[str, Any]]:
         """
@@ -1,6 +1,5 @@
 # Arquivo: pizzaria/services/integrations/ifood.py
 from fastapi import status
-import requests
 import pytz
 import re
 from datetime import datetime
@@ -13,12 +12,14 @@ IFOOD_AUTH_URL = "https://merchant-api.ifood.com.br/authentication/v1.0/oauth/to
 IFOOD_BASE_URL = "https://merchant-api.ifood.com.br/order/v1.0"
 
 class IfoodAdapter(BaseIntegration):
+    upstream = "ifood"
     
     def __init__(self, user: str, password: str, merchant_id: str):
         self.client_id = user
         self.client_secret = password
         self.merchant_id = merchant_id
         self.token = None
+        self.token_expires_at = 0
 
     def _authenticate(self):
         try:
@@ -29,9 +30,10 @@ class IfoodAdapter(BaseIntegration):
             }
             headers = {"Content-Type": "application/x-www-form-urlencoded"}
             
-            resp = requests.post(IFOOD_AUTH_URL, data=payload, headers=headers, timeout=10)
+            resp = self.http.post(IFOOD_AUTH_URL, data=payload, headers=headers, timeout=10)
             if resp.status_code == 200:
-                self.token = resp.json().get("accessToken")
+                data = resp.json()
+                self._store_token(data.get("accessToken"), data.get("expiresIn"))
                 return True
             print(f"❌ [iFood] Erro Auth: {resp.text}")
             return False
@@ -43,16 +45,26 @@ class IfoodAdapter(BaseIntegration):
             return False
         
     def _get_headers(self):
-        if not self.token:
+        if not self._token_is_fresh():
             if not self._authenticate(): return None
         return {"Authorization": f"Bearer {self.token}"}
+
+    def _request(self, method, url, **kwargs):
+        """Chamada autenticada (keep-alive). Em 401 renova o token e tenta UMA vez."""
+        for attempt in range(2):
+            headers = self._get_headers()
+            if not headers: return None
+            resp = self.http.request(method, url, headers=headers, **kwargs)
+            if resp.status_code != 401 or attempt == 1:
+                return resp
+            self.token = None
+            self.token_expires_at = 0
     
     # --- AÇÕES DE PEDIDO (COM LOGS DETALHADOS) ---
     def confirm_order(self, order_id: str):
-        headers = self._get_headers()
-        if not headers: return False
         try:
-            r = requests.post(f"{IFOOD_BASE_URL}/orders/{order_id}/confirm", headers=headers, timeout=5)
+            r = self._request("POST", f"{IFOOD_BASE_URL}/orders/{order_id}/confirm", timeout=5)
+            if r is None: return False
             if r.status_code == 202: return True
             print(f"❌ [iFood] Falha Confirm ({r.status_code}): {r.text}")
             return False
@@ -61,10 +73,9 @@ class IfoodAdapter(BaseIntegration):
             return False
 
     def dispatch_order(self, order_id: str):
-        headers = self._get_headers()
-        if not headers: return False
         try:
-            r = requests.post(f"{IFOOD_BASE_URL}/orders/{order_id}/dispatch", headers=headers, timeout=5)
+            r = self._request("POST", f"{IFOOD_BASE_URL}/orders/{order_id}/dispatch", timeout=5)
+            if r is None: return False
             if r.status_code == 202:
                 print(f"✅ [iFood] Pedido {order_id} despachado com sucesso!")
                 return True
@@ -75,10 +86,9 @@ class IfoodAdapter(BaseIntegration):
             return False
 
     def ready_to_pickup(self, order_id: str):
-        headers = self._get_headers()
-        if not headers: return False
         try: 
-            r = requests.post(f"{IFOOD_BASE_URL}/orders/{order_id}/readyToPickup", headers=headers, timeout=5)
+            r = self._request("POST", f"{IFOOD_BASE_URL}/orders/{order_id}/readyToPickup", timeout=5)
+            if r is None: return False
             if r.status_code == 202: return True
             print(f"❌ [iFood] Falha ReadyToPickup ({r.status_code}): {r.text}")
             return False
@@ -87,24 +97,21 @@ class IfoodAdapter(BaseIntegration):
             return False
 
     def request_cancellation(self, order_id: str, reason_code: str, details: str):
-        headers = self._get_headers()
-        if not headers: return False
         try:
             payload = {"reason": reason_code, "cancellationCode": reason_code, "details": details}
-            return requests.post(f"{IFOOD_BASE_URL}/orders/{order_id}/requestCancellation", json=payload, headers=headers, timeout=5).status_code == 202
+            r = self._request("POST", f"{IFOOD_BASE_URL}/orders/{order_id}/requestCancellation", json=payload, timeout=5)
+            return r is not None and r.status_code == 202
         except: return False
 
     # --- POLLING DE EVENTOS ---
     def fetch_orders(self) -> List[Dict[str, Any]]:
-        headers = self._get_headers()
-        if not headers: return []
-
         orders_found = []
         acks = []
 
         try:
             url_events = f"{IFOOD_BASE_URL}/events:polling"
-            resp = requests.get(url_events, headers=headers, timeout=10)
+            resp = self._request("GET", url_events, timeout=10)
+            if resp is None: return []
             
             if resp.status_code == 200:
                 events = resp.json() or []
@@ -118,8 +125,8 @@ class IfoodAdapter(BaseIntegration):
                     if not order_id: continue
 
                     if code == 'PLC':
-                        r_det = requests.get(f"{IFOOD_BASE_URL}/orders/{order_id}", headers=headers, timeout=10)
-                        if r_det.status_code == 200:
+                        r_det = self._request("GET", f"{IFOOD_BASE_URL}/orders/{order_id}", timeout=10)
+                        if r_det is not None and r_det.status_code == 200:
                             full_order = r_det.json()
                             full_order['event_code'] = 'PLC'
                             orders_found.append(full_order)
@@ -132,10 +139,7 @@ class IfoodAdapter(BaseIntegration):
                         })
 
                 if acks:
-                    requests.post(f"{IFOOD_BASE_URL}/events/acknowledgment", json=acks, headers=headers)
-            
-            elif resp.status_code == 401:
-                self.token = None 
+                    self._request("POST", f"{IFOOD_BASE_URL}/events/acknowledgment", json=acks, timeout=10)
                 
             return orders_found
 
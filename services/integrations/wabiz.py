@@ -1,4 +1,3 @@
-import requests
 import re
 import pytz
 import json
@@ -10,8 +9,11 @@ from models import Order
 from fastapi import status
 
 class WabizAdapter(BaseIntegration):
+    upstream = "wabiz"
     
     def _get_auth_token(self):
+        # Token em cache até perto de expirar (antes era um POST /token por chamada)
+        if self._token_is_fresh(): return self.token
         try:
             url = f"{self.base_url.rstrip('/')}/token"
             
@@ -25,11 +27,12 @@ class WabizAdapter(BaseIntegration):
             headers = {"Content-Type": "application/x-www-form-urlencoded"}
             
             # Agora a variável 'headers' existe e o VS Code não vai mais reclamar
-            r = requests.post(url, data=payload, headers=headers, timeout=15)
+            r = self.http.post(url, data=payload, headers=headers, timeout=15)
             
             if r.status_code == 200:
-                token = r.json().get("access_token")
-                return token
+                data = r.json()
+                self._store_token(data.get("access_token"), data.get("expires_in"))
+                return self.token
             
             print(f"❌ [Wabiz] Erro Auth ({r.status_code}): {r.text}")
             return None
@@ -38,21 +41,35 @@ class WabizAdapter(BaseIntegration):
             print(f"❌ [Wabiz] Erro Conexão: {e}")
             return None
 
+    def _request(self, method, url, headers=None, **kwargs):
+        """
+        Chamada autenticada pela sessão compartilhada.
+        Se a Wabiz responder 401 (token revogado), renova o token e tenta UMA vez.
+        """
+        for attempt in range(2):
+            token = self._get_auth_token()
+            if not token: return None
+            final_headers = dict(headers or {})
+            final_headers["Authorization"] = f"Bearer {token}"
+            resp = self.http.request(method, url, headers=final_headers, **kwargs)
+            if resp.status_code != 401 or attempt == 1:
+                return resp
+            self.token = None
+            self.token_expires_at = 0
+
    # --- 2. BUSCA DE PEDIDOS (VERSÃO 2) ---
     def fetch_orders(self) -> List[Dict[str, Any]]:
-        token = self._get_auth_token()
-        if not token: return []
-
         try:
             # CORREÇÃO: O endpoint de pedidos mudou para V2
             # A base_url padrão termina em /api/v1, então trocamos para /api/v2
             base_v2 = self.base_url.replace("/api/v1", "/api/v2")
             url = f"{base_v2.rstrip('/')}/orders/pending"
             
-            headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+            headers = {"Accept": "application/json"}
             
             # Timeout de 15s para garantir
-            resp = requests.get(url, headers=headers, timeout=15)
+            resp = self._request("GET", url, headers=headers, timeout=15)
+            if resp is None: return []
             
             if resp.status_code == 200:
                 data = resp.json()
@@ -485,9 +502,6 @@ class WabizAdapter(BaseIntegration):
 
 # --- ENVIO DE STATUS (CONFIRMAÇÃO / DESPACHO) ---
     def update_status(self, order_number, internal_key, status_code, message=""):
-        token = self._get_auth_token()
-        if not token: return False
-        
         # A URL é V1 conforme sua documentação
         url = f"{self.base_url.replace('/api/v2', '/api/v1').rstrip('/')}/orders/status"
         
@@ -501,14 +515,14 @@ class WabizAdapter(BaseIntegration):
         }
         
         headers = {
-            "Authorization": f"Bearer {token}", 
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "application/json"
         }
         
         try:
             print(f"📤 [Wabiz] Atualizando Status #{order_number} -> {status_code}...")
-            r = requests.post(url, data=payload, headers=headers, timeout=10)
+            r = self._request("POST", url, data=payload, headers=headers, timeout=10)
+            if r is None: return False
             
             if r.status_code == 200:
                 print(f"✅ [Wabiz] Sucesso: {r.text}")
@@ -524,20 +538,17 @@ class WabizAdapter(BaseIntegration):
     # --- INSIRA ISTO DENTRO DA CLASSE WabizAdapter ---
     def get_order_by_id(self, order_number: str) -> Dict[str, Any]:
         """Busca pedido específico para resgate imediato (Race Condition)"""
-        token = self._get_auth_token()
-        if not token: return None
-
         try:
             # Garante uso da V2
             base_v2 = self.base_url.replace("/api/v1", "/api/v2")
             url = f"{base_v2.rstrip('/')}/orders/{order_number}"
             
-            headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+            headers = {"Accept": "application/json"}
             
             # Timeout curto pois é uma operação de tempo real
-            resp = requests.get(url, headers=headers, timeout=10)
+            resp = self._request("GET", url, headers=headers, timeout=10)
             
-            if resp.status_code == 200:
+            if resp is not None and resp.status_code == 200:
                 data = resp.json()
                 # A Wabiz às vezes retorna o objeto direto, às vezes dentro de 'data'
                 return data.get("data", data)
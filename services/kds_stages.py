@@ -0,0 +1,154 @@
+# Arquivo: pizzaria/services/kds_stages.py
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import OrderItemStage
+
+# ==========================================
+#     ESTÁGIO DOS ITENS NO KDS (POR LINHA)
+# ==========================================
+# Antes, cada toque no KDS fazia deepcopy do items_json, marcava kds_stage/kds_done,
+# regravava o JSON inteiro e o último a salvar ganhava: duas telas de setor tocando
+# no mesmo pedido apagavam o estágio uma da outra.
+#
+# Agora cada item tem uma linha em order_item_stages. Avançar = UPSERT que só sobe
+# o estágio (nunca volta), e o status do pedido sai de uma agregação dessas linhas.
+# Quando os itens do pedido são editados (PDV, app do garçom), as linhas são remapeadas
+# pela assinatura do item: o que já estava no pedido mantém o estágio (não volta para a
+# cozinha, mesmo que a tela tenha mandado um kds_stage velho); item novo vale o do JSON.
+#
+# Os itens normalizados (items_view) trazem src_index = posição no items_json; é essa
+# posição que indexa as linhas (um item agrupado da Wabiz vira vários na tela).
+
+STAGE_KITCHEN = 0
+STAGE_OVEN = 1
+STAGE_DONE = 2
+
+
+def json_stage(item) -> int:
+    """Estágio gravado dentro do item (formato antigo)."""
+    try: return int(item.get("kds_stage") or 0)
+    except: return STAGE_KITCHEN
+
+
+def load_item_stages(db, order_ids) -> dict:
+    """{order_id: {item_index: stage}} numa consulta só."""
+    order_ids = [i for i in order_ids if i]
+    if not order_ids: return {}
+    stages = {}
+    rows = db.query(OrderItemStage.order_id, OrderItemStage.item_index, OrderItemStage.stage).filter(
+        OrderItemStage.order_id.in_(order_ids)
+    ).all()
+    for order_id, item_index, stage in rows:
+        stages.setdefault(order_id, {})[item_index] = stage
+    return stages
+
+
+def item_signature(item) -> str:
+    """Assinatura de um item (produto, quantidade, obs, sabores, removidos)."""
+    pid = str(item.get('product_id') or item.get('id') or "0")
+    try: qty = "{:.2f}".format(float(item.get('quantity', 0)))
+    except: qty = "0.00"
+
+    raw_obs = str(item.get('observation') or "").strip().lower()
+    obs = raw_obs if raw_obs not in ["none", "null", ""] else ""
+
+    parts = sorted([str(p).strip().lower() for p in item.get('parts') or []])
+    rem = sorted([str(r) for r in item.get('removed_ingredients') or []])
+    return f"{pid}|{qty}|{obs}|{parts}|{rem}"
+
+
+def apply_item_stages(items, stages, copy_items=True, normalized=False):
+    """
+    Sobrepõe os estágios da tabela nos itens (kds_stage / kds_done).
+    `items` é o items_json (posição = índice) ou, com normalized=True, o items_view
+    (índice = src_index). Por padrão devolve cópias.
+    """
+    if not stages: return items
+    result = []
+    for pos, item in enumerate(items):
+        idx = item.get("src_index") if normalized and isinstance(item, dict) else pos
+        if idx in stages and isinstance(item, dict):
+            if copy_items: item = dict(item)
+            item["kds_stage"] = stages[idx]
+            item["kds_done"] = stages[idx] >= STAGE_DONE
+        result.append(item)
+    return result
+
+
+def advance_item_stages(db, order, moves, current) -> list:
+    """
+    Grava os avanços (item_index -> (sector_id, novo estágio)) com um único UPSERT.
+    Itens do pedido que ainda não têm linha entram com o estágio atual (para a
+    agregação enxergar o pedido inteiro). Retorna os índices que realmente subiram.
+    Faz commit.
+    """
+    now = datetime.utcnow()
+    rows = []
+    for idx, stage in current.items():
+        sector_id, new_stage = moves.get(idx, (None, stage))
+        rows.append({"order_id": order.id, "item_index": idx, "sector_id": sector_id,
+                     "stage": new_stage, "updated_at": now})
+    if not rows: return []
+
+    stmt = pg_insert(OrderItemStage).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderItemStage.order_id, OrderItemStage.item_index],
+        set_={"stage": stmt.excluded.stage, "sector_id": func.coalesce(stmt.excluded.sector_id, OrderItemStage.sector_id),
+              "updated_at": stmt.excluded.updated_at},
+        # Só sobe: dois toques simultâneos no mesmo item não regridem nem duplicam
+        where=OrderItemStage.stage < stmt.excluded.stage,
+    ).returning(OrderItemStage.item_index, OrderItemStage.stage)
+
+    returned = db.execute(stmt).all()
+    db.commit()
+    return [idx for idx, stage in returned if idx in moves]
+
+
+def derive_order_status(db, order_id: int, items_count: int):
+    """Status global do pedido a partir das linhas (PRONTO / FORNO / PREPARO)."""
+    total, done, oven = db.query(
+        func.count(OrderItemStage.id),
+        func.count(OrderItemStage.id).filter(OrderItemStage.stage >= STAGE_DONE),
+        func.count(OrderItemStage.id).filter(OrderItemStage.stage == STAGE_OVEN),
+    ).filter(
+        OrderItemStage.order_id == order_id,
+        OrderItemStage.item_index < items_count,
+    ).one()
+
+    if total >= items_count and done >= items_count: return "PRONTO"
+    if oven: return "FORNO"
+    return "PREPARO"
+
+
+def remap_item_stages(db, order_id: int, old_items, new_items):
+    """
+    Itens do pedido foram editados: leva o estágio de cada item antigo para a nova
+    posição do mesmo item (pela assinatura). Nunca regride. Sem commit.
+    """
+    old_items = old_items if isinstance(old_items, list) else []
+    new_items = new_items if isinstance(new_items, list) else []
+    rows = {idx: (stage, sector_id) for idx, stage, sector_id in db.query(
+        OrderItemStage.item_index, OrderItemStage.stage, OrderItemStage.sector_id
+    ).filter(OrderItemStage.order_id == order_id).all()}
+
+    # Assinatura -> estágios dos itens antigos (na ordem, para itens repetidos)
+    pool = {}
+    for idx, item in enumerate(old_items):
+        if not isinstance(item, dict): continue
+        stage, sector_id = rows.get(idx, (json_stage(item), None))
+        pool.setdefault(item_signature(item), []).append((stage, sector_id))
+
+    now = datetime.utcnow()
+    remapped = []
+    for idx, item in enumerate(new_items):
+        if not isinstance(item, dict): continue
+        matches = pool.get(item_signature(item))
+        if not matches: continue  # Item novo: vale o kds_stage do JSON
+        stage, sector_id = matches.pop(0)
+        remapped.append({"order_id": order_id, "item_index": idx, "sector_id": sector_id,
+                         "stage": max(stage, json_stage(item)), "updated_at": now})
+
+    db.query(OrderItemStage).filter(OrderItemStage.order_id == order_id).delete(synchronize_session=False)
+    if remapped: db.bulk_insert_mappings(OrderItemStage, remapped)
@@ -0,0 +1,227 @@
+# Arquivo: pizzaria/services/market_basket.py
+import os
+from datetime import datetime, timedelta
+from itertools import combinations
+from collections import Counter
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import SessionLocal
+from models import OrderItem, BasketItemset, BasketRule, BasketState
+from services.order_items import order_items_ready
+
+# ==========================================
+#     CESTA DE COMPRAS (COMBOS FREQUENTES)
+# ==========================================
+# O analyze_combos pegava os últimos 500 pedidos, montava todos os pares em Python
+# a cada chamada e devolvia só o par mais comum (sem dizer se era acaso: Coca
+# aparece com tudo). Agora:
+#   1. Cada pedido da janela (BASKET_WINDOW_DAYS, 0 = histórico inteiro) vira uma
+#      cesta com os nomes limpos dos itens principais (tabela order_items).
+#   2. basket_itemsets guarda em quantos pedidos cada produto, par e trio apareceu.
+#      A cada rodada só entra a diferença: soma os pedidos novos e subtrai os que
+#      saíram da janela. Uma vez por dia a contagem é refeita do zero (pega pedidos
+#      editados/cancelados depois de contados).
+#   3. Das contagens saem as regras "quem leva A (e B) leva C" com suporte,
+#      confiança e lift, gravadas já ranqueadas em basket_rules.
+# O PizzaBrain (analyze_combos / combo_opportunities) e o scanner de oportunidades
+# só leem basket_rules. Roda no Celery (basket_rules_async), agendado pelo robô.
+# Sem numpy/scipy no projeto: contagem em Python, mas só sobre a diferença.
+
+BASKET_WINDOW_DAYS = int(os.getenv("BASKET_WINDOW_DAYS", "180"))
+BASKET_FULL_REBUILD_HOURS = 24
+BASKET_LAG = timedelta(minutes=10)   # Itens do pedido são gravados logo depois do commit
+BASKET_MAX_TRIPLE_ITEMS = 12         # Cestas maiores só contam pares (C(12,3) = 220 trios)
+BASKET_MIN_COUNT = 3                 # Suporte mínimo (pedidos) para virar regra
+BASKET_MIN_CONFIDENCE = 0.05
+BASKET_MIN_LIFT = 1.0                # Abaixo de 1 a dupla sai junto MENOS que o acaso
+BASKET_MAX_RULES = 100
+BASKET_BATCH = 1000
+
+ITEMSET_SEP = "\x1f"
+_LOCK_KEY = 81120025  # pg_try_advisory_xact_lock(_LOCK_KEY, loja)
+
+
+def itemset_key(names) -> str:
+    return ITEMSET_SEP.join(sorted(names))
+
+
+def itemset_names(key: str) -> list:
+    return key.split(ITEMSET_SEP)
+
+
+def _basket_itemsets(names):
+    """Produtos, pares e trios de uma cesta (nomes já ordenados)."""
+    yield from ((n,) for n in names)
+    yield from combinations(names, 2)
+    if len(names) <= BASKET_MAX_TRIPLE_ITEMS:
+        yield from combinations(names, 3)
+
+
+def count_baskets(db, store_id: int, start, end):
+    """(Counter itemset -> pedidos, total de cestas) dos pedidos criados em [start, end)."""
+    query = db.query(OrderItem.order_id, OrderItem.name).filter(
+        OrderItem.store_id == store_id,
+        OrderItem.parent_index == None,
+        OrderItem.is_cancelled == False,
+        OrderItem.name != "",
+        OrderItem.created_at < end,
+    )
+    if start is not None: query = query.filter(OrderItem.created_at >= start)
+
+    counts = Counter()
+    baskets = 0
+    current_id, names = None, set()
+    for order_id, name in query.order_by(OrderItem.order_id).yield_per(5000):
+        if order_id != current_id:
+            if names:
+                counts.update(itemset_key(s) for s in _basket_itemsets(sorted(names)))
+                baskets += 1
+            current_id, names = order_id, set()
+        names.add(name)
+    if names:
+        counts.update(itemset_key(s) for s in _basket_itemsets(sorted(names)))
+        baskets += 1
+    return counts, baskets
+
+
+def _apply_delta(db, store_id, delta):
+    """Soma (ou subtrai) contagens com UPSERT e apaga quem zerou."""
+    rows = [{"store_id": store_id, "itemset": key, "size": key.count(ITEMSET_SEP) + 1, "count": value}
+            for key, value in delta.items() if value]
+    for i in range(0, len(rows), BASKET_BATCH):
+        stmt = pg_insert(BasketItemset).values(rows[i:i + BASKET_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BasketItemset.store_id, BasketItemset.itemset],
+            set_={"count": BasketItemset.count + stmt.excluded.count},
+        )
+        db.execute(stmt)
+    db.query(BasketItemset).filter(
+        BasketItemset.store_id == store_id, BasketItemset.count <= 0
+    ).delete(synchronize_session=False)
+
+
+def _rebuild_counts(db, store_id, start, end):
+    counts, baskets = count_baskets(db, store_id, start, end)
+    db.query(BasketItemset).filter(BasketItemset.store_id == store_id).delete(synchronize_session=False)
+    rows = [{"store_id": store_id, "itemset": key, "size": key.count(ITEMSET_SEP) + 1, "count": value}
+            for key, value in counts.items()]
+    for i in range(0, len(rows), BASKET_BATCH):
+        db.bulk_insert_mappings(BasketItemset, rows[i:i + BASKET_BATCH])
+    return baskets
+
+
+# --- REGRAS (SUPORTE / CONFIANÇA / LIFT) ---
+
+def build_rules(counts: dict, baskets: int, min_count: int = BASKET_MIN_COUNT) -> list:
+    """Regras ranqueadas a partir das contagens (itemset -> pedidos)."""
+    if not baskets: return []
+    rules = []
+    for key, together in counts.items():
+        names = itemset_names(key)
+        if len(names) < 2 or together < min_count: continue
+        for consequent in names:
+            antecedent = [n for n in names if n != consequent]
+            base = counts.get(itemset_key(antecedent))
+            alone = counts.get(consequent)
+            if not base or not alone: continue
+            confidence = together / base
+            lift = confidence / (alone / baskets)
+            if confidence < BASKET_MIN_CONFIDENCE or lift <= BASKET_MIN_LIFT: continue
+            rules.append({
+                "antecedent": antecedent, "consequent": consequent, "itemset_size": len(names),
+                "support_count": together, "support": together / baskets,
+                "confidence": confidence, "lift": lift,
+            })
+    # Mais forte que o acaso primeiro; empate: mais pedidos
+    rules.sort(key=lambda r: (-r["lift"], -r["support_count"], -r["confidence"]))
+    return rules[:BASKET_MAX_RULES]
+
+
+def _save_rules(db, store_id, baskets):
+    counts = dict(db.query(BasketItemset.itemset, BasketItemset.count).filter(
+        BasketItemset.store_id == store_id
+    ).all())
+    rules = build_rules(counts, baskets)
+    now = datetime.utcnow()
+    db.query(BasketRule).filter(BasketRule.store_id == store_id).delete(synchronize_session=False)
+    if rules:
+        db.bulk_insert_mappings(BasketRule, [
+            {"store_id": store_id, "rank": rank, "computed_at": now, **rule}
+            for rank, rule in enumerate(rules, start=1)
+        ])
+    return len(rules)
+
+
+# --- ATUALIZAÇÃO (POR LOJA) ---
+
+def refresh_basket_rules(db, store_id: int, force_full: bool = False) -> dict:
+    """
+    Atualiza contagens e regras da loja. Incremental quando dá; do zero uma vez por dia,
+    na primeira vez ou se a janela mudou. Faz commit.
+    """
+    if not order_items_ready(db, store_id):
+        return {"skipped": "order_items sem backfill"}
+
+    # Outro worker já está nesta loja: deixa para a próxima rodada
+    if not db.execute(text("SELECT pg_try_advisory_xact_lock(:k1, :k2)"), {"k1": _LOCK_KEY, "k2": store_id}).scalar():
+        return {"skipped": "em andamento"}
+
+    now = datetime.utcnow()
+    end = now - BASKET_LAG
+    start = end - timedelta(days=BASKET_WINDOW_DAYS) if BASKET_WINDOW_DAYS else None
+
+    state = db.query(BasketState).get(store_id)
+    full = (
+        force_full or not state or not state.full_rebuild_at
+        or (state.window_days or 0) != BASKET_WINDOW_DAYS
+        or now - state.full_rebuild_at > timedelta(hours=BASKET_FULL_REBUILD_HOURS)
+    )
+
+    if full:
+        baskets = _rebuild_counts(db, store_id, start, end)
+        if not state:
+            state = BasketState(store_id=store_id)
+            db.add(state)
+        state.full_rebuild_at = now
+    else:
+        added, added_baskets = count_baskets(db, store_id, state.window_end, end)
+        delta = Counter(added)
+        removed_baskets = 0
+        if start is not None and state.window_start is not None and start > state.window_start:
+            # Pedidos que saíram da janela
+            removed, removed_baskets = count_baskets(db, store_id, state.window_start, start)
+            delta.subtract(removed)
+        _apply_delta(db, store_id, delta)
+        baskets = (state.basket_count or 0) + added_baskets - removed_baskets
+
+    state.window_days = BASKET_WINDOW_DAYS
+    state.window_start = start
+    state.window_end = end
+    state.basket_count = baskets
+    state.updated_at = now
+
+    rules = _save_rules(db, store_id, baskets)
+    db.commit()
+    return {"full": full, "baskets": baskets, "rules": rules}
+
+
+def refresh_store_basket(store_id: int, force_full: bool = False) -> dict:
+    """Versão com sessão própria (Celery / rota de manutenção)."""
+    db = SessionLocal()
+    try:
+        return refresh_basket_rules(db, store_id, force_full)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def top_rules(db, store_id: int, limit: int = 20, min_support: int = BASKET_MIN_COUNT) -> list:
+    """Regras gravadas, na ordem do rank."""
+    return db.query(BasketRule).filter(
+        BasketRule.store_id == store_id,
+        BasketRule.support_count >= min_support
+    ).order_by(BasketRule.rank).limit(limit).all()
@@ -1,5 +1,136 @@
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm.attributes import set_committed_value
+
+# ==========================================
+#     VISÃO NORMALIZADA GRAVADA NO PEDIDO
+# ==========================================
+# O resultado do normalizador fica em Order.items_view (calculado na escrita, via
+# before_flush em models.py). Pedidos antigos, ou gravados com uma versão anterior
+# do normalizador, são recalculados na primeira leitura e salvos em segundo plano.
+# >>> Mudou algum tradutor abaixo? Suba a versão para refazer os pedidos gravados. <<<
+NORMALIZER_VERSION = 3
+ITEMS_VIEW_BATCH = 500
+
+# Gravação fora da rota: a leitura só enfileira; um worker grava em lote (UPDATE executemany)
+_persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="items-view")
+_pending_lock = threading.Lock()
+_pending = {}  # order_id -> items_view a gravar
+
+
+def refresh_items_view(order):
+    """Recalcula e grava no objeto (vai junto com o flush de quem está salvando)."""
+    try:
+        order.items_view = normalize_order_items_for_view(order)
+        order.items_view_version = NORMALIZER_VERSION
+    except Exception as e:
+        print(f"⚠️ Erro ao gerar items_view do pedido {getattr(order, 'id', None)}: {e}")
+        order.items_view = None
+        order.items_view_version = None
+
+
+def ensure_items_views(orders):
+    """
+    Garante items_view atualizado numa lista de pedidos já carregados.
+    Os desatualizados são normalizados aqui (a rota já usa o resultado) e gravados
+    em segundo plano, numa sessão separada, sem sujar a sessão de leitura da rota.
+    """
+    stale = []
+    for o in orders:
+        if o.items_view is not None and o.items_view_version == NORMALIZER_VERSION: continue
+        try:
+            view = normalize_order_items_for_view(o)
+        except Exception as e:
+            print(f"⚠️ Erro ao normalizar pedido {o.id}: {e}")
+            view = o.items_json or []
+            set_committed_value(o, "items_view", view)
+            continue
+        set_committed_value(o, "items_view", view)
+        set_committed_value(o, "items_view_version", NORMALIZER_VERSION)
+        if o.id: stale.append({"oid": o.id, "view": view})
+
+    if stale: _persist_items_views(stale)
+    return orders
+
+
+def load_items_views(db, rows):
+    """
+    Versão para consultas por projeção (linhas, não entidades): {order_id: itens}.
+    As linhas trazem só items_view/items_view_version; o items_json bruto é buscado
+    apenas para as desatualizadas.
+    """
+    from models import Order
+
+    views = {}
+    stale_ids = []
+    for r in rows:
+        if r.items_view is not None and r.items_view_version == NORMALIZER_VERSION:
+            views[r.id] = r.items_view
+        else:
+            stale_ids.append(r.id)
+    if not stale_ids: return views
+
+    stale = []
+    sources = db.query(
+        Order.id, Order.items_json, Order.payment_method, Order.wabiz_id, Order.external_id
+    ).filter(Order.id.in_(stale_ids)).all()
+    for o in sources:
+        try:
+            views[o.id] = normalize_order_items_for_view(o)
+            stale.append({"oid": o.id, "view": views[o.id]})
+        except Exception as e:
+            print(f"⚠️ Erro ao normalizar pedido {o.id}: {e}")
+            views[o.id] = o.items_json or []
+
+    if stale: _persist_items_views(stale)
+    return views
+
+
+def get_items_view(order):
+    """Itens normalizados de um pedido (lê o gravado; recalcula se estiver velho)."""
+    ensure_items_views([order])
+    return order.items_view or []
+
+
+def _persist_items_views(rows):
+    """Enfileira a gravação (não bloqueia a leitura). Pedido já na fila não entra de novo."""
+    with _pending_lock:
+        new = {r["oid"]: r["view"] for r in rows if r["oid"] not in _pending}
+        _pending.update(new)
+    if new: _persist_executor.submit(_drain_pending)
+
+
+def _drain_pending():
+    from database import SessionLocal
+    from models import Order
+
+    with _pending_lock:
+        rows = [{"oid": oid, "view": view} for oid, view in _pending.items()]
+        _pending.clear()
+    if not rows: return
+
+    table = Order.__table__
+    stmt = table.update().where(
+        table.c.id == bindparam("oid"),
+        # Se alguém salvou o pedido nesse meio tempo, a versão já está certa: não sobrescreve
+        or_(table.c.items_view_version == None, table.c.items_view_version != NORMALIZER_VERSION)
+    ).values(items_view=bindparam("view"), items_view_version=NORMALIZER_VERSION)
+
+    db = SessionLocal()
+    try:
+        for i in range(0, len(rows), ITEMS_VIEW_BATCH):
+            db.execute(stmt, rows[i:i + ITEMS_VIEW_BATCH])
+            db.commit()
+    except Exception as e:
+        # Sem problema perder: o pedido é normalizado de novo na próxima leitura
+        db.rollback()
+        print(f"⚠️ Erro ao salvar items_view ({len(rows)} pedidos): {e}")
+    finally:
+        db.close()
+
 
 def normalize_order_items_for_view(order):
     if not order.items_json:
@@ -68,7 +199,7 @@ def normalize_order_items_for_view(order):
         return _translate_pdv(raw_items)
     
 
-def _inject_metadata(source, target):
+def _inject_metadata(source, target, src_index=None):
     # BLINDAGEM: Garante que kds_stage seja sempre um inteiro válido
     try:
         val = source.get('kds_stage')
@@ -81,6 +212,10 @@ def _inject_metadata(source, target):
     
     target['kds_done'] = source.get('kds_done', False)
     target['external_code'] = source.get('external_code') or source.get('id')
+    # Setor de produção gravado na entrada do pedido (services/sector_routing.py)
+    if 'sector_id' in source: target['sector_id'] = source['sector_id']
+    # Posição do item no items_json (chave do order_item_stages; services/kds_stages.py)
+    if src_index is not None: target['src_index'] = src_index
     return target
 
 def _detail(text, code=None, type='info'):
@@ -92,7 +227,7 @@ def _detail(text, code=None, type='info'):
 def _translate_wabiz(items):
     standardized = []
     
-    for item in items:
+    for src_index, item in enumerate(items):
         price = float(item.get('price', item.get('unitPrice', 0))) # <--- CAPTURA PREÇO
 
         # A) Formato do Banco (Display Lines - Mais Rico)
@@ -133,7 +268,7 @@ def _translate_wabiz(items):
                 "removed": [],
                 "is_pizza": "PIZZA" in name.upper() or len(edges) > 0
             }
-            standardized.append(_inject_metadata(item, final_item))
+            standardized.append(_inject_metadata(item, final_item, src_index))
 
         # B) Formato Webhook (Bruto)
         elif 'products' in item:
@@ -189,7 +324,7 @@ def _translate_wabiz(items):
                     "removed": [],
                     "is_pizza": is_pizza
                 }
-                standardized.append(_inject_metadata(prod, final_item))
+                standardized.append(_inject_metadata(prod, final_item, src_index))
 
         # C) Fallback
         else:
@@ -209,7 +344,7 @@ def _translate_wabiz(items):
                 "removed": [],
                 "is_pizza": "PIZZA" in name.upper()
             }
-            standardized.append(_inject_metadata(item, final_item))
+            standardized.append(_inject_metadata(item, final_item, src_index))
 
     return standardized
 
@@ -219,7 +354,7 @@ def _translate_wabiz(items):
 
 def _translate_ifood(items):
     standardized = []
-    for item in items:
+    for src_index, item in enumerate(items):
         name = item.get('title') or item.get('name') or "Item"
         price = float(item.get('unitPrice', item.get('price', 0))) 
         details = []
@@ -272,7 +407,7 @@ def _translate_ifood(items):
             "removed": [], 
             "is_pizza": "pizza" in name.lower()
         }
-        standardized.append(_inject_metadata(item, final_item))
+        standardized.append(_inject_metadata(item, final_item, src_index))
     return standardized
 
 # ==========================================
@@ -280,7 +415,7 @@ def _translate_ifood(items):
 # ==========================================
 def _translate_pdv(items):
     standardized = []
-    for item in items:
+    for src_index, item in enumerate(items):
         # Pega o Título e limpa prefixos
         raw_title = item.get('title') or item.get('name') or "Item"
         if raw_title.upper().startswith("PIZZA PIZZA"): raw_title = raw_title[6:].strip()
@@ -401,6 +536,6 @@ def _translate_pdv(items):
             final_item['external_code'] = main_code
             final_item['id'] = main_code
         
-        standardized.append(_inject_metadata(item, final_item))
+        standardized.append(_inject_metadata(item, final_item, src_index))
         
     return standardized
\ No newline at end of file
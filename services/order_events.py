@@ -0,0 +1,259 @@
+# Arquivo: pizzaria/services/order_events.py
+import json
+import threading
+import unicodedata
+from datetime import datetime
+import pytz
+from sqlalchemy import case
+from sqlalchemy.orm import object_session
+
+from models import Order, User
+
+from services.cache import get_redis, mark_redis_down
+from services.normalizer import get_items_view
+from services.kds_stages import load_item_stages, apply_item_stages
+from services.sockets import manager, publish_store_event
+
+# ==========================================
+#     DELTAS DE PEDIDO (PUSH PARA AS TELAS)
+# ==========================================
+# Em vez de mandar "update" e cada tela refazer a consulta inteira, o servidor
+# manda o pedido já montado (mesmo formato do card do painel) com um número de
+# sequência por loja. A tela aplica localmente; se pular um número, ressincroniza.
+#
+# Formato (texto JSON no websocket):
+# {"type": "order_created" | "order_status" | "order_items" | "order_deleted",
+#  "seq": 123, "order_id": 45, "order": {...card...}}
+
+_local_seq = {}
+_seq_lock = threading.Lock()
+
+
+def _seq_key(store_id):
+    return f"store:{store_id}:seq"
+
+
+def next_store_seq(store_id: int) -> int:
+    """Incrementa a sequência da loja (compartilhada via Redis entre processos)."""
+    r = get_redis()
+    if r is not None:
+        try:
+            return int(r.incr(_seq_key(store_id)))
+        except Exception as e:
+            mark_redis_down(e)
+    with _seq_lock:
+        _local_seq[store_id] = _local_seq.get(store_id, 0) + 1
+        return _local_seq[store_id]
+
+
+def current_store_seq(store_id: int) -> int:
+    r = get_redis()
+    if r is not None:
+        try:
+            return int(r.get(_seq_key(store_id)) or 0)
+        except Exception as e:
+            mark_redis_down(e)
+    return _local_seq.get(store_id, 0)
+
+
+# --- MONTAGEM DO CARD (usado pelo /admin/api/orders/list e pelos deltas) ---
+
+# Projeção com só o que o card usa (sem carregar a entidade Order inteira).
+# O items_json só vem quando precisa achar a taxa de entrega dentro dos itens.
+CARD_COLUMNS = (
+    Order.id, Order.store_id, Order.wabiz_id, Order.customer_name, Order.customer_phone,
+    Order.total_value, Order.discount, Order.delivery_fee, Order.service_fee,
+    Order.status, Order.payment_method, Order.created_at, Order.notes,
+    Order.address_street, Order.address_number, Order.address_neighborhood,
+    Order.table_number, Order.delivery_type, Order.driver_id, Order.driver_tip, Order.customer_credit,
+    Order.items_view, Order.items_view_version,
+    case((Order.delivery_fee > 0, None), else_=Order.items_json).label("items_json"),
+    User.full_name.label("driver_name"),
+)
+
+
+def card_query(db):
+    return db.query(*CARD_COLUMNS).outerjoin(User, User.id == Order.driver_id)
+
+
+def build_order_card(o, items=None):
+    """`o` pode ser um Order (deltas) ou uma linha de card_query (listas); `items` = itens já normalizados."""
+    dtype = o.delivery_type
+
+    if dtype == 'delivery' and "retirada" in (o.address_street or "").lower():
+        dtype = "balcao"
+
+    if not dtype:
+        dtype = "delivery"
+        if o.table_number: dtype = "mesa"
+        elif "retirada" in (o.address_street or "").lower(): dtype = "balcao"
+
+
+    if hasattr(o, "driver"):
+        driver_name = o.driver.full_name if o.driver else "Sem Motoboy"
+    else:
+        driver_name = o.driver_name or "Sem Motoboy"
+    neighborhood = o.address_neighborhood if o.address_neighborhood else "OUTROS"
+    final_delivery_fee = float(o.delivery_fee or 0.0)
+
+    if final_delivery_fee == 0 and o.items_json:
+         for item in o.items_json:
+            try:
+                title = (item.get('title') or item.get('name') or "").lower()
+                price = float(item.get('price', 0)) * float(item.get('quantity', 1))
+                if ('taxa' in title or 'entrega' in title) and price > 0: final_delivery_fee += price
+            except: pass
+
+    # --- CÁLCULO DE TEMPO CORRIGIDO (UTC -> BR) ---
+    utc = pytz.utc
+    br_zone = pytz.timezone('America/Sao_Paulo')
+    now_aware = datetime.now(br_zone)
+
+    minutes_elapsed = 0
+    formatted_time = "--:--"
+
+    if o.created_at:
+        raw_dt = o.created_at
+        # Se vier sem fuso do banco, marca como UTC
+        if raw_dt.tzinfo is None:
+            raw_dt = utc.localize(raw_dt)
+
+        # Converte para Brasil
+        local_dt = raw_dt.astimezone(br_zone)
+
+        formatted_time = local_dt.strftime('%H:%M')
+        minutes_elapsed = int((now_aware - local_dt).total_seconds() / 60)
+    # ---------------------------------------------
+
+    pm = (o.payment_method or "").lower()
+    wid = str(o.wabiz_id or "")
+    plat_code = "PDV"
+    if "ifood" in pm: plat_code = "IFOOD"
+    elif not wid.startswith("M-"): plat_code = "WABIZ"
+
+    final_name = o.customer_name or "Cliente"
+
+    # --- ITENS NORMALIZADOS (gravados no pedido; fallback para os brutos) ---
+    items_normalized = items if items is not None else get_items_view(o)
+
+    # Gera uma string simples para resumo
+    try:
+        items_summary = ", ".join([f"{i.get('quantity', 1)}x {i.get('name', 'Item')}" for i in items_normalized])
+    except:
+        items_summary = "Erro ao listar itens"
+
+
+    return {
+        "id": o.id,
+        "wabiz_id": o.wabiz_id or str(o.id),
+        "name": final_name,
+        "customer_name": final_name,
+        "phone": o.customer_phone,
+        "customer_phone": o.customer_phone,
+        "total": float(o.total_value or 0.0),
+        "discount": float(o.discount or 0.0),
+        "delivery_fee": final_delivery_fee,
+        "service_fee": float(o.service_fee or 0.0),
+        "status": o.status,
+        "payment": o.payment_method,
+        "time": formatted_time,
+        "minutes_elapsed": minutes_elapsed,
+        "items": items_normalized,
+        "items_desc": items_summary,
+
+        # --- CAMPOS ADICIONADOS PARA CORRIGIR O BUG ---
+        "address_street": o.address_street,
+        "address_number": o.address_number,
+        # ----------------------------------------------
+
+        "address": f"{o.address_street}, {o.address_number} - {neighborhood}" if o.address_street else "Retirada",
+        "neighborhood": neighborhood,
+        "table": o.table_number,
+        "delivery_type": dtype,
+        "driver_name": driver_name,
+        "driver_id": o.driver_id,
+        "driver_tip": float(o.driver_tip or 0.0),
+        "customer_credit": float(o.customer_credit or 0.0),
+        "platform": plat_code,
+
+        "obs": o.notes or "",
+
+    }
+
+
+def normalize_neigh_py(text):
+    if not text: return "OUTROS"
+    text = unicodedata.normalize('NFKD', str(text)).encode('ASCII', 'ignore').decode('ASCII')
+    return "".join([c for c in text if c.isalnum() or c.isspace()]).strip().upper()
+
+
+DELIVERED_PAGE_SIZE = 20
+LIST_PAGE_SIZE = 50  # Histórico das abas em lista (balcão/mesas), fora os ativos
+
+
+def build_kanban(data):
+    """Distribui os cards nas colunas do Kanban (PRONTO agrupado por bairro)."""
+    kanban_data = { "PREPARO": [], "PRONTO": [], "SAIU_ENTREGA": [], "ENTREGUE": [] }
+    pronto_groups = {}
+
+    for item in data:
+        raw_st = (item['status'] or '').upper()
+        st = 'PREPARO' if raw_st == 'PENDENTE' else raw_st
+        if raw_st in ['FORNO', 'EXPEDICAO', 'PRONTO_COZINHA']:
+            st = 'PREPARO'
+            item['css_class'] = 'card-oven'
+
+        if st == 'PREPARO':
+            kanban_data['PREPARO'].append(item)
+        elif st == 'SAIU_ENTREGA':
+            kanban_data['SAIU_ENTREGA'].append(item)
+        elif st == 'ENTREGUE':
+            kanban_data['ENTREGUE'].append(item)
+        elif st == 'PRONTO':
+            neigh_raw = item.get('neighborhood') or 'Outros'
+            neigh_key = normalize_neigh_py(neigh_raw)
+            if neigh_key not in pronto_groups:
+                pronto_groups[neigh_key] = {"name": neigh_raw.upper().strip(), "orders": [], "total_value": 0.0}
+            pronto_groups[neigh_key]['orders'].append(item)
+            pronto_groups[neigh_key]['total_value'] += item['total']
+        elif st in kanban_data:
+            kanban_data[st].append(item)
+
+    kanban_data['PRONTO'] = sorted(list(pronto_groups.values()), key=lambda x: len(x['orders']), reverse=True)
+    # ENTREGUE: só a primeira página (os mais recentes); o resto vem por /admin/api/orders/delivered
+    if len(kanban_data['ENTREGUE']) > DELIVERED_PAGE_SIZE:
+         kanban_data['ENTREGUE'] = kanban_data['ENTREGUE'][:DELIVERED_PAGE_SIZE]
+    return kanban_data
+
+
+# --- DELTAS ---
+
+def order_delta_messages(orders, kind: str):
+    """
+    Monta as mensagens (uma por pedido) AINDA com a sessão aberta.
+    Deve ser chamada depois do commit e antes de devolver a resposta.
+    """
+    messages = []
+    for o in orders:
+        if o is None: continue
+        payload = {"type": kind, "seq": next_store_seq(o.store_id), "order_id": o.id}
+        if kind != "order_deleted":
+            # Estágio real dos itens (order_item_stages), igual ao /admin/api/orders/list
+            session = object_session(o)
+            stages = load_item_stages(session, [o.id]).get(o.id) if session else None
+            payload["order"] = build_order_card(o, items=apply_item_stages(get_items_view(o), stages, normalized=True))
+        messages.append((o.store_id, json.dumps(payload, default=str)))
+    return messages
+
+
+async def broadcast_deltas(messages):
+    for store_id, message in messages:
+        await manager.broadcast(store_id, message)
+
+
+def publish_deltas(messages) -> bool:
+    """Versão síncrona (robô / outbox). Retorna False se algum não foi publicado."""
+    ok = True
+    for store_id, message in messages:
+        ok = publish_store_event(store_id, message) and ok
+    return ok
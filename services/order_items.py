@@ -0,0 +1,201 @@
+# Arquivo: pizzaria/services/order_items.py
+import time
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from database import SessionLocal
+from models import Order, Store, OrderItem, OrderItemsState
+from services.catalog import get_catalog
+from services.sales_rollup import item_sale
+
+# ==========================================
+#     ITENS VENDIDOS (TABELA order_items)
+# ==========================================
+# Top produtos, combos, produto favorito do cliente, previsão e consumo de estoque
+# percorriam o items_json de cada pedido em Python e limpavam o nome com split('(').
+# Agora cada item vira uma linha em order_items, já com:
+#   - título como veio (title) e nome limpo (name), quantidade e preço unitário
+#     (mesmas regras do get_top_products: services/sales_rollup.item_sale)
+#   - product_id resolvido pelo catálogo (ID interno > código externo > nome)
+#   - tamanho da pizza e os filhos (sabores do meio-a-meio, adicionais, sub-produtos
+#     de combo) apontando para o item pai (parent_index)
+# e os relatórios fazem GROUP BY com índice.
+#
+# Manutenção: toda gravação de pedido via ORM que mexe em itens/status/data (hooks em
+# models.py) refaz as linhas do pedido depois do commit, em segundo plano.
+# Pedidos antigos: python backfill_order_items.py [loja] (libera o uso nos relatórios).
+
+# Campos do pedido que mudam as linhas
+ORDER_ITEMS_SOURCE_FIELDS = ("items_json", "status", "created_at", "store_id")
+
+ORDER_ITEMS_BATCH = 500
+ORDER_ITEMS_READY_CACHE = 60
+
+_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-items")
+_pending = set()
+_pending_lock = threading.Lock()
+_ready = {}  # store_id -> (pronto, checado_em)
+
+
+def clean_name(raw) -> str:
+    """Nome sem o que vem entre parênteses ('Calabresa (G)' -> 'Calabresa')."""
+    return str(raw or "").split('(')[0].strip()
+
+
+def _sub_name(sub):
+    if isinstance(sub, dict):
+        return sub.get('title') or sub.get('name') or sub.get('item_name') or ""
+    return str(sub or "")
+
+
+def _resolve(catalog, data, name):
+    raw_id = str(data.get('product_id') or '').strip() if isinstance(data, dict) else ""
+    raw_code = str(data.get('external_code') or data.get('externalCode') or '').strip() if isinstance(data, dict) else ""
+    return catalog.resolve_product(
+        int(raw_id) if raw_id.isdigit() and int(raw_id) > 0 else None,
+        raw_code if raw_code.lower() != 'none' else "",
+        clean_name(name),
+    )
+
+
+def _pizza_size(catalog, title, parts):
+    """Mesma ordem do motor de estoque: título, depois sabores, por fim o maior tamanho."""
+    size = catalog.detect_size(title)
+    for part in parts if not size else []:
+        size = catalog.detect_size(_sub_name(part))
+        if size: break
+    return size or catalog.default_size()
+
+
+def extract_order_items(catalog, order_id, store_id, created_at, is_cancelled, items_json) -> list:
+    """Linhas (dicts) do order_items para um pedido."""
+    rows = []
+    if not isinstance(items_json, list): return rows
+
+    def add(kind, parent_index, data, title, qty, unit_price, size=None):
+        product = _resolve(catalog, data, title)
+        rows.append({
+            "store_id": store_id, "order_id": order_id, "created_at": created_at, "is_cancelled": is_cancelled,
+            "item_index": len(rows), "parent_index": parent_index, "kind": kind,
+            "product_id": product.id if product else None,
+            "title": str(title), "name": clean_name(title), "qty": qty, "unit_price": unit_price, "size": size,
+        })
+        return len(rows) - 1
+
+    for item in items_json:
+        if not isinstance(item, dict): continue
+        title, qty, revenue = item_sale(item)
+        unit_price = revenue / qty if qty else 0.0
+        parts = item.get('parts') or []
+        product = _resolve(catalog, item, title)
+        size = None
+        if product and product.is_pizza:
+            size_obj = _pizza_size(catalog, str(title), parts)
+            size = size_obj.name if size_obj else None
+
+        parent = add("item", None, item, title, qty, unit_price, size)
+
+        # Sabores do meio-a-meio: cada um com a sua fração da quantidade
+        for part in parts:
+            name = _sub_name(part)
+            if name: add("part", parent, part, name, qty / len(parts), 0.0, size)
+        for addon in item.get('addons') or []:
+            name = _sub_name(addon)
+            if name: add("addon", parent, addon, name, qty, 0.0, size)
+        # Sub-produtos agrupados (combos Wabiz)
+        for sub in item.get('products') or []:
+            if not isinstance(sub, dict): continue
+            sub_title, sub_qty, sub_revenue = item_sale(sub)
+            add("sub", parent, sub, sub_title, sub_qty, sub_revenue / sub_qty if sub_qty else 0.0)
+    return rows
+
+
+def sync_order_items(db, order_ids):
+    """Refaz as linhas dos pedidos (apaga e insere). Não faz commit."""
+    order_ids = [i for i in order_ids if i]
+    if not order_ids: return 0
+    # Trava os pedidos: dois processos refazendo o mesmo pedido não duplicam linhas
+    orders = db.query(
+        Order.id, Order.store_id, Order.created_at, Order.status, Order.items_json
+    ).filter(Order.id.in_(order_ids)).with_for_update().all()
+
+    db.query(OrderItem).filter(OrderItem.order_id.in_(order_ids)).delete(synchronize_session=False)
+
+    rows = []
+    for o in orders:
+        if not o.store_id: continue
+        catalog = get_catalog(db, o.store_id)
+        is_cancelled = bool(o.status and "CANCELADO" in o.status.upper())
+        rows += extract_order_items(catalog, o.id, o.store_id, o.created_at, is_cancelled, o.items_json)
+    if rows: db.bulk_insert_mappings(OrderItem, rows)
+    return len(rows)
+
+
+# --- APLICAÇÃO INCREMENTAL (pós-commit) ---
+
+def schedule_order_items_sync(order_ids):
+    """Chamado pelo after_commit (models.py)."""
+    with _pending_lock:
+        new = set(order_ids) - _pending
+        _pending.update(new)
+    if new: _sync_executor.submit(_drain_pending)
+
+
+def _drain_pending():
+    with _pending_lock:
+        order_ids = set(_pending)
+        _pending.clear()
+    if not order_ids: return
+    db = SessionLocal()
+    try:
+        sync_order_items(db, sorted(order_ids))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [Itens] Erro ao gravar itens de {len(order_ids)} pedido(s): {e}")
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+# --- BACKFILL ---
+
+def backfill_order_items(store_id: int = None, log=print) -> int:
+    """Extrai os itens de todos os pedidos (da loja ou de todas) e libera o uso nos relatórios."""
+    db = SessionLocal()
+    total = 0
+    try:
+        store_ids = [store_id] if store_id else [row[0] for row in db.query(Store.id).all()]
+        for sid in store_ids:
+            last_id = 0
+            log(f"🧾 [Itens] Loja {sid}: extraindo itens dos pedidos...")
+            while True:
+                ids = [row[0] for row in db.query(Order.id).filter(
+                    Order.store_id == sid, Order.id > last_id
+                ).order_by(Order.id).limit(ORDER_ITEMS_BATCH).all()]
+                if not ids: break
+                sync_order_items(db, ids)
+                db.commit()
+                total += len(ids)
+                last_id = ids[-1]
+
+            state = db.query(OrderItemsState).get(sid)
+            if state: state.backfilled_at = datetime.utcnow()
+            else: db.add(OrderItemsState(store_id=sid, backfilled_at=datetime.utcnow()))
+            db.commit()
+            _ready.pop(sid, None)
+    finally:
+        db.close()
+    log(f"🏁 [Itens] {total} pedido(s) processado(s).")
+    return total
+
+
+def order_items_ready(db, store_id: int) -> bool:
+    cached = _ready.get(store_id)
+    if cached and time.time() - cached[1] < ORDER_ITEMS_READY_CACHE:
+        return cached[0]
+    ready = db.query(OrderItemsState.store_id).filter(OrderItemsState.store_id == store_id).first() is not None
+    _ready[store_id] = (ready, time.time())
+    return ready
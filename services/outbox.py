@@ -0,0 +1,251 @@
+# Arquivo: pizzaria/services/outbox.py
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import OutboxEvent, Order, Store, PendingPixelEvent
+from services.utils import recover_historical_ip, dispatch_smart_event
+from services.sockets import publish_store_event
+from services.order_events import order_delta_messages, publish_deltas
+
+# ==========================================
+#        OUTBOX DE EFEITOS COLATERAIS
+# ==========================================
+# O process_standard_order só grava o pedido + as linhas de outbox no mesmo commit.
+# Tudo que depende de HTTP externo (Pixel FB, confirmação iFood/Wabiz, aviso ao KDS,
+# GA4 pendente) roda aqui, em paralelo, com retry e chave de idempotência.
+#
+# Fluxo: enqueue_event() (sem commit) -> commit do pedido -> kick_outbox() -> drain_outbox()
+# O robô também chama drain_outbox() periodicamente para pegar o que falhou.
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_BATCH = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_LOCK_TIMEOUT = timedelta(minutes=5)  # PROCESSING travado há mais que isso = worker morreu
+
+_kick_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-kick")
+_drain_lock = threading.Lock()
+_rerun = threading.Event()  # Chegou evento novo enquanto uma drenagem rodava
+
+
+def enqueue_event(db: Session, store_id: int, event_type: str, key: str, payload: dict, order_id: int = None):
+    """Adiciona um evento na sessão. NÃO faz commit: vai junto com o commit do pedido."""
+    event = OutboxEvent(
+        store_id=store_id, order_id=order_id, event_type=event_type,
+        idempotency_key=f"{event_type}:{store_id}:{key}", payload=payload or {},
+        status="PENDING", attempts=0, next_attempt_at=datetime.utcnow()
+    )
+    db.add(event)
+    return event
+
+
+def kick_outbox():
+    """Dispara uma drenagem em segundo plano (não bloqueia quem chamou)."""
+    _kick_executor.submit(drain_outbox)
+
+
+# --- HANDLERS ---
+# Cada handler recebe (db, store, order, payload). Levantar exceção = nova tentativa.
+
+def _handle_pixel_fb(db, store, order, payload):
+    cust = payload.get("customer", {})
+    addr = payload.get("address", {})
+    ext_id = payload.get("external_id")
+
+    client_ip = recover_historical_ip(db, store.id, cust.get('phone'), cust.get('email'))
+
+    # Melhora o Match Quality separando Nome e Sobrenome
+    full_name = cust.get('name', '') or ""
+    first_name = full_name.split()[0] if full_name else ""
+    last_name = " ".join(full_name.split()[1:]) if full_name and len(full_name.split()) > 1 else ""
+
+    user_data_pixel = {
+        "email": cust.get('email'),
+        "phone": cust.get('phone'),
+        "first_name": first_name,
+        "last_name": last_name,
+        "city": addr.get('city', 'Itanhaem'),
+        "zip_code": addr.get('zip_code', '11740000'),
+        "state": addr.get('state', 'SP'),
+        "ip": client_ip,
+        "user_agent": "AlivHub/Server-Side",
+        "external_id": cust.get('email') or cust.get('phone') or str(ext_id),
+        "url": "https://app.wabiz.delivery/pedido_confirmado"
+    }
+
+    # ESTRATÉGIA HÍBRIDA: só Facebook via servidor (Google vai pelo GTM no navegador)
+    results = dispatch_smart_event(
+        store, "Venda Real (Server) - Correta", user_data_pixel,
+        payload.get("items", []), payload.get("total", 0), ext_id, targets=["fb"]
+    )
+    # Pixel configurado e o Facebook recusou/caiu: nova tentativa (o event_id deduplica lá)
+    if store.fb_pixel_id and store.fb_access_token and not results.get('fb'):
+        raise RuntimeError("Facebook CAPI não aceitou o evento")
+    if order:
+        order.sent_to_facebook = results.get('fb', False)
+        order.sent_to_google = results.get('ga', False)
+
+
+def _handle_confirm_origin(db, store, order, payload):
+    # Import tardio: background_jobs importa este módulo
+    from services.background_jobs import get_active_adapters
+    from services.integrations.ifood import IfoodAdapter
+    from services.integrations.wabiz import WabizAdapter, process_wabiz_update
+
+    integration = payload.get("integration")
+    if integration == "ifood":
+        print(f"🤖 [Outbox] Confirmando iFood #{payload.get('external_id')}...")
+        for adapter in get_active_adapters(store, only="ifood"):
+            if isinstance(adapter, IfoodAdapter) and not adapter.confirm_order(payload.get("external_id")):
+                raise RuntimeError("iFood não aceitou a confirmação")
+
+    elif integration == "wabiz" and order:
+        print(f"🤖 [Outbox] Confirmando Wabiz #{order.wabiz_id}...")
+        for adapter in get_active_adapters(store, only="wabiz"):
+            if isinstance(adapter, WabizAdapter):
+                process_wabiz_update(adapter, order, "CONFIRMADO")
+
+
+def _handle_kds_trigger(db, store, order, payload):
+    # Publica direto no barramento Redis: todos os workers da API recebem
+    # O delta já leva o card pronto (as telas não precisam recarregar tudo)
+    if order: publish_deltas(order_delta_messages([order], "order_created"))
+    if publish_store_event(store.id, "new_order"): return
+    # Sem Redis: volta para o gatilho HTTP antigo (alcança só um worker)
+    trigger_url = f"http://127.0.0.1:8000/api/internal/kds-trigger/{store.id}"
+    requests.post(trigger_url, timeout=5).raise_for_status()
+
+
+def _handle_ga4_pending(db, store, order, payload):
+    cust = payload.get("customer", {})
+    addr = payload.get("address", {})
+    ext_id = payload.get("external_id")
+    possible_ids = payload.get("possible_ids") or [str(ext_id)]
+
+    pending_pixel = db.query(PendingPixelEvent).filter(
+        PendingPixelEvent.store_id == store.id,
+        PendingPixelEvent.event_id.in_(possible_ids),
+        PendingPixelEvent.status == 'PENDING'
+    ).first()
+
+    if not pending_pixel:
+        print(f"💨 [Outbox] Nenhum pixel pendente encontrado para {possible_ids}.")
+        return
+
+    print(f"🔗 [Outbox] MATCH! Pixel encontrado para o pedido #{pending_pixel.event_id}. Disparando GA4...")
+    web_data = pending_pixel.payload_json or {}
+    u_data = web_data.get('user_data', {})
+
+    user_data_ga = {
+        "client_ip": u_data.get('ip'),
+        "client_user_agent": web_data.get('user_agent'),
+        "fbp": u_data.get('fbp'),
+        "fbc": u_data.get('fbc'),
+        "gclid": u_data.get('gclid'),
+        "session_id": u_data.get('session_id'),
+        "email": cust.get('email'),
+        "phone": cust.get('phone'),
+        "city": addr.get('city'),
+        "state": addr.get('state'),
+        "external_id": ext_id
+    }
+    dispatch_smart_event(store, "Purchase", user_data_ga, payload.get("items", []), payload.get("total", 0), ext_id, targets=["ga"])
+    pending_pixel.status = "PROCESSED"
+
+
+OUTBOX_HANDLERS = {
+    "pixel_fb": _handle_pixel_fb,
+    "confirm_origin": _handle_confirm_origin,
+    "kds_trigger": _handle_kds_trigger,
+    "ga4_pending": _handle_ga4_pending,
+}
+
+
+# --- WORKER ---
+
+def _claim_batch():
+    """Reserva um lote de eventos com FOR UPDATE SKIP LOCKED (vários workers não pegam o mesmo)."""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        events = db.query(OutboxEvent).filter(
+            ((OutboxEvent.status == "PENDING") & (OutboxEvent.next_attempt_at <= now)) |
+            ((OutboxEvent.status == "PROCESSING") & (OutboxEvent.locked_at < now - OUTBOX_LOCK_TIMEOUT))
+        ).order_by(OutboxEvent.id).limit(OUTBOX_BATCH).with_for_update(skip_locked=True).all()
+
+        ids = []
+        for ev in events:
+            ev.status = "PROCESSING"
+            ev.locked_at = now
+            ids.append(ev.id)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def _run_event(event_id: int):
+    db = SessionLocal()
+    try:
+        event = db.query(OutboxEvent).get(event_id)
+        if not event or event.status != "PROCESSING": return
+
+        handler = OUTBOX_HANDLERS.get(event.event_type)
+        try:
+            if not handler: raise ValueError(f"Tipo de evento desconhecido: {event.event_type}")
+            store = db.query(Store).get(event.store_id)
+            order = db.query(Order).get(event.order_id) if event.order_id else None
+            handler(db, store, order, event.payload or {})
+
+            event.status = "DONE"
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            event = db.query(OutboxEvent).get(event_id)
+            event.attempts = (event.attempts or 0) + 1
+            event.last_error = str(e)[:1000]
+            if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                event.status = "FAILED"
+                print(f"❌ [Outbox] {event.idempotency_key} desistiu após {event.attempts} tentativas: {e}")
+            else:
+                # Backoff exponencial: 10s, 20s, 40s... (máx 30 min)
+                wait = min(1800, 10 * (2 ** (event.attempts - 1)))
+                event.status = "PENDING"
+                event.next_attempt_at = datetime.utcnow() + timedelta(seconds=wait)
+                print(f"⚠️ [Outbox] {event.idempotency_key} falhou ({e}). Nova tentativa em {wait}s.")
+            db.commit()
+    except Exception as e:
+        print(f"🔥 [Outbox] Erro crítico no evento {event_id}: {e}")
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+def drain_outbox():
+    """Processa os eventos pendentes em paralelo. Retorna quantos foram executados."""
+    # Uma drenagem por vez por processo. Se já tem uma rodando, ela dá mais uma volta no final.
+    if not _drain_lock.acquire(blocking=False):
+        _rerun.set()
+        return 0
+    try:
+        total = 0
+        with ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox") as pool:
+            while True:
+                _rerun.clear()
+                ids = _claim_batch()
+                if ids:
+                    # Eventos do mesmo lote rodam em paralelo
+                    list(pool.map(_run_event, ids))
+                    total += len(ids)
+                if len(ids) < OUTBOX_BATCH and not _rerun.is_set(): break
+        return total
+    finally:
+        _drain_lock.release()
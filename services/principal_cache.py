@@ -0,0 +1,128 @@
+# Arquivo: pizzaria/services/principal_cache.py
+import hmac
+import time
+import hashlib
+import threading
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import User
+from auth import verify_password, SECRET_KEY
+from services.cache import get_redis, mark_redis_down
+
+# ==========================================
+#   CACHE DE AUTENTICAÇÃO (USUÁRIO LOGADO)
+# ==========================================
+# check_db_auth/check_role rodavam bcrypt.checkpw (~250ms de CPU) e uma consulta
+# no users a CADA requisição HTTP Basic. Com as telas do admin fazendo polling,
+# cada aba aberta prendia um núcleo do worker. Os logins por cookie (motoboy,
+# garçom, apps) também buscavam o usuário por email a cada chamada.
+#
+# Dois caches em memória (por processo), com expiração curta:
+#   1. Credencial já verificada: HMAC(SECRET_KEY, usuário:senha) -> email.
+#      A senha nunca é guardada; a credencial só vale enquanto o hash do banco for o mesmo.
+#   2. Usuário por email: só as colunas de identidade (id, email, papel, loja, nome).
+#      O objeto entregue à rota é anexado à sessão dela sem consulta (merge load=False);
+#      qualquer outra coluna (saldo do motoboy etc.) é lida do banco quando acessada.
+#
+# Salvar/excluir usuário chama invalidate_principals(): a versão no Redis faz todos
+# os workers descartarem o cache. Sem Redis, vale a expiração local (curta).
+# Tentativas com senha errada NÃO entram no cache (continuam pagando o bcrypt).
+
+PRINCIPAL_TTL = 300        # Com Redis (invalidação chega em todos os workers)
+PRINCIPAL_TTL_LOCAL = 30   # Sem Redis: outros workers não ficam sabendo, expira rápido
+PRINCIPAL_MAX_ENTRIES = 5000
+
+_VERSION_KEY = "auth:version"
+_IDENTITY_COLUMNS = ("id", "email", "role", "store_id", "full_name")
+
+_users = {}         # email -> (campos, hashed_password, versão, expira_em)
+_credentials = {}   # hmac -> (email, hashed_password, versão, expira_em)
+_local_version = 0
+_lock = threading.Lock()
+
+
+def _current_version():
+    r = get_redis()
+    if r is not None:
+        try:
+            return int(r.get(_VERSION_KEY) or 0), PRINCIPAL_TTL
+        except Exception as e:
+            mark_redis_down(e)
+    return ("local", _local_version), PRINCIPAL_TTL_LOCAL
+
+
+def _credential_key(username, password) -> str:
+    raw = f"{username}:{password}".encode("utf-8")
+    return hmac.new(SECRET_KEY.encode("utf-8"), raw, hashlib.sha256).hexdigest()
+
+
+def _store(cache, key, value):
+    with _lock:
+        if len(cache) >= PRINCIPAL_MAX_ENTRIES: cache.clear()
+        cache[key] = value
+
+
+def _attach(db, fields):
+    """Entrega um User da sessão da rota, montado do cache (sem SELECT)."""
+    user = User(**fields)
+    make_transient_to_detached(user)  # Colunas não preenchidas ficam "expiradas" (lazy)
+    return db.merge(user, load=False)
+
+
+def get_user_by_email(db, email):
+    """User do email (do cache quando possível) ou None."""
+    if not email: return None
+    version, ttl = _current_version()
+    now = time.time()
+    entry = _users.get(email)
+    if entry and entry[2] == version and entry[3] > now:
+        return _attach(db, entry[0])
+
+    user = db.query(User).filter(User.email == email).first()
+    if not user: return None
+    fields = {col: getattr(user, col) for col in _IDENTITY_COLUMNS}
+    _store(_users, email, (fields, user.hashed_password, version, now + ttl))
+    return user
+
+
+def password_hash_of(user):
+    """Hash da senha do usuário (do cache, sem tocar nas colunas expiradas do objeto)."""
+    entry = _users.get(user.email)
+    return entry[1] if entry else user.hashed_password
+
+
+def authenticate_basic(db, username, password):
+    """Usuário/senha do HTTP Basic. Retorna o User ou None. O bcrypt só roda na 1ª vez (por TTL)."""
+    if not username or password is None: return None
+    version, ttl = _current_version()
+    now = time.time()
+    key = _credential_key(username, password)
+
+    user = get_user_by_email(db, username)
+    if not user: return None
+    current_hash = password_hash_of(user)
+
+    cached = _credentials.get(key)
+    if cached and cached[0] == username and cached[1] == current_hash and cached[2] == version and cached[3] > now:
+        return user
+
+    if not current_hash or not verify_password(password, current_hash):
+        return None
+    _store(_credentials, key, (username, current_hash, version, now + ttl))
+    return user
+
+
+def invalidate_principals():
+    """Chamar DEPOIS do commit de qualquer alteração em usuário (senha, papel, loja, exclusão)."""
+    global _local_version
+    with _lock:
+        _local_version += 1
+        _users.clear()
+        _credentials.clear()
+
+    r = get_redis()
+    if r is not None:
+        try:
+            r.incr(_VERSION_KEY)
+        except Exception as e:
+            mark_redis_down(e)
@@ -0,0 +1,324 @@
+# Arquivo: pizzaria/services/sales_rollup.py
+import time
+import threading
+import traceback
+from datetime import datetime, date, timedelta
+from datetime import time as dtime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytz
+from sqlalchemy import not_, text
+
+from database import SessionLocal
+from models import Order, Store, SalesRollupHourly, ProductRollupDaily, SalesRollupState
+from services.store_version import bump_store_versions
+
+# ==========================================
+#      RESUMOS DE VENDAS (DIA x HORA)
+# ==========================================
+# Dashboard (KPIs, mapa de calor, top produtos), relatório matinal e previsão de
+# estoque varriam os pedidos do período inteiro (30 dias = milhares de items_json).
+# Agora existem dois resumos por loja, no horário de Brasília:
+#   sales_rollup_hourly  -> (dia, hora, forma de pagamento): pedidos e faturamento
+#   product_rollup_daily -> (dia, forma de pagamento, produto): quantidade e faturamento
+# Cancelados ficam de fora e a forma de pagamento é o texto cru do pedido, então o
+# filtro do dashboard (ILIKE) aplicado no resumo dá o mesmo resultado.
+#
+# Manutenção: toda gravação de pedido via ORM marca o dia afetado (hooks em models.py)
+# e, depois do commit, o dia inteiro da loja é recalculado a partir dos pedidos
+# (idempotente: edição, cancelamento e troca de data se corrigem sozinhos).
+# O robô refaz hoje/ontem periodicamente (rede de segurança para UPDATE em massa).
+#
+# Só usamos o resumo quando a loja já passou pelo backfill (sales_rollup_state) e o
+# período cai em hora cheia (dia cheio, para produtos). Fora disso, lê os pedidos.
+# Backfill: python backfill_rollups.py [loja]  (ou rota /admin/maintenance/backfill-rollups)
+
+TZ_BR = pytz.timezone("America/Sao_Paulo")
+
+# Campos do pedido que mudam os resumos
+ROLLUP_SOURCE_FIELDS = ("store_id", "created_at", "status", "total_value", "payment_method", "items_json")
+
+ROLLUP_READY_CACHE = 60  # Segundos que a resposta "loja já tem backfill?" fica em memória
+
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sales-rollup")
+_pending = set()
+_pending_lock = threading.Lock()
+_ready = {}  # store_id -> (pronto, checado_em)
+
+
+# --- DATAS ---
+
+def local_day_of(created_at) -> date:
+    """Dia em Brasília de um created_at do banco (UTC sem fuso)."""
+    return pytz.utc.localize(created_at).astimezone(TZ_BR).date()
+
+
+def day_bounds_utc(day: date):
+    """[início, fim) do dia de Brasília em UTC sem fuso (como o banco grava)."""
+    start = TZ_BR.localize(datetime.combine(day, dtime.min))
+    end = TZ_BR.localize(datetime.combine(day + timedelta(days=1), dtime.min))
+    return start.astimezone(pytz.utc).replace(tzinfo=None), end.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _local_key(dt_utc):
+    local = pytz.utc.localize(dt_utc).astimezone(TZ_BR)
+    return (local.date(), local.hour)
+
+
+def _hour_range(start_utc, end_utc):
+    """
+    Converte o filtro [start, end] (UTC, como o _apply_filters) em (dia, hora) locais
+    [início, fim). None se algum lado não cair em hora cheia (aí o resumo não serve).
+    """
+    if start_utc is None or end_utc is None: return None
+    if isinstance(start_utc, int) or isinstance(end_utc, int): return None
+    if start_utc.tzinfo is not None: start_utc = start_utc.astimezone(pytz.utc).replace(tzinfo=None)
+    if end_utc.tzinfo is not None: end_utc = end_utc.astimezone(pytz.utc).replace(tzinfo=None)
+
+    if (start_utc.minute, start_utc.second, start_utc.microsecond) != (0, 0, 0): return None
+    if (end_utc.minute, end_utc.second) == (59, 59):
+        end_excl = end_utc.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    elif (end_utc.minute, end_utc.second, end_utc.microsecond) == (0, 0, 0):
+        end_excl = end_utc
+    else:
+        return None
+    if end_excl <= start_utc: return None
+    return _local_key(start_utc), _local_key(end_excl)
+
+
+def _day_range(start_utc, end_utc):
+    """Mesmo que _hour_range, mas exige dia cheio. Retorna (primeiro dia, dia depois do último)."""
+    bounds = _hour_range(start_utc, end_utc)
+    if not bounds: return None
+    (start_day, start_hour), (end_day, end_hour) = bounds
+    if start_hour != 0 or end_hour != 0: return None
+    return start_day, end_day
+
+
+# --- CONTA DE UM ITEM (mesma regra do get_top_products) ---
+
+def item_sale(item):
+    """(nome, quantidade, faturamento) de um item do items_json."""
+    name = item.get('title') or item.get('item_name') or item.get('name') or "Produto s/ Nome"
+    try:
+        qty = float(item.get('quantity', 1))
+        price = float(item.get('price', 0))
+    except (ValueError, TypeError):
+        qty = 1
+        price = 0.0
+    return name, qty, qty * price
+
+
+def _valid_orders(query):
+    # Mesma exclusão do PizzaBrain._apply_filters (status NULL também fica de fora)
+    return query.filter(not_(Order.status.ilike("%CANCELADO%")))
+
+
+# --- RECÁLCULO DE UM DIA ---
+
+def rebuild_day(db, store_id: int, day: date):
+    """Refaz as linhas de um dia da loja a partir dos pedidos. Não faz commit."""
+    # Dois processos recalculando o mesmo dia: o segundo espera e lê o estado final
+    db.execute(text("SELECT pg_advisory_xact_lock(:k1, :k2)"), {"k1": store_id, "k2": day.toordinal()})
+
+    start_utc, end_utc = day_bounds_utc(day)
+    orders = _valid_orders(db.query(
+        Order.created_at, Order.total_value, Order.payment_method, Order.items_json
+    )).filter(
+        Order.store_id == store_id,
+        Order.created_at >= start_utc,
+        Order.created_at < end_utc,
+    ).all()
+
+    hours = {}     # (hora, pagamento) -> [pedidos, faturamento]
+    products = {}  # (pagamento, produto) -> [qtd, faturamento]
+    for created_at, total_value, payment_method, items_json in orders:
+        payment = payment_method or ""
+        bucket = hours.setdefault((_local_key(created_at)[1], payment), [0, 0.0])
+        bucket[0] += 1
+        bucket[1] += total_value or 0
+
+        for item in items_json if isinstance(items_json, list) else []:
+            if not isinstance(item, dict): continue
+            name, qty, revenue = item_sale(item)
+            row = products.setdefault((payment, str(name)), [0.0, 0.0])
+            row[0] += qty
+            row[1] += revenue
+
+    db.query(SalesRollupHourly).filter(
+        SalesRollupHourly.store_id == store_id, SalesRollupHourly.local_date == day
+    ).delete(synchronize_session=False)
+    db.query(ProductRollupDaily).filter(
+        ProductRollupDaily.store_id == store_id, ProductRollupDaily.local_date == day
+    ).delete(synchronize_session=False)
+
+    if hours:
+        db.bulk_insert_mappings(SalesRollupHourly, [
+            {"store_id": store_id, "local_date": day, "hour": hour, "payment_method": payment,
+             "orders_count": count, "revenue": revenue}
+            for (hour, payment), (count, revenue) in hours.items()
+        ])
+    if products:
+        db.bulk_insert_mappings(ProductRollupDaily, [
+            {"store_id": store_id, "local_date": day, "payment_method": payment, "product_name": name,
+             "qty": qty, "revenue": revenue}
+            for (payment, name), (qty, revenue) in products.items()
+        ])
+
+
+def refresh_days(days):
+    """Recalcula (loja, dia) em uma sessão própria. Cada dia no seu commit."""
+    db = SessionLocal()
+    try:
+        for store_id, day in sorted(days):
+            try:
+                rebuild_day(db, store_id, day)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ [Resumos] Erro ao recalcular loja {store_id} dia {day}: {e}")
+    finally:
+        db.close()
+    # Caches que dependem dos resumos (mapa de calor) usam a versão da loja na chave
+    bump_store_versions({store_id for store_id, _ in days})
+
+
+# --- APLICAÇÃO INCREMENTAL (pós-commit) ---
+
+def schedule_rollup_refresh(days):
+    """Chamado pelo after_commit (models.py). Dias repetidos enquanto a fila anda viram um só."""
+    with _pending_lock:
+        new = set(days) - _pending
+        _pending.update(new)
+    if new: _refresh_executor.submit(_drain_pending)
+
+
+def _drain_pending():
+    with _pending_lock:
+        days = set(_pending)
+        _pending.clear()
+    if not days: return
+    try:
+        refresh_days(days)
+    except Exception as e:
+        print(f"⚠️ [Resumos] Erro na fila de recálculo: {e}")
+        traceback.print_exc()
+
+
+def refresh_recent_rollups(days_back: int = 1):
+    """Job do robô: refaz hoje e os últimos `days_back` dias das lojas com backfill."""
+    db = SessionLocal()
+    try:
+        store_ids = [row[0] for row in db.query(SalesRollupState.store_id).all()]
+    finally:
+        db.close()
+    today = datetime.now(TZ_BR).date()
+    refresh_days({(store_id, today - timedelta(days=i)) for store_id in store_ids for i in range(days_back + 1)})
+
+
+# --- BACKFILL ---
+
+def backfill_rollups(store_id: int = None, log=print) -> int:
+    """Refaz todo o histórico (da loja ou de todas) e libera o uso dos resumos. Retorna dias refeitos."""
+    db = SessionLocal()
+    total = 0
+    try:
+        store_ids = [store_id] if store_id else [row[0] for row in db.query(Store.id).all()]
+        for sid in store_ids:
+            first = db.query(Order.created_at).filter(
+                Order.store_id == sid, Order.created_at != None
+            ).order_by(Order.created_at).limit(1).scalar()
+            if first is None:
+                log(f"📊 [Resumos] Loja {sid}: sem pedidos.")
+            else:
+                day, today = local_day_of(first), datetime.now(TZ_BR).date()
+                log(f"📊 [Resumos] Loja {sid}: refazendo de {day} até {today}...")
+                while day <= today:
+                    rebuild_day(db, sid, day)
+                    db.commit()
+                    day += timedelta(days=1)
+                    total += 1
+
+            state = db.query(SalesRollupState).get(sid)
+            if state: state.backfilled_at = datetime.utcnow()
+            else: db.add(SalesRollupState(store_id=sid, backfilled_at=datetime.utcnow()))
+            db.commit()
+            _ready.pop(sid, None)
+    finally:
+        db.close()
+    log(f"🏁 [Resumos] {total} dia(s) refeito(s).")
+    return total
+
+
+def rollup_ready(db, store_id: int) -> bool:
+    cached = _ready.get(store_id)
+    if cached and time.time() - cached[1] < ROLLUP_READY_CACHE:
+        return cached[0]
+    ready = db.query(SalesRollupState.store_id).filter(SalesRollupState.store_id == store_id).first() is not None
+    _ready[store_id] = (ready, time.time())
+    return ready
+
+
+# --- LEITURA (None = o resumo não atende, use os pedidos) ---
+
+def _hour_rows(db, store_id, bounds, payment_method=None):
+    (start_day, _), (end_day, _) = bounds
+    query = db.query(
+        SalesRollupHourly.local_date, SalesRollupHourly.hour,
+        SalesRollupHourly.orders_count, SalesRollupHourly.revenue,
+    ).filter(
+        SalesRollupHourly.store_id == store_id,
+        SalesRollupHourly.local_date >= start_day,
+        SalesRollupHourly.local_date <= end_day,
+    )
+    if payment_method and payment_method != "Todos":
+        query = query.filter(SalesRollupHourly.payment_method.ilike(f"%{payment_method}%"))
+    start_key, end_key = bounds
+    return [r for r in query.all() if start_key <= (r[0], r[1]) < end_key]
+
+
+def sales_totals(db, store_id: int, start_utc, end_utc, payment_method=None):
+    """(pedidos, faturamento) do período."""
+    bounds = _hour_range(start_utc, end_utc)
+    if not bounds or not rollup_ready(db, store_id): return None
+    count, revenue = 0, 0.0
+    for _, _, orders_count, row_revenue in _hour_rows(db, store_id, bounds, payment_method):
+        count += orders_count or 0
+        revenue += row_revenue or 0
+    return count, revenue
+
+
+def sales_heatmap(db, store_id: int, start_utc, end_utc):
+    """Matriz 7 (seg..dom) x 24 com a quantidade de pedidos."""
+    bounds = _hour_range(start_utc, end_utc)
+    if not bounds or not rollup_ready(db, store_id): return None
+    heatmap = [[0 for _ in range(24)] for _ in range(7)]
+    for local_date, hour, orders_count, _ in _hour_rows(db, store_id, bounds):
+        heatmap[local_date.weekday()][hour] += orders_count or 0
+    return heatmap
+
+
+def product_totals(db, store_id: int, start_day: date, end_day: date, payment_method=None):
+    """{produto: {"qty", "revenue"}} dos dias locais [start_day, end_day)."""
+    query = db.query(
+        ProductRollupDaily.product_name, ProductRollupDaily.qty, ProductRollupDaily.revenue
+    ).filter(
+        ProductRollupDaily.store_id == store_id,
+        ProductRollupDaily.local_date >= start_day,
+        ProductRollupDaily.local_date < end_day,
+    )
+    if payment_method and payment_method != "Todos":
+        query = query.filter(ProductRollupDaily.payment_method.ilike(f"%{payment_method}%"))
+    totals = {}
+    for name, qty, revenue in query.all():
+        row = totals.setdefault(name, {"qty": 0.0, "revenue": 0.0})
+        row["qty"] += qty or 0
+        row["revenue"] += revenue or 0
+    return totals
+
+
+def top_products(db, store_id: int, start_utc, end_utc, payment_method=None):
+    """Mesmo formato do get_top_products (mapa nome -> qty/revenue), ou None."""
+    days = _day_range(start_utc, end_utc)
+    if not days or not rollup_ready(db, store_id): return None
+    return product_totals(db, store_id, days[0], days[1], payment_method)
@@ -0,0 +1,222 @@
+# Arquivo: pizzaria/services/sector_routing.py
+import re
+import copy
+from collections import deque
+from sqlalchemy import not_, or_
+from sqlalchemy.orm.attributes import flag_modified
+
+from models import Order
+from services.catalog import get_catalog
+
+# ==========================================
+#   ROTEAMENTO DE ITENS POR SETOR (KDS)
+# ==========================================
+# A tela da cozinha filtrada por setor remontava os mapas categoria->setor e
+# produto->categoria (2 consultas) a cada polling e, para cada item sem nome exato,
+# varria TODOS os produtos procurando substring (itens x catálogo).
+#
+# Agora o classificador é montado uma vez por snapshot do catálogo (services/catalog.py)
+# e morre junto com ele: qualquer edição de menu/setor invalida o snapshot.
+# Ordem de resolução de um item:
+#   1. product_id interno  2. código externo (ProductMapping)  3. nome exato
+#   4. nome aproximado: Aho-Corasick (nome do produto DENTRO do item, o mais longo
+#      ganha) e índice de trigramas (item DENTRO do nome do produto, o mais curto ganha)
+# O resultado por nome fica memorizado, então cada item custa um acesso a dicionário.
+#
+# Na entrada do pedido (hub e PDV) o setor já é gravado em cada item do items_json
+# (stamp_item_sectors), então o KDS só compara item["sector_id"]. O classificador
+# fica de reserva para pedidos antigos (ou rode backfill_item_sectors).
+
+DEFAULT_SECTOR_ID = 1  # Setor padrão: recebe o que não tem setor definido
+
+# Itens que não casam com nenhum produto e parecem bebida não vão para nenhuma tela
+BEVERAGE_KEYWORDS = ("refri", "cerveja", "coca", "guarana", "fanta", "pepsi", "suco", "agua", "h2oh", "lata", "2l", "600ml", "vinho")
+
+_NAME_MEMO_MAX = 5000
+
+
+def clean_item_name(raw_title) -> str:
+    """Mesma limpeza que o KDS sempre usou: minúsculo, sem 'combo:', sem 'Nx ' e sem o que vem depois de ':'."""
+    clean = str(raw_title or "").lower().replace("combo:", "").split(":")[0].strip()
+    return re.sub(r"^\d+x\s+", "", clean).strip()
+
+
+class _AhoCorasick:
+    """Autômato simples: acha todos os padrões contidos num texto em uma passada."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pattern)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_all(self, text):
+        node = 0
+        found = []
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.out[node]: found.extend(self.out[node])
+        return found
+
+
+class SectorClassifier:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.by_name = {}      # nome limpo do produto -> category_id (último vence, como o mapa antigo)
+        self._memo = {}        # nome limpo do item -> setor (ou None)
+        self._trigrams = {}    # trigrama -> {nomes de produto}
+
+        for p in sorted(catalog.products_by_id.values(), key=lambda x: x.id):
+            name = (p.name or "").lower().strip()
+            if name: self.by_name[name] = p.category_id
+
+        self._matcher = _AhoCorasick(self.by_name.keys())
+        for name in self.by_name:
+            for i in range(len(name) - 2):
+                self._trigrams.setdefault(name[i:i + 3], set()).add(name)
+
+    # --- RESOLUÇÃO ---
+    def _sector_of_category(self, category_id):
+        return self.catalog.category_sectors.get(category_id) or DEFAULT_SECTOR_ID
+
+    def _category_by_name(self, clean):
+        category_id = self.by_name.get(clean)
+        if category_id: return category_id
+
+        # Nome do produto contido no item ("pizza calabresa grande" -> "calabresa")
+        contained = self._matcher.find_all(clean)
+        if contained:
+            return self.by_name[max(contained, key=len)]
+
+        # Item contido no nome do produto ("calab" -> "calabresa")
+        if len(clean) >= 3:
+            candidates = None
+            for i in range(len(clean) - 2):
+                names = self._trigrams.get(clean[i:i + 3])
+                if not names: return None
+                candidates = set(names) if candidates is None else candidates & names
+                if not candidates: return None
+            matches = [n for n in candidates if clean in n]
+        else:
+            matches = [n for n in self.by_name if clean in n]
+        if matches:
+            return self.by_name[min(matches, key=lambda n: (len(n), n))]
+        return None
+
+    def _sector_by_name(self, raw_title):
+        clean = clean_item_name(raw_title)
+        if clean in self._memo: return self._memo[clean]
+
+        category_id = self._category_by_name(clean) if clean else None
+        if category_id:
+            sector = self._sector_of_category(category_id)
+        elif any(k in str(raw_title or "").lower() for k in BEVERAGE_KEYWORDS):
+            sector = None
+        else:
+            sector = DEFAULT_SECTOR_ID
+
+        if len(self._memo) >= _NAME_MEMO_MAX: self._memo.clear()
+        self._memo[clean] = sector
+        return sector
+
+    def sector_for(self, item):
+        """
+        Setor de produção do item (dict do items_json ou do items_view).
+        None = não vai para nenhuma tela de setor (bebida sem cadastro).
+        """
+        if "sector_id" in item: return item["sector_id"]  # Gravado na entrada do pedido
+        return self.classify(item)
+
+    def classify(self, item):
+        """Resolve o setor ignorando o que já estiver gravado no item."""
+        product_id = str(item.get("product_id") or "")
+        if product_id.isdigit():
+            product = self.catalog.products_by_id.get(int(product_id))
+            if product and product.category_id: return self._sector_of_category(product.category_id)
+
+        for key in ("external_code", "externalCode", "code"):
+            code = item.get(key)
+            if not code: continue
+            product = self.catalog.products_by_code.get(str(code))
+            if product and product.category_id: return self._sector_of_category(product.category_id)
+
+        return self._sector_by_name(item.get("title") or item.get("name"))
+
+
+def get_sector_classifier(db, store_id: int) -> SectorClassifier:
+    """Classificador da loja (reaproveitado enquanto o snapshot do catálogo for o mesmo)."""
+    catalog = get_catalog(db, store_id)
+    if catalog.sector_classifier is None:
+        catalog.sector_classifier = SectorClassifier(catalog)
+    return catalog.sector_classifier
+
+
+# --- GRAVAÇÃO NA ENTRADA DO PEDIDO ---
+
+def stamp_item_sectors(db, store_id: int, items):
+    """
+    Grava sector_id (e product_id, quando o código/nome bate exato com o catálogo)
+    em cada item. Altera a lista no lugar; sub-produtos agrupados (Wabiz) também.
+    """
+    if not items: return items
+    classifier = get_sector_classifier(db, store_id)
+    catalog = classifier.catalog
+
+    def stamp(item):
+        if not isinstance(item, dict): return
+        item["sector_id"] = classifier.classify(item)
+        if not item.get("product_id"):
+            code = item.get("external_code") or item.get("externalCode") or item.get("code")
+            product = catalog.resolve_product(None, str(code or ""), str(item.get("title") or item.get("name") or "").strip())
+            if product: item["product_id"] = product.id
+
+    for item in items:
+        stamp(item)
+        for sub in (item.get("products") or []) if isinstance(item, dict) else []:
+            stamp(sub)
+    return items
+
+
+def backfill_item_sectors(db, store_id: int = None) -> int:
+    """Grava o setor nos itens dos pedidos em aberto que ainda não têm. Retorna quantos pedidos mudaram."""
+    query = db.query(Order).filter(
+        not_(Order.status.in_(["ENTREGUE", "CONCLUIDO"])),
+        or_(Order.status == None, not_(Order.status.ilike("%CANCELADO%"))),
+    )
+    if store_id: query = query.filter(Order.store_id == store_id)
+
+    changed = 0
+    for order in query.all():
+        items = order.items_json
+        if not isinstance(items, list) or not items: continue
+        if all(isinstance(i, dict) and "sector_id" in i for i in items): continue
+        items = copy.deepcopy(items)
+        order.items_json = stamp_item_sectors(db, order.store_id, items)
+        flag_modified(order, "items_json")
+        changed += 1
+    db.commit()
+    return changed
@@ -1,36 +1,219 @@
+import json
+import time
+import asyncio
+from collections import deque
 from typing import List, Dict
 from fastapi import WebSocket
+import redis.asyncio as aioredis
+
+from services.cache import REDIS_URL, get_redis, mark_redis_down
+
+# ==========================================
+#     BARRAMENTO DE EVENTOS (REDIS PUB/SUB)
+# ==========================================
+# Cada worker do uvicorn só enxerga os websockets que ele mesmo aceitou.
+# Por isso todo broadcast é PUBLICADO no Redis, e cada worker (inscrito no canal)
+# repassa para os seus sockets locais. Assim o robô (run_robot.py), o Celery ou
+# qualquer worker alcançam todas as telas da loja.
+# Sem Redis, o broadcast cai para entrega local (comportamento antigo).
+
+STORE_EVENTS_CHANNEL = "pizzaria:store_events"
+
+
+def publish_store_event(store_id: int, message: str) -> bool:
+    """
+    Versão SÍNCRONA para processos fora da API (robô, Celery, outbox).
+    Retorna False se o Redis não estiver disponível.
+    """
+    r = get_redis()
+    if r is None: return False
+    try:
+        r.publish(STORE_EVENTS_CHANNEL, json.dumps({"store_id": store_id, "message": message}))
+        return True
+    except Exception as e:
+        mark_redis_down(e)
+        return False
+
+
+# --- ENVIO CONCORRENTE COM CONTROLE DE FILA ---
+# Cada socket tem sua própria fila de saída e sua própria task de envio.
+# Um tablet travado no Wi-Fi da cozinha só atrasa a fila DELE: os outros recebem na hora.
+SEND_TIMEOUT = 3.0      # Segundos para um send_text; passou disso o socket é derrubado
+PEER_QUEUE_MAX = 32     # Fila cheia = descarta a mensagem mais antiga
+# Sinais "vazios" (a tela vai recarregar de qualquer jeito): um pendente na fila já basta
+COALESCE_MESSAGES = {"update", "new_order", "cash_update"}
+
+
+class _Peer:
+    """Um websocket conectado + fila de saída + task que envia."""
+    __slots__ = ("ws", "store_id", "queue", "wakeup", "task")
+
+    def __init__(self, ws: WebSocket, store_id: int):
+        self.ws = ws
+        self.store_id = store_id
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+
+class _StoreMetrics:
+    __slots__ = ("sent", "dropped", "coalesced", "evicted", "latencies")
+
+    def __init__(self):
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self.latencies = deque(maxlen=200)  # Últimas latências de envio (ms)
+
 
 class ConnectionManager:
     def __init__(self):
         # Dicionário: { store_id: [lista_de_sockets_conectados] }
         self.active_connections: Dict[int, List[WebSocket]] = {}
+        self._peers: Dict[WebSocket, _Peer] = {}
+        self._metrics: Dict[int, _StoreMetrics] = {}
+        self._redis = None
+        self._listener_task = None
+        self.listening = False  # True quando a inscrição no canal está ativa
 
     async def connect(self, websocket: WebSocket, store_id: int):
         await websocket.accept()
         if store_id not in self.active_connections:
             self.active_connections[store_id] = []
         self.active_connections[store_id].append(websocket)
+        peer = _Peer(websocket, store_id)
+        peer.task = asyncio.create_task(self._sender(peer))
+        self._peers[websocket] = peer
         print(f"🔌 [Socket] KDS conectado na Loja {store_id}")
 
     def disconnect(self, websocket: WebSocket, store_id: int):
+        peer = self._peers.pop(websocket, None)
+        if peer and peer.task and peer.task is not asyncio.current_task():
+            peer.task.cancel()
         if store_id in self.active_connections:
             if websocket in self.active_connections[store_id]:
                 self.active_connections[store_id].remove(websocket)
                 print(f"🔌 [Socket] KDS desconectado da Loja {store_id}")
 
     async def broadcast(self, store_id: int, message: str):
-        """Envia mensagem para TODOS os KDS dessa loja"""
-        if store_id in self.active_connections:
-            # Copia a lista para evitar erro de modificação durante iteração
-            connections = self.active_connections[store_id][:]
-            for connection in connections:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    # Se der erro (ex: fechou navegador), remove da lista
-                    print(f"⚠️ Erro ao enviar socket: {e}")
-                    self.disconnect(connection, store_id)
+        """Envia mensagem para TODOS os KDS dessa loja (em todos os workers)"""
+        if self.listening:
+            try:
+                await self._get_redis().publish(
+                    STORE_EVENTS_CHANNEL, json.dumps({"store_id": store_id, "message": message})
+                )
+                return  # O próprio listener deste worker entrega localmente
+            except Exception as e:
+                print(f"⚠️ [Socket] Falha ao publicar no Redis, entregando só neste worker: {e}")
+        await self.broadcast_local(store_id, message)
+
+    async def broadcast_local(self, store_id: int, message: str):
+        """
+        Entrega apenas para os sockets conectados NESTE processo.
+        Não espera o envio: só coloca na fila de cada socket (retorna na hora).
+        """
+        metrics = self._metrics.setdefault(store_id, _StoreMetrics())
+        for websocket in self.active_connections.get(store_id, [])[:]:
+            peer = self._peers.get(websocket)
+            if not peer: continue
+
+            if message in COALESCE_MESSAGES and message in peer.queue:
+                metrics.coalesced += 1
+                continue
+            if len(peer.queue) >= PEER_QUEUE_MAX:
+                peer.queue.popleft()
+                metrics.dropped += 1
+            peer.queue.append(message)
+            peer.wakeup.set()
+
+    async def _sender(self, peer: _Peer):
+        metrics = self._metrics.setdefault(peer.store_id, _StoreMetrics())
+        try:
+            while True:
+                await peer.wakeup.wait()
+                peer.wakeup.clear()
+                while peer.queue:
+                    message = peer.queue.popleft()
+                    started = time.perf_counter()
+                    try:
+                        await asyncio.wait_for(peer.ws.send_text(message), SEND_TIMEOUT)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # Timeout ou socket morto: derruba para não acumular fila
+                        print(f"⚠️ Erro ao enviar socket (Loja {peer.store_id}): {str(e) or 'timeout'}")
+                        metrics.evicted += 1
+                        self.disconnect(peer.ws, peer.store_id)
+                        try: await peer.ws.close()
+                        except Exception: pass
+                        return
+                    metrics.sent += 1
+                    metrics.latencies.append((time.perf_counter() - started) * 1000)
+        except asyncio.CancelledError:
+            pass
+
+    def get_metrics(self):
+        """Resumo por loja: conexões ativas, envios, descartes e latência (ms)."""
+        report = {}
+        for store_id in set(self.active_connections) | set(self._metrics):
+            m = self._metrics.get(store_id) or _StoreMetrics()
+            lat = sorted(m.latencies)
+            report[store_id] = {
+                "connections": len(self.active_connections.get(store_id, [])),
+                "sent": m.sent,
+                "dropped": m.dropped,
+                "coalesced": m.coalesced,
+                "evicted": m.evicted,
+                "latency_avg_ms": round(sum(lat) / len(lat), 2) if lat else 0,
+                "latency_p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 2) if lat else 0,
+                "latency_max_ms": round(lat[-1], 2) if lat else 0,
+            }
+        return report
+
+    # --- INSCRIÇÃO NO CANAL ---
+    def _get_redis(self):
+        if self._redis is None:
+            self._redis = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+        return self._redis
+
+    def start_listener(self):
+        """Chamado no startup da API. Sobe a task que escuta o canal de eventos."""
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen_forever())
+
+    async def stop_listener(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            self._listener_task = None
+        self.listening = False
+
+    async def _listen_forever(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._get_redis().pubsub()
+                await pubsub.subscribe(STORE_EVENTS_CHANNEL)
+                self.listening = True
+                print("📡 [Socket] Inscrito no barramento de eventos (Redis).")
+                async for item in pubsub.listen():
+                    if item.get("type") != "message": continue
+                    try:
+                        event = json.loads(item["data"])
+                        await self.broadcast_local(int(event["store_id"]), event["message"])
+                    except Exception as e:
+                        print(f"⚠️ [Socket] Evento inválido no barramento: {e}")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.listening = False
+                print(f"⚠️ [Socket] Barramento Redis indisponível ({e}). Tentando de novo em 5s...")
+                await asyncio.sleep(5)
+            finally:
+                self.listening = False
+                if pubsub is not None:
+                    try: await pubsub.close()
+                    except Exception: pass
 
 # Instância Global (Singleton)
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
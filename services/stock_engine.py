@@ -1,21 +1,22 @@
 # Arquivo: pizzaria/services/stock_engine.py
 
-from sqlalchemy import or_, func
+from sqlalchemy import func, update, insert
 from sqlalchemy.orm import Session
 # ADICIONADO: InventoryCategory no import
 from models import (
-    Product, ProductMapping, Ingredient, PizzaBaseRecipe, ProductRecipe, 
-    Category, PizzaSize, ProductAddon, AddonPrice, InventoryUnit, 
+    Product, ProductMapping, Ingredient,
+    Category, ProductAddon, InventoryUnit, 
     InventoryCategory, StockLog
 )
+from services.catalog import get_catalog, invalidate_catalog
 
 # ==========================================
 #          RESOLUÇÃO DE PRODUTOS
 # ==========================================
 
-def _resolve_product(db, store_id, item_data, integration_source):
+def _resolve_product(catalog, item_data):
     """
-    Localiza o produto no banco de dados.
+    Localiza o produto no snapshot do catálogo (services/catalog.py).
     ESTRATÉGIA BLINDADA:
     1. ID Interno (Prioridade Absoluta - Vem do PDV).
     2. Código Externo (Integrações).
@@ -39,41 +40,22 @@ def _resolve_product(db, store_id, item_data, integration_source):
     elif isinstance(item_data, str):
         name = item_data.strip()
 
-    # 1. VIA EXPRESSA: ID INTERNO
-    if prod_id:
-        product = db.query(Product).filter(Product.id == prod_id, Product.store_id == store_id).first()
-        if product:
-            return product
+    return catalog.resolve_product(prod_id, ext_code, name)
 
-    # 2. BUSCA POR CÓDIGO EXTERNO
-    if ext_code:
-        mapping = db.query(ProductMapping).filter(
-            ProductMapping.store_id == store_id,
-            ProductMapping.external_code == ext_code
-        ).first()
-        if mapping: return mapping.product
-        return None
 
-    # 3. BUSCA POR NOME
-    if name:
-        return db.query(Product).filter(
-            Product.store_id == store_id, 
-            Product.name.ilike(name)
-        ).first()
-        
-    return None
+def _detect_pizza_size(catalog, item_title, parts):
+    """Tamanho pelo título, depois pelos sabores, e por fim o maior tamanho da loja."""
+    size_obj = catalog.detect_size(item_title)
 
+    if not size_obj and parts:
+        for p_data in parts:
+            p_name = p_data.get('name') if isinstance(p_data, dict) else p_data
+            size_obj = catalog.detect_size(p_name)
+            if size_obj: break
 
-def _detect_size_from_text(db: Session, store_id: int, text_to_search: str):
-    if not text_to_search: return None
-    all_sizes = db.query(PizzaSize).filter(PizzaSize.store_id == store_id).all()
-    text_lower = text_to_search.lower()
-    best_match = None
-    for size in all_sizes:
-        if size.name.lower() in text_lower:
-            if best_match is None or len(size.name) > len(best_match.name):
-                best_match = size
-    return best_match
+    if not size_obj:
+        size_obj = catalog.default_size()
+    return size_obj
 
 
 # ==========================================
@@ -118,6 +100,7 @@ def auto_learn_product(db: Session, store_id: int, item_data: dict, integration_
                             integration_type=source_clean, external_code=external_code
                         )
                         db.add(new_map); db.commit()
+                        invalidate_catalog(store_id)
                     except: db.rollback()
             return product_found
 
@@ -134,6 +117,7 @@ def auto_learn_product(db: Session, store_id: int, item_data: dict, integration_
                     integration_type=source_clean, external_code=external_code
                 )
                 db.add(new_map); db.commit()
+                invalidate_catalog(store_id)
             except: db.rollback()
         return product
     
@@ -143,153 +127,198 @@ def auto_learn_product(db: Session, store_id: int, item_data: dict, integration_
 # ==========================================
 #          BAIXA DE ESTOQUE
 # ==========================================
+# Toda a resolução (produto, tamanho, fichas técnicas) vem do snapshot em memória.
+# O banco só é tocado no StockMovementBatch.flush(), para gravar saldo e Kardex.
 
-def deduct_stock_from_order(db: Session, store_id: int, items: list, integration_source: str = "manual"):
+def deduct_stock_from_order(db: Session, store_id: int, items: list, integration_source: str = "manual", batch: "StockMovementBatch" = None):
+    """
+    Sem 'batch': grava e comita ao final deste pedido.
+    Com 'batch': só acumula; quem chamou faz batch.flush(db) + commit (lote de pedidos).
+    """
     print(f"📉 [Estoque] Processando {len(items)} itens via {integration_source}...")
+    catalog = get_catalog(db, store_id)
+    own_batch = batch is None
+    if own_batch: batch = StockMovementBatch(store_id)
 
     for item in items:
         qty_sold = float(item.get("quantity", 1))
         parts = item.get("parts", [])   
         addons = item.get("addons", []) 
         
-        product = _resolve_product(db, store_id, {
+        product = _resolve_product(catalog, {
             "name": item.get("title", ""),
             "external_code": item.get("external_code"),
             "product_id": item.get("product_id")
-        }, integration_source)
+        })
 
         removed_ids = item.get("removed_ingredients", [])
 
         # CASO A: PIZZA
         if product and product.is_pizza:
             item_title = item.get("title", "")
-            size_obj = _detect_size_from_text(db, store_id, item_title)
-
-            if not size_obj and parts:
-                for p_data in parts:
-                    p_name = p_data.get('name') if isinstance(p_data, dict) else p_data
-                    size_obj = _detect_size_from_text(db, store_id, p_name)
-                    if size_obj: break
-            
-            if not size_obj:
-                size_obj = db.query(PizzaSize).filter(PizzaSize.store_id == store_id).order_by(PizzaSize.slices.desc()).first()
+            size_obj = _detect_pizza_size(catalog, item_title, parts)
 
             # Base
             if size_obj:
-                base_query = db.query(PizzaBaseRecipe).filter(
-                    PizzaBaseRecipe.store_id == store_id,
-                    PizzaBaseRecipe.base_type == product.base_type,
-                    or_(PizzaBaseRecipe.size_id == size_obj.id, PizzaBaseRecipe.size_slug == size_obj.slug)
-                )
-                for base in base_query.all():
-                    if base.ingredient:
-                        _execute_stock_movement(db, store_id, base.ingredient, base.quantity * qty_sold, "OUT", f"Venda {item_title[:15]}")
+                for base in catalog.base_recipe(product.base_type, size_obj):
+                    _execute_stock_movement(batch, base.ingredient, base.quantity * qty_sold, "OUT", f"Venda {item_title[:15]}")
 
             # Sabores
             if parts:
                 fraction = 1.0 / len(parts)
                 for part_data in parts:
-                    _process_recursive_item(db, store_id, part_data, qty_sold * fraction, integration_source, size_obj, removed_ids, is_pizza_part=True)
+                    _process_recursive_item(batch, catalog, part_data, qty_sold * fraction, size_obj, removed_ids, is_pizza_part=True)
             else:
-                _process_recursive_item(db, store_id, {
+                _process_recursive_item(batch, catalog, {
                     "external_code": item.get("external_code"), 
                     "product_id": item.get("product_id"),
                     "name": item.get("title")
-                }, qty_sold, integration_source, size_obj, removed_ids, is_pizza_part=True)
+                }, qty_sold, size_obj, removed_ids, is_pizza_part=True)
 
             # Bordas/Extras
             for addon_data in addons:
-                _process_recursive_item(db, store_id, addon_data, qty_sold, integration_source, size_obj, removed_ids, is_addon=True)
+                _process_recursive_item(batch, catalog, addon_data, qty_sold, size_obj, removed_ids, is_addon=True)
 
         # CASO B: PRODUTO COMUM
         elif product:
-            _deduct_recipe(db, store_id, product, qty_sold, removed_ids)
+            _deduct_recipe(batch, product, qty_sold, removed_ids)
             all_subs = parts + addons
             for sub in all_subs:
-                _process_recursive_item(db, store_id, sub, qty_sold, integration_source, None, [])
+                _process_recursive_item(batch, catalog, sub, qty_sold, None, [])
 
-    db.commit()
+    if own_batch:
+        batch.flush(db)
+        db.commit()
 
 
-def _process_recursive_item(db, store_id, item_data, parent_qty, source, size_obj=None, removed_ids=[], is_pizza_part=False, is_addon=False):
+def _process_recursive_item(batch, catalog, item_data, parent_qty, size_obj=None, removed_ids=[], is_pizza_part=False, is_addon=False):
     if isinstance(item_data, str): item_data = {"name": item_data}
 
-    product = _resolve_product(db, store_id, item_data, source)
+    product = _resolve_product(catalog, item_data)
     
     addon_obj = None
     if is_addon and not product:
         ext_code = str(item_data.get('external_code') or '').strip()
         if ext_code and ext_code != 'None':
-            ap = db.query(AddonPrice).filter(AddonPrice.external_code == ext_code).first()
-            if ap: addon_obj = ap.addon
+            addon_obj = catalog.addons_by_code.get(ext_code)
 
     qty_item = float(item_data.get('quantity', 1)) * parent_qty
 
     if product:
         if is_pizza_part:
-            recipes = []
-            if size_obj:
-                recipes = db.query(ProductRecipe).filter(ProductRecipe.product_id == product.id, ProductRecipe.size_id == size_obj.id).all()
-            if not recipes:
-                recipes = db.query(ProductRecipe).filter(ProductRecipe.product_id == product.id, ProductRecipe.size_id == None).all()
-            
-            for r in recipes:
-                if r.ingredient and r.ingredient.id not in removed_ids:
+            for r in catalog.flavor_recipe(product.id, size_obj):
+                if r.ingredient.id not in removed_ids:
                     size_factor = size_obj.recipe_multiplier if (size_obj and not r.size_id) else 1.0
-                    _execute_stock_movement(db, store_id, r.ingredient, r.quantity * qty_item * size_factor, "OUT", f"Venda {product.name}")
+                    _execute_stock_movement(batch, r.ingredient, r.quantity * qty_item * size_factor, "OUT", f"Venda {product.name}")
         else:
-            _deduct_recipe(db, store_id, product, qty_item, removed_ids)
+            _deduct_recipe(batch, product, qty_item, removed_ids)
 
     elif addon_obj and size_obj:
-        addon_price = db.query(AddonPrice).filter(AddonPrice.addon_id == addon_obj.id, AddonPrice.size_id == size_obj.id).first()
-        if addon_price:
-            for r in addon_price.recipe_items:
-                if r.ingredient:
-                    _execute_stock_movement(db, store_id, r.ingredient, r.quantity * qty_item, "OUT", f"Venda {addon_obj.name}")
+        addon_lines = catalog.addon_recipe(addon_obj.id, size_obj.id)
+        if addon_lines:
+            for r in addon_lines:
+                _execute_stock_movement(batch, r.ingredient, r.quantity * qty_item, "OUT", f"Venda {addon_obj.name}")
 
     sub_items = item_data.get('sub_items', [])
     if sub_items:
         for sub in sub_items:
-            _process_recursive_item(db, store_id, sub, qty_item, source, None, [])
+            _process_recursive_item(batch, catalog, sub, qty_item, None, [])
 
 
-def _deduct_recipe(db, store_id, product, qty, removed_ids):
+def _deduct_recipe(batch, product, qty, removed_ids):
     for r in product.recipe_items:
-        if r.ingredient and r.ingredient.id not in removed_ids:
-            _execute_stock_movement(db, store_id, r.ingredient, r.quantity * qty, "OUT", f"Venda {product.name}")
+        if r.ingredient.id not in removed_ids:
+            _execute_stock_movement(batch, r.ingredient, r.quantity * qty, "OUT", f"Venda {product.name}")
 
 
-def _execute_stock_movement(db, store_id, ingredient, quantity_needed, type, reason):
-    factor = ingredient.conversion_factor if (ingredient.conversion_factor and ingredient.conversion_factor > 0) else 1.0
-    real_deduct = quantity_needed / factor
-    old_stock = ingredient.current_stock
-    
-    if type == "OUT":
-        ingredient.current_stock -= real_deduct
-    else:
-        ingredient.current_stock += real_deduct
-        
-    log = StockLog(
-        store_id=store_id, ingredient_id=ingredient.id, movement_type=type,
-        quantity=real_deduct, old_stock=old_stock, new_stock=ingredient.current_stock,
-        cost_at_time=ingredient.cost, reason=reason, user_name="Sistema Auto"
-    )
-    db.add(log)
+def _execute_stock_movement(batch, ingredient, quantity_needed, type, reason):
+    # Só acumula: a gravação acontece de uma vez em StockMovementBatch.flush()
+    batch.add(ingredient, quantity_needed, type, reason)
+
+
+class StockMovementBatch:
+    """
+    Acumulador de movimentações de estoque.
+    O mesmo insumo (mussarela, massa...) aparece várias vezes num pedido; aqui
+    somamos o delta por ingrediente e no flush fazemos UM UPDATE atômico por
+    ingrediente (current_stock = current_stock - x) + um INSERT em lote no Kardex.
+    Pode ser usado para um pedido ou compartilhado entre vários pedidos.
+    """
+
+    def __init__(self, store_id: int, user_name: str = "Sistema Auto"):
+        self.store_id = store_id
+        self.user_name = user_name
+        self.deltas = {}    # ingredient_id -> delta (já convertido pelo fator)
+        self.lines = []     # (ingredient_id, type, quantidade, custo, motivo)
+
+    def add(self, ingredient, quantity_needed, type, reason):
+        factor = ingredient.conversion_factor if (ingredient.conversion_factor and ingredient.conversion_factor > 0) else 1.0
+        real_qty = quantity_needed / factor
+        signed = -real_qty if type == "OUT" else real_qty
+        self.deltas[ingredient.id] = self.deltas.get(ingredient.id, 0.0) + signed
+        self.lines.append((ingredient.id, type, real_qty, ingredient.cost, reason))
+
+    def flush(self, db: Session):
+        """Aplica os deltas no banco (sem commit). Retorna quantos insumos foram atualizados."""
+        if not self.deltas: return 0
+
+        final_stock = {}
+        # Ordem fixa de IDs: dois pedidos simultâneos travam as linhas na mesma ordem (sem deadlock)
+        for ing_id in sorted(self.deltas):
+            delta = self.deltas[ing_id]
+            new_stock = db.execute(
+                update(Ingredient)
+                .where(Ingredient.id == ing_id)
+                .values(current_stock=func.coalesce(Ingredient.current_stock, 0.0) + delta)
+                .returning(Ingredient.current_stock)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            if new_stock is not None:
+                # Saldo antes do lote = saldo retornado - delta (a linha está travada até o commit)
+                final_stock[ing_id] = new_stock - delta
+
+        # Kardex: reconstrói old/new de cada linha a partir do saldo real do banco
+        running = dict(final_stock)
+        logs = []
+        for ing_id, type, real_qty, cost, reason in self.lines:
+            if ing_id not in running: continue
+            old_stock = running[ing_id]
+            new_stock = old_stock - real_qty if type == "OUT" else old_stock + real_qty
+            running[ing_id] = new_stock
+            logs.append({
+                "store_id": self.store_id, "ingredient_id": ing_id, "movement_type": type,
+                "quantity": real_qty, "old_stock": old_stock, "new_stock": new_stock,
+                "cost_at_time": cost, "reason": reason, "user_name": self.user_name,
+            })
+        if logs:
+            db.execute(insert(StockLog), logs)  # executemany
+
+        # Objetos Ingredient já carregados nesta sessão ficaram com saldo velho
+        for obj in list(db.identity_map.values()):
+            if isinstance(obj, Ingredient) and obj.id in final_stock:
+                db.expire(obj, ["current_stock"])
+
+        count = len(final_stock)
+        self.deltas = {}
+        self.lines = []
+        return count
 
     
 def return_stock_from_order(db: Session, store_id: int, items: list, integration_source: str = "manual"):
     print(f"🔄 [Estoque] Estornando {len(items)} itens (Fonte: {integration_source})...")
+    catalog = get_catalog(db, store_id)
+    batch = StockMovementBatch(store_id)
 
     for item in items:
         qty_sold = float(item.get("quantity", 1))
         parts = item.get("parts", [])
         addons = item.get("addons", [])
         
-        product = _resolve_product(db, store_id, {
+        product = _resolve_product(catalog, {
             "name": item.get("title", "").split("(")[0].strip(),
             "external_code": item.get("external_code"),
             "product_id": item.get("product_id")
-        }, integration_source)
+        })
 
         if not product: continue
 
@@ -297,31 +326,11 @@ def return_stock_from_order(db: Session, store_id: int, items: list, integration
 
         if product.is_pizza:
             item_title = item.get("title", "")
-            size_obj = _detect_size_from_text(db, store_id, item_title)
-
-            if not size_obj and parts:
-                for p_data in parts:
-                    p_name = p_data.get('name') if isinstance(p_data, dict) else p_data
-                    size_obj = _detect_size_from_text(db, store_id, p_name)
-                    if size_obj: break
-
-            if not size_obj:
-                size_obj = db.query(PizzaSize).filter(PizzaSize.store_id == store_id).order_by(PizzaSize.slices.desc()).first()
+            size_obj = _detect_pizza_size(catalog, item_title, parts)
 
             # 1. Estorno da Base
-            base_query = db.query(PizzaBaseRecipe).filter(
-                PizzaBaseRecipe.store_id == store_id,
-                PizzaBaseRecipe.base_type == product.base_type
-            )
-            if size_obj:
-                base_query = base_query.filter(or_(
-                    PizzaBaseRecipe.size_id == size_obj.id,
-                    PizzaBaseRecipe.size_slug == size_obj.slug
-                ))
-
-            for base in base_query.all():
-                if base.ingredient:
-                    _execute_stock_movement(db, store_id, base.ingredient, base.quantity * qty_sold, "IN", f"Estorno {item_title[:20]}")
+            for base in catalog.base_recipe(product.base_type, size_obj):
+                _execute_stock_movement(batch, base.ingredient, base.quantity * qty_sold, "IN", f"Estorno {item_title[:20]}")
 
             # 2. Estorno dos Sabores
             flavors_to_return = []
@@ -329,39 +338,28 @@ def return_stock_from_order(db: Session, store_id: int, items: list, integration
                 fraction = 1.0 / len(parts)
                 for part_data in parts:
                     if isinstance(part_data, str): part_data = {"name": part_data}
-                    p_part = _resolve_product(db, store_id, part_data, integration_source)
+                    p_part = _resolve_product(catalog, part_data)
                     if p_part:
                         flavors_to_return.append((p_part, fraction))
             else:
                 flavors_to_return.append((product, 1.0))
 
             for p_obj, mult in flavors_to_return:
-                recipes = []
-                if size_obj:
-                    recipes = db.query(ProductRecipe).filter(
-                        ProductRecipe.product_id == p_obj.id,
-                        ProductRecipe.size_id == size_obj.id
-                    ).all()
-                if not recipes:
-                    recipes = db.query(ProductRecipe).filter(
-                        ProductRecipe.product_id == p_obj.id,
-                        ProductRecipe.size_id == None
-                    ).all()
-
-                for r in recipes:
-                    if r.ingredient and r.ingredient.id not in removed_ids:
+                for r in catalog.flavor_recipe(p_obj.id, size_obj):
+                    if r.ingredient.id not in removed_ids:
                         size_factor = size_obj.recipe_multiplier if (size_obj and not r.size_id) else 1.0
                         raw_qty = r.quantity * qty_sold * mult * size_factor
-                        _execute_stock_movement(db, store_id, r.ingredient, raw_qty, "IN", f"Estorno Pizza {p_obj.name}")
+                        _execute_stock_movement(batch, r.ingredient, raw_qty, "IN", f"Estorno Pizza {p_obj.name}")
 
             # 3. Estorno de Bordas/Extras
             # (Mantido como estava, pois usa a lógica interna do _execute)
 
         else:
             for recipe in product.recipe_items:
-                if recipe.ingredient and recipe.ingredient.id not in removed_ids:
-                    _execute_stock_movement(db, store_id, recipe.ingredient, recipe.quantity * qty_sold, "IN", f"Estorno {product.name}")
+                if recipe.ingredient.id not in removed_ids:
+                    _execute_stock_movement(batch, recipe.ingredient, recipe.quantity * qty_sold, "IN", f"Estorno {product.name}")
 
+    batch.flush(db)
     db.commit()
 
 
@@ -417,6 +415,7 @@ def enrich_order_with_combo_data(db: Session, store_id: int, items: list):
     Isso garante que KDS e Impressora recebam os dados prontos.
     """
     if not items: return
+    catalog = get_catalog(db, store_id)
 
     for item in items:
         # Se já tem detalhes (ex: cliente escolheu sabores no iFood), não mexe
@@ -424,7 +423,7 @@ def enrich_order_with_combo_data(db: Session, store_id: int, items: list):
             continue
             
         # 1. Identifica o Produto
-        product = _resolve_product(db, store_id, item, "internal")
+        product = _resolve_product(catalog, item)
         
         # 2. Se for COMBO FIXO (tem itens configurados)
         if product and product.combo_items and len(product.combo_items) > 0:
@@ -435,7 +434,7 @@ def enrich_order_with_combo_data(db: Session, store_id: int, items: list):
                 qty = float(child_ref.get('qty', 1))
                 
                 # Busca nome do filho para ficar bonito na tela
-                child_prod = db.query(Product).get(child_id)
+                child_prod = catalog.products_by_id.get(child_id) or db.query(Product).get(child_id)
                 child_name = child_prod.name if child_prod else "Item do Combo"
                 
                 # Gera o objeto de detalhe padrão
@@ -0,0 +1,89 @@
+# Arquivo: pizzaria/services/store_version.py
+import time
+import zlib
+from fastapi import Response
+
+from services.cache import get_redis, mark_redis_down
+
+# ==========================================
+#   VERSÃO DA LOJA (ETag / 304 NO POLLING)
+# ==========================================
+# Painel, KDS e "motoboys ao vivo" fazem polling e quase sempre recebem a mesma
+# resposta. Toda gravação de pedido, caixa ou sessão de motoboy (hooks em models.py)
+# incrementa um contador por loja no Redis (store:{loja}:version). As rotas de
+# polling montam o ETag com ele; se o navegador mandar o mesmo ETag no If-None-Match,
+# respondemos 304 sem consultar o banco.
+#
+# Não é a mesma sequência dos deltas (store:{loja}:seq): aquela não pode ter buracos,
+# senão a tela ressincroniza à toa.
+#
+# O ETag também "vira" a cada minuto, porque os cards mostram minutos decorridos.
+# Sem Redis não há ETag (a escrita feita pelo robô não seria vista pelos workers).
+
+ETAG_TIME_BUCKET = 60
+
+
+def _key(store_id):
+    return f"store:{store_id}:version"
+
+
+def bump_store_versions(store_ids):
+    """Chamado DEPOIS do commit (models.py ou rotas com UPDATE em massa)."""
+    store_ids = {s for s in store_ids if s}
+    if not store_ids: return
+    r = get_redis()
+    if r is None: return
+    try:
+        pipe = r.pipeline()
+        for store_id in store_ids:
+            pipe.incr(_key(store_id))
+        pipe.execute()
+    except Exception as e:
+        mark_redis_down(e)
+
+
+def store_version(store_id: int):
+    """Versão atual da loja, ou None se o Redis não estiver disponível."""
+    r = get_redis()
+    if r is None: return None
+    try:
+        return int(r.get(_key(store_id)) or 0)
+    except Exception as e:
+        mark_redis_down(e)
+        return None
+
+
+def store_etag(request, store_id: int, user_id=None):
+    """ETag da resposta: versão da loja + minuto + rota/parâmetros/usuário."""
+    version = store_version(store_id)
+    if version is None: return None
+    variant = zlib.crc32(f"{request.url.path}?{request.url.query}|{user_id}".encode())
+    bucket = int(time.time() // ETAG_TIME_BUCKET)
+    return f'W/"{store_id}-{version}-{bucket}-{variant:x}"'
+
+
+def check_not_modified(request, response, store_id: int, user_id=None, seq=None):
+    """
+    Uso no começo da rota (ANTES de qualquer consulta):
+        not_modified = check_not_modified(request, response, store_id, user.id)
+        if not_modified: return not_modified
+    Retorna um 304 pronto, ou None (e deixa o ETag no `response` da rota).
+
+    `seq` = sequência de deltas da loja lida ANTES desta chamada. Vai no X-Store-Seq
+    do 200 e também do 304: a sequência anda sem mudar a versão (ex.: delta do outbox
+    de um pedido já gravado), e o navegador atualiza os cabeçalhos da resposta guardada
+    com os do 304. Sem isso a tela ficaria com o seq velho e ressincronizaria à toa.
+    """
+    seq_headers = {"X-Store-Seq": str(seq)} if seq is not None else {}
+    etag = store_etag(request, store_id, user_id)
+    if etag is None:
+        response.headers.update(seq_headers)
+        return None
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", **seq_headers}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -4,6 +4,7 @@ from database import SessionLocal
 from services.whatsapp import send_whatsapp_template
 from models import Store, Customer, Campaign, CampaignLog, Address
 from services.analytics import PizzaBrain
+from services.market_basket import refresh_store_basket
 from datetime import datetime
 
 # Helper para abrir e fechar banco dentro da task
@@ -44,6 +45,19 @@ def task_run_rfm_analysis(store_id: int):
     finally:
         db.close()
 
+@celery_app.task(name="basket_rules_async")
+def task_refresh_basket_rules(store_id: int, force_full: bool = False):
+    """
+    Atualiza as contagens e regras de combos (cesta de compras) de uma loja.
+    """
+    try:
+        result = refresh_store_basket(store_id, force_full)
+        print(f"🛒 [Celery] Cesta da Loja ID {store_id}: {result}")
+        return result
+    except Exception as e:
+        print(f"❌ [Celery] Erro na cesta da Loja ID {store_id}: {e}")
+        return "Erro"
+
 @celery_app.task(name="broadcast_campaign_async")
 def task_process_broadcast(campaign_id: int):
     """
@@ -4,7 +4,7 @@ import pytz
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, or_, desc
-from models import Event, Store, Customer, Address, CashOpening, CashClosing
+from models import Event, Store, Customer, Address
 from services.facebook import send_event_to_facebook, hash_data
 from services.google import send_to_google_analytics
 
@@ -267,22 +267,6 @@ def get_active_cash_id(db, store_id):
     Retorna o ID do caixa ABERTO para a loja.
     Retorna None se estiver fechado ou não existir.
     """
-    # 1. Pega a última abertura
-    last_opening = db.query(CashOpening).filter(
-        CashOpening.store_id == store_id
-    ).order_by(desc(CashOpening.created_at)).first()
-    
-    if not last_opening:
-        return None
-        
-    # 2. Verifica se houve um fechamento posterior
-    last_closing = db.query(CashClosing).filter(
-        CashClosing.store_id == store_id,
-        CashClosing.closed_at > last_opening.created_at
-    ).first()
-    
-    # Se tem fechamento depois da abertura, então está FECHADO.
-    if last_closing:
-        return None
-    
-    return last_opening.id
\ No newline at end of file
+    # Estado em cache (services/cash_state.py), atualizado na abertura/fechamento
+    from services.cash_state import get_cash_state
+    return get_cash_state(db, store_id).opening_id
\ No newline at end of file
@@ -0,0 +1,87 @@
+# Arquivo: pizzaria/tests/test_admin_session.py
+import os
+
+import pytest
+
+if not os.getenv("TEST_DATABASE_URL"):
+    # database.py cria o engine na importação: sem banco de teste, nada aqui roda
+    pytest.skip("TEST_DATABASE_URL não definida (ver tests/conftest.py)", allow_module_level=True)
+
+pytest.importorskip("httpx")  # TestClient do FastAPI
+
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.testclient import TestClient
+
+# Access vencido + refresh válido: o access novo tem que chegar ao navegador mesmo
+# quando a rota devolve a própria resposta (JSONResponse/RedirectResponse/TemplateResponse).
+
+
+@pytest.fixture
+def client(db):
+    from database import get_db
+    from dependencies import check_db_auth, apply_refreshed_session
+    from models import Store, User
+    from routers import auth as auth_router
+    from services import principal_cache
+
+    store = Store(name="Loja Teste", slug="loja-teste-sessao")
+    db.add(store)
+    db.flush()
+    user = User(email="sessao@teste.com", full_name="Dono Teste", role="owner",
+                store_id=store.id, hashed_password="$2b$12$hash-de-teste")
+    db.add(user)
+    db.flush()
+    principal_cache.invalidate_principals()
+
+    app = FastAPI()
+
+    # Mesmo middleware do main.py
+    @app.middleware("http")
+    async def admin_session_cookie(request: Request, call_next):
+        response = await call_next(request)
+        return apply_refreshed_session(request, response)
+
+    @app.get("/json")
+    def json_route(current_user=Depends(check_db_auth)):
+        return JSONResponse(content={"email": current_user.email})
+
+    @app.get("/redirect")
+    def redirect_route(current_user=Depends(check_db_auth)):
+        return RedirectResponse(url="/json", status_code=303)
+
+    app.include_router(auth_router.router)
+    app.dependency_overrides[get_db] = lambda: db
+    with TestClient(app, follow_redirects=False) as c:
+        c.user = user
+        yield c
+
+
+def _refresh_cookie(user):
+    from auth import create_refresh_token
+    return create_refresh_token(user.email, user.hashed_password)
+
+
+@pytest.mark.parametrize("path", ["/json", "/redirect"])
+def test_expired_access_is_renewed_on_own_response(client, path):
+    client.cookies.set("refresh_token", _refresh_cookie(client.user))
+    res = client.get(path)
+    assert res.status_code in (200, 303)
+    assert res.cookies.get("access_token", "").strip('"').startswith("Bearer ")
+
+
+def test_valid_access_does_not_set_cookie(client):
+    from dependencies import _admin_access_token
+    client.cookies.set("access_token", f"Bearer {_admin_access_token(client.user)}")
+    res = client.get("/json")
+    assert res.status_code == 200
+    assert "access_token" not in res.cookies
+
+
+def test_refresh_endpoint(client):
+    assert client.post("/admin/auth/refresh").status_code == 401
+
+    client.cookies.set("refresh_token", _refresh_cookie(client.user))
+    res = client.post("/admin/auth/refresh")
+    assert res.status_code == 200
+    assert res.cookies.get("access_token")
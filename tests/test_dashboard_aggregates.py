@@ -0,0 +1,216 @@
+# Arquivo: pizzaria/tests/test_dashboard_aggregates.py
+import os
+from datetime import datetime, timedelta, time as dtime
+
+import pytest
+
+if not os.getenv("TEST_DATABASE_URL"):
+    # database.py cria o engine na importação: sem banco de teste, nada aqui roda
+    pytest.skip("TEST_DATABASE_URL não definida (ver tests/conftest.py)", allow_module_level=True)
+
+import pytz
+
+# Regressão do dashboard: os agregados no banco (get_kpis, get_customer_intelligence)
+# e os resumos (services/sales_rollup.py) têm que bater com as contas antigas, feitas
+# em Python pedido a pedido. As funções old_* abaixo são cópias das versões antigas.
+
+TZ_BR = pytz.timezone("America/Sao_Paulo")
+
+PAYMENTS = [None, "Todos", "Pix", "Dinheiro", "Cartão", "Inexistente"]
+
+
+# --- IMPLEMENTAÇÕES ANTIGAS (REFERÊNCIA) ---
+
+def old_kpis(brain, start_date=None, end_date=None, payment_method=None):
+    from models import Order
+    orders = brain._apply_filters(brain.db.query(Order), start_date, end_date, payment_method).all()
+    total_revenue = sum(o.total_value or 0 for o in orders)
+    total_orders = len(orders)
+    return total_orders, total_revenue
+
+
+def old_customers(db, store_id, days_lookback=90):
+    from models import Order
+    start_date = datetime.now() - timedelta(days=days_lookback)
+    orders = db.query(Order).filter(Order.store_id == store_id, Order.created_at >= start_date).all()
+
+    customers = {}
+    for o in orders:
+        key = o.customer_phone
+        if not key: continue
+        if key not in customers:
+            customers[key] = {"name": o.customer_name, "count": 0, "total_spent": 0, "last_order": o.created_at}
+        c = customers[key]
+        c["count"] += 1
+        c["total_spent"] += float(o.total_value or 0)
+        if o.created_at > c["last_order"]: c["last_order"] = o.created_at
+    return customers
+
+
+def old_heatmap(brain, start_date=None, end_date=None):
+    from models import Order
+    orders = brain._apply_filters(brain.db.query(Order), start_date, end_date).all()
+    heatmap = [[0 for _ in range(24)] for _ in range(7)]
+    for o in orders:
+        if not o.created_at: continue
+        local = pytz.utc.localize(o.created_at).astimezone(TZ_BR)
+        heatmap[local.weekday()][local.hour] += 1
+    return heatmap
+
+
+def old_top_products(brain, start_date=None, end_date=None, payment_method=None):
+    from models import Order
+    from services.sales_rollup import item_sale
+    product_map = {}
+    for o in brain._apply_filters(brain.db.query(Order), start_date, end_date, payment_method).all():
+        for item in o.items_json if isinstance(o.items_json, list) else []:
+            name, qty, revenue = item_sale(item)
+            row = product_map.setdefault(name, {"qty": 0.0, "revenue": 0.0})
+            row["qty"] += qty
+            row["revenue"] += revenue
+    return product_map
+
+
+# --- DADOS ---
+
+def _utc(day, hour, minute=0):
+    """Horário de Brasília -> UTC sem fuso (como o created_at é gravado)."""
+    local = TZ_BR.localize(datetime.combine(day, dtime(hour, minute)))
+    return local.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _dashboard_range(first_day, last_day):
+    """Mesmo intervalo que o main.py monta: 00:00:00 a 23:59:59 de Brasília, em UTC."""
+    return _utc(first_day, 0), _utc(last_day, 23, 59) + timedelta(seconds=59)
+
+
+@pytest.fixture
+def seeded(db):
+    from models import Store, Order
+
+    store = Store(name="Loja Teste", slug="loja-teste-agregados")
+    other = Store(name="Outra Loja", slug="outra-loja-agregados")
+    db.add_all([store, other])
+    db.flush()
+
+    today = datetime.now(TZ_BR).date()
+    d1, d2, d3 = today - timedelta(days=20), today - timedelta(days=5), today - timedelta(days=1)
+    pizza = {"title": "Pizza Calabresa (G)", "quantity": 1, "price": 50}
+    coca = {"title": "Coca 2L", "quantity": 2, "price": 12.5}
+    broken = {"name": "Esfiha", "quantity": "x", "price": None}
+
+    rows = [
+        # (dia, hora, status, total, pagamento, telefone, nome, itens)
+        (d1, 19, "ENTREGUE", 75.0, "Pix", "11999990001", "Ana", [pizza, coca]),
+        (d1, 23, "ENTREGUE", 50.0, "Dinheiro (Troco p/ 100)", "11999990001", "Ana", [pizza]),
+        (d1, 0, "CONCLUIDO", None, "Cartão de Crédito", "11999990002", "Bruno", [coca]),
+        (d2, 12, "CANCELADO", 999.0, "Pix", "11999990002", "Bruno", [pizza]),
+        (d2, 20, "Cancelado pelo cliente", 10.0, "Pix", "11999990003", "Carla", [coca]),
+        (d2, 21, None, 33.0, "Pix", "11999990003", "Carla", [pizza]),
+        (d2, 21, "PREPARO", 41.5, None, "", "Sem Telefone", [broken]),
+        (d3, 2, "ENTREGUE", 62.25, "iFood - Pix Online", None, "Anônimo", [pizza, broken]),
+        (d3, 22, "ENTREGUE", 18.0, "Dinheiro", "11999990004", "Davi", None),
+    ]
+    for day, hour, status, total, payment, phone, name, items in rows:
+        db.add(Order(
+            store_id=store.id, created_at=_utc(day, hour), status=status, total_value=total,
+            payment_method=payment, customer_phone=phone, customer_name=name, items_json=items,
+        ))
+    # Pedido de outra loja: nunca pode aparecer
+    db.add(Order(store_id=other.id, created_at=_utc(d2, 20), status="ENTREGUE", total_value=500.0,
+                 payment_method="Pix", customer_phone="11999990001", customer_name="Ana", items_json=[pizza]))
+    db.flush()
+    return store, (d1, d2, d3)
+
+
+def _ranges(days):
+    d1, d2, d3 = days
+    return [
+        (None, None),
+        _dashboard_range(d1, d3),
+        _dashboard_range(d2, d2),
+        _dashboard_range(d1 - timedelta(days=1), d1 - timedelta(days=1)),  # Vazio
+    ]
+
+
+def _reset_ready():
+    from services import sales_rollup
+    sales_rollup._ready.clear()
+
+
+# --- TESTES ---
+
+def test_kpis_match_python_loop(db, seeded):
+    from services.analytics import PizzaBrain
+    store, days = seeded
+    _reset_ready()  # Sem resumo: caminho do agregado no banco
+    brain = PizzaBrain(db, store.id)
+
+    for start, end in _ranges(days):
+        for payment in PAYMENTS:
+            expected_orders, expected_revenue = old_kpis(brain, start, end, payment)
+            kpis = brain.get_kpis(start, end, payment)
+            assert kpis["orders"] == expected_orders, (start, end, payment)
+            assert kpis["revenue"] == pytest.approx(expected_revenue), (start, end, payment)
+            expected_ticket = expected_revenue / expected_orders if expected_orders else 0
+            assert kpis["avg_ticket"] == pytest.approx(expected_ticket)
+
+
+def test_customer_intelligence_matches_python_loop(db, seeded):
+    from services.analytics import PizzaBrain
+    store, _ = seeded
+    result = PizzaBrain(db, store.id).get_customer_intelligence()
+    expected = old_customers(db, store.id)
+
+    assert result["total_active"] == len(expected)
+    for customer in result["vips"]:
+        old = expected[customer["phone"]]
+        assert customer["name"] == old["name"]
+        assert customer["orders"] == old["count"]
+        assert customer["spent"] == pytest.approx(old["total_spent"])
+        assert customer["last_order_days"] == (datetime.now() - old["last_order"]).days
+    assert {c["phone"] for c in result["vips"]} == set(expected)
+
+
+def test_rollups_match_raw_orders(db, seeded):
+    from models import SalesRollupState
+    from services import sales_rollup
+    from services.analytics import PizzaBrain
+    store, days = seeded
+
+    for day in days:
+        sales_rollup.rebuild_day(db, store.id, day)
+    db.add(SalesRollupState(store_id=store.id))
+    db.flush()
+    _reset_ready()
+
+    brain = PizzaBrain(db, store.id)
+    for start, end in _ranges(days)[1:]:
+        for payment in PAYMENTS:
+            totals = sales_rollup.sales_totals(db, store.id, start, end, payment)
+            assert totals is not None, "intervalo do dashboard tem que usar o resumo"
+            expected_orders, expected_revenue = old_kpis(brain, start, end, payment)
+            assert totals[0] == expected_orders, (start, end, payment)
+            assert totals[1] == pytest.approx(expected_revenue), (start, end, payment)
+
+            products = sales_rollup.top_products(db, store.id, start, end, payment)
+            expected_products = old_top_products(brain, start, end, payment)
+            assert set(products) == set(expected_products)
+            for name, row in expected_products.items():
+                assert products[name]["qty"] == pytest.approx(row["qty"])
+                assert products[name]["revenue"] == pytest.approx(row["revenue"])
+
+        expected_heatmap = old_heatmap(brain, start, end)
+        assert sales_rollup.sales_heatmap(db, store.id, start, end) == expected_heatmap
+        assert brain._sales_heatmap_sql(start, end) == expected_heatmap
+
+
+def test_default_dashboard_range_uses_rollups():
+    """O padrão do main.py (30 dias a partir do now()) tem que cair em hora cheia."""
+    from services.sales_rollup import _hour_range
+    now_br = datetime.now(TZ_BR)
+    start = TZ_BR.localize(
+        (now_br.replace(tzinfo=None) - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+    ).astimezone(pytz.utc).replace(tzinfo=None)
+    end = TZ_BR.localize(now_br.replace(tzinfo=None).replace(hour=23, minute=59, second=59)).astimezone(pytz.utc).replace(tzinfo=None)
+    assert _hour_range(start, end) is not None
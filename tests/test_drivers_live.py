@@ -0,0 +1,89 @@
+# Arquivo: pizzaria/tests/test_drivers_live.py
+import os
+
+import pytest
+
+if not os.getenv("TEST_DATABASE_URL"):
+    # database.py cria o engine na importação: sem banco de teste, nada aqui roda
+    pytest.skip("TEST_DATABASE_URL não definida (ver tests/conftest.py)", allow_module_level=True)
+
+pytest.importorskip("httpx")  # TestClient do FastAPI
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Rota /admin/api/finance/drivers-live de ponta a ponta (ETag/304 do services/store_version.py).
+# O Redis da versão da loja é trocado por um dicionário: o que se testa é a rota.
+
+URL = "/admin/api/finance/drivers-live"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    from database import get_db
+    from dependencies import check_db_auth
+    from models import Store, User
+    from routers import finance
+    from services import store_version
+
+    store = Store(name="Loja Teste", slug="loja-teste-motoboys")
+    db.add(store)
+    db.flush()
+    owner = User(email="dono@teste.com", full_name="Dono Teste", role="owner", store_id=store.id)
+    driver = User(email="moto@teste.com", full_name="Moto Boy", role="driver", store_id=store.id)
+    db.add_all([owner, driver])
+    db.flush()
+
+    fake = FakeRedis()
+    monkeypatch.setattr(store_version, "get_redis", lambda: fake)
+
+    app = FastAPI()
+    app.include_router(finance.router)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[check_db_auth] = lambda: owner
+    with TestClient(app) as c:
+        c.store_id = store.id
+        yield c
+
+
+def test_drivers_live_without_if_none_match(client):
+    res = client.get(URL)
+    assert res.status_code == 200
+    assert res.headers.get("ETag")
+    body = res.json()
+    assert [d["name"] for d in body] == ["Moto"]
+    assert body[0]["status"] == "Offline"
+
+
+def test_drivers_live_with_if_none_match(client):
+    from services.store_version import bump_store_versions
+
+    etag = client.get(URL).headers["ETag"]
+
+    res = client.get(URL, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+
+    # Gravação na loja muda a versão: o ETag antigo não vale mais
+    bump_store_versions([client.store_id])
+    res = client.get(URL, headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag